@@ -0,0 +1,259 @@
+import hashlib
+import heapq
+import os
+import numpy as np
+from tqdm import tqdm
+
+
+class Hnsw_index:
+    def __init__(self, vectors, links, entry_point, M=16, ef_search=64):
+        """
+        Initializes a hierarchical navigable small world (HNSW) graph over the embeddings of a semantic vector store, for approximate nearest-neighbour search.
+
+        Every vector is a node of layer 0, and of each higher layer with a probability decaying by a factor M per
+        layer. A search descends greedily from the entry point through the sparse upper layers, then explores the
+        ef_search closest nodes found in layer 0, so only a small fraction of the vectors are compared with the
+        query. Indexes are created with ``build`` and stored with ``save``.
+
+        Parameters:
+        - vectors (numpy.ndarray): The float32 embeddings, normalized to unit length, with one row per node.
+        - links (list): The neighbours of the nodes of each layer, as one dictionary per layer mapping a node to the array of its neighbours.
+        - entry_point (int): The node where searches start, in the highest layer.
+        - M (int): The number of neighbours per node in the upper layers; nodes of layer 0 have up to 2M (default is 16).
+        - ef_search (int): The number of candidates explored in layer 0 by default, which trades latency for recall (default is 64).
+        """
+        self.vectors = vectors
+        self.links = links
+        self.entry_point = entry_point
+        self.M = M
+        self.ef_search = ef_search
+
+    @staticmethod
+    def index_path(semantic_vector_store):
+        """
+        Return the path of the index stored next to a semantic vector store.
+
+        Args:
+            semantic_vector_store (str): The path to the semantic vector store, e.g. semantic_db.h5ad.
+
+        Returns:
+            str: The path of the index, e.g. semantic_db.hnsw.npz.
+        """
+        return os.path.splitext(semantic_vector_store)[0] + ".hnsw.npz"
+
+    @staticmethod
+    def normalize(vectors):
+        """
+        Scale vectors to unit length, so that the cosine similarity of two vectors is their dot product.
+
+        Args:
+            vectors (numpy.ndarray): The vectors, with one row per vector.
+
+        Returns:
+            numpy.ndarray: The float32 normalized vectors, or the vectors themselves when they are already normalized.
+                Zero vectors are left unchanged.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        # normalized vectors are shared rather than copied, e.g. between Rag_embedding and its index
+        if np.all((np.abs(norms - 1) < 1e-6) | (norms == 0)):
+            return vectors
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    @staticmethod
+    def fingerprint(vectors, n_rows=1000):
+        """
+        Compute a fingerprint of the embeddings an index was built from.
+
+        Args:
+            vectors (numpy.ndarray): The normalized float32 embeddings.
+            n_rows (int, optional): The number of rows hashed, evenly spaced over the embeddings. Defaults to 1000.
+
+        Returns:
+            str: The hexadecimal fingerprint of the shape and of the sampled rows.
+        """
+        digest = hashlib.sha256(str(vectors.shape).encode())
+        digest.update(np.ascontiguousarray(vectors[::max(1, len(vectors) // n_rows)], dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    def search_layer(self, query, entry_points, ef, layer):
+        """
+        Find the closest nodes to a query in one layer of the graph, by best-first search from the entry points.
+
+        Args:
+            query (numpy.ndarray): The normalized query vector.
+            entry_points (list): The nodes where the search starts.
+            ef (int): The number of closest nodes kept.
+            layer (int): The layer searched.
+
+        Returns:
+            list: The (cosine distance, node) pairs of the ef closest nodes found, from the closest.
+        """
+        links = self.links[layer]
+        visited = set(entry_points)
+        distances = 1 - self.vectors[entry_points] @ query
+        candidates = [(float(distance), node) for distance, node in zip(distances, entry_points)]
+        heapq.heapify(candidates)
+        # a max-heap of the closest nodes found, holding negated distances
+        closest = [(-distance, node) for distance, node in candidates]
+        heapq.heapify(closest)
+        while len(closest) > ef:
+            heapq.heappop(closest)
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -closest[0][0]:
+                break
+            neighbours = [neighbour for neighbour in links[node] if neighbour not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for distance, neighbour in zip((1 - self.vectors[neighbours] @ query).tolist(), neighbours):
+                if len(closest) < ef or distance < -closest[0][0]:
+                    heapq.heappush(candidates, (distance, neighbour))
+                    heapq.heappush(closest, (-distance, neighbour))
+                    if len(closest) > ef:
+                        heapq.heappop(closest)
+        return sorted((-distance, node) for distance, node in closest)
+
+    def select_neighbours(self, candidates, M):
+        """
+        Select the neighbours of a node among candidates, with the heuristic of the HNSW paper.
+
+        A candidate is kept if it is closer to the node than to every neighbour already kept, which links the node
+        to several directions instead of one dense cluster.
+
+        Args:
+            candidates (list): The (cosine distance, node) pairs of the candidates, from the closest.
+            M (int): The maximum number of neighbours.
+
+        Returns:
+            list: The selected nodes.
+        """
+        nodes = [node for _, node in candidates]
+        distances = np.array([distance for distance, _ in candidates])
+        between = 1 - self.vectors[nodes] @ self.vectors[nodes].T
+        selected = []
+        for i in range(len(nodes)):
+            if not selected or distances[i] < between[i, selected].min():
+                selected.append(i)
+                if len(selected) == M:
+                    break
+        return [nodes[i] for i in selected]
+
+    @staticmethod
+    def build(vectors, M=16, ef_construction=200, ef_search=64, random_state=0):
+        """
+        Build an index by inserting the vectors one at a time.
+
+        Args:
+            vectors (numpy.ndarray): The embeddings, with one row per vector. They are normalized for cosine similarity.
+            M (int, optional): The number of neighbours per node in the upper layers. Defaults to 16.
+            ef_construction (int, optional): The number of candidates explored when inserting a node, which trades build
+                time for recall. Defaults to 200.
+            ef_search (int, optional): The default number of candidates explored by searches. Defaults to 64.
+            random_state (int, optional): The seed of the layers of the nodes. Defaults to 0.
+
+        Returns:
+            Hnsw_index: The index.
+        """
+        vectors = Hnsw_index.normalize(vectors)
+        rng = np.random.default_rng(random_state)
+        levels = np.floor(-np.log(1 - rng.random(len(vectors))) / np.log(M)).astype(int)
+        index = Hnsw_index(vectors, [{} for _ in range(levels.max(initial=0) + 1)], 0, M, ef_search)
+        top_level = -1
+        for node in tqdm(range(len(vectors))):
+            level = levels[node]
+            if top_level < 0:
+                for layer in range(level + 1):
+                    index.links[layer][node] = []
+                index.entry_point, top_level = node, level
+                continue
+            query = vectors[node]
+            entry_points = [index.entry_point]
+            for layer in range(top_level, level, -1):
+                entry_points = [index.search_layer(query, entry_points, 1, layer)[0][1]]
+            for layer in range(min(level, top_level), -1, -1):
+                candidates = index.search_layer(query, entry_points, ef_construction, layer)
+                max_degree = 2 * M if layer == 0 else M
+                neighbours = index.select_neighbours(candidates, M)
+                index.links[layer][node] = neighbours
+                for neighbour in neighbours:
+                    links = index.links[layer][neighbour]
+                    links.append(node)
+                    if len(links) > max_degree:
+                        distances = 1 - vectors[links] @ vectors[neighbour]
+                        order = np.argsort(distances)
+                        index.links[layer][neighbour] = index.select_neighbours(
+                            [(distances[i], links[i]) for i in order], max_degree
+                        )
+                entry_points = [node for _, node in candidates]
+            for layer in range(top_level + 1, level + 1):
+                index.links[layer][node] = []
+            if level > top_level:
+                index.entry_point, top_level = node, level
+        return index
+
+    def save(self, index_path):
+        """
+        Save the graph of the index. The embeddings are not saved, as they are stored in the semantic vector store.
+
+        Args:
+            index_path (str): The path of the index (npz), e.g. as returned by ``index_path``.
+
+        Returns:
+            None
+        """
+        arrays = {}
+        for layer, links in enumerate(self.links):
+            nodes = np.array(sorted(links), dtype=np.int64)
+            arrays[f"nodes_{layer}"] = nodes
+            arrays[f"indptr_{layer}"] = np.concatenate([[0], np.cumsum([len(links[node]) for node in nodes])]).astype(np.int64)
+            arrays[f"indices_{layer}"] = np.array([n for node in nodes for n in links[node]], dtype=np.int32)
+        with open(index_path, "wb") as f:
+            np.savez(f, n_layers=len(self.links), entry_point=self.entry_point, M=self.M, ef_search=self.ef_search,
+                     fingerprint=self.fingerprint(self.vectors), **arrays)
+
+    @staticmethod
+    def load(index_path, vectors):
+        """
+        Load an index saved with ``save``.
+
+        Args:
+            index_path (str): The path of the index.
+            vectors (numpy.ndarray): The embeddings the index was built from, e.g. the X of the semantic vector store.
+
+        Returns:
+            Hnsw_index: The index.
+        """
+        vectors = Hnsw_index.normalize(vectors)
+        with np.load(index_path) as f:
+            if "fingerprint" not in f or str(f["fingerprint"]) != Hnsw_index.fingerprint(vectors):
+                raise ValueError(f"The index {index_path} was built from different embeddings.")
+            links = []
+            for layer in range(int(f["n_layers"])):
+                nodes, indptr, indices = f[f"nodes_{layer}"], f[f"indptr_{layer}"], f[f"indices_{layer}"]
+                links.append(dict(zip(nodes.tolist(), np.split(indices, indptr[1:-1]))))
+            return Hnsw_index(vectors, links, int(f["entry_point"]), int(f["M"]), int(f["ef_search"]))
+
+    def search(self, query, k=5, ef=None):
+        """
+        Find the approximate k nearest neighbours of a query by cosine similarity.
+
+        Args:
+            query (numpy.ndarray): The query vector.
+            k (int, optional): The number of neighbours. Defaults to 5.
+            ef (int, optional): The number of candidates explored in layer 0, at least k. Larger values give a higher
+                recall and a higher latency. Defaults to ef_search.
+
+        Returns:
+            tuple: The positions of the neighbours, from the closest, and their cosine distances.
+        """
+        if ef is None:
+            ef = self.ef_search
+        query = self.normalize(np.ravel(query))
+        entry_points = [self.entry_point]
+        for layer in range(len(self.links) - 1, 0, -1):
+            entry_points = [self.search_layer(query, entry_points, 1, layer)[0][1]]
+        closest = self.search_layer(query, entry_points, max(ef, k), 0)[:k]
+        return (np.array([node for _, node in closest], dtype=np.int64),
+                np.array([distance for distance, _ in closest], dtype=np.float32))
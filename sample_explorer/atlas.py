@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import anndata as ad
+import h5py
+from .enrichment import Transcriptome_enrichment
+from .utils import read_gmt
+
+
+class Enrichment_atlas:
+    def __init__(self, atlas_path):
+        """
+        Initializes a precomputed enrichment atlas, which stores the ORA scores of every condition against a gene set library.
+
+        The atlas holds a float16 matrix of -log10 p-values (conditions x gene sets) and, for every gene set, the
+        positions of its top conditions, so that the top conditions of a gene set and the enriched gene sets of a
+        condition are looked up without scanning the transcriptomic vector store. Atlases are created with ``build``.
+
+        Parameters:
+        - atlas_path (str): The path to the atlas (HDF5).
+        """
+        self.atlas_path = atlas_path
+        self.file = h5py.File(atlas_path, "r")
+        self.gene_set_names = pd.Index(self.file["gene_sets"].asstr()[:])
+        self.conditions = pd.Index(self.file["conditions"].asstr()[:])
+
+    @staticmethod
+    def build(transcriptomic_vector_store, gmt_path, atlas_path, k=1000, batch_size=None, method=None, execution_profile=None):
+        """
+        Score every condition of a transcriptomic vector store against a gene set library and write the atlas.
+
+        The vector store is read once for the whole library (see ``Transcriptome_enrichment.iter_native_ora_pvals_many``).
+        Gene sets without any gene in the vector store are skipped.
+
+        Args:
+            transcriptomic_vector_store (str): The path to the transcriptomic vector store.
+            gmt_path (str): The path to the gene set library in GMT format.
+            atlas_path (str): The path of the atlas to write.
+            k (int, optional): The number of top conditions indexed per gene set. Defaults to 1000.
+            batch_size (int, optional): The number of conditions scored per block. Defaults to the block size of the
+                method in the execution profile, or 1000.
+            method (str, optional): The ORA engine, either "index" or "native". Defaults to "index" when the vector store
+                has a top-gene index, otherwise "native".
+            execution_profile (Execution_profile, optional): The profile setting the block size. Defaults to None.
+
+        Returns:
+            None
+        """
+        te = Transcriptome_enrichment(ad.read_h5ad(transcriptomic_vector_store, backed="r"))
+        if method is None:
+            method = "native" if te.top_gene_index is None else "index"
+        gene_sets = read_gmt(gmt_path)
+        gene_sets = {name: genes for name, genes in gene_sets.items() if te.gene_index.isin(genes).any()}
+        n_obs, n_sets = te.memmap_adata.n_obs, len(gene_sets)
+        k = min(k, n_obs)
+        if batch_size is None:
+            batch_size = 1000
+            if execution_profile is not None and method in ("index", "native"):
+                # the p-values and scores of every gene set are held for each condition of a block
+                batch_size = execution_profile.get_batch_size(method, te.memmap_adata.n_vars, extra_bytes_per_row=24 * n_sets, default=1000)
+        if method == "index":
+            blocks = te.iter_indexed_ora_pvals_many(gene_sets, batch_size=batch_size)
+        elif method == "native":
+            blocks = te.iter_native_ora_pvals_many(gene_sets, batch_size=batch_size)
+        else:
+            raise ValueError("method should be one of 'index' or 'native'.")
+
+        with h5py.File(atlas_path, "w") as f:
+            f.create_dataset("gene_sets", data=np.array(list(gene_sets), dtype=object), dtype=h5py.string_dtype())
+            f.create_dataset("gene_set_sizes", data=[int(te.gene_index.isin(genes).sum()) for genes in gene_sets.values()])
+            f.create_dataset("conditions", data=np.array(te.memmap_adata.obs_names, dtype=object), dtype=h5py.string_dtype())
+            scores = f.create_dataset(
+                "scores", shape=(n_obs, n_sets), dtype=np.float16,
+                chunks=(min(n_obs, 4096), min(n_sets, 64)), compression="gzip"
+            )
+            top_positions = np.empty((0, n_sets), dtype=np.int64)
+            top_pvals = np.empty((0, n_sets), dtype=np.float64)
+            for start, stop, pvals in blocks:
+                with np.errstate(divide="ignore"):
+                    scores[start:stop] = np.minimum(-np.log10(pvals), np.finfo(np.float16).max)
+                # the running top k of every gene set; the stable sort keeps the earlier row on ties
+                candidate_positions = np.vstack([top_positions, np.broadcast_to(np.arange(start, stop)[:, None], pvals.shape)])
+                candidate_pvals = np.vstack([top_pvals, pvals])
+                order = np.argsort(candidate_pvals, axis=0, kind="stable")[:k]
+                top_positions = np.take_along_axis(candidate_positions, order, axis=0)
+                top_pvals = np.take_along_axis(candidate_pvals, order, axis=0)
+            f.create_dataset("top_k", data=top_positions.T.astype(np.int32))
+            f.attrs["method"] = method
+            f.attrs["k"] = k
+
+    def top_conditions(self, gene_set_name, k=None):
+        """
+        Return the top conditions of a gene set.
+
+        Args:
+            gene_set_name (str): The name of the gene set.
+            k (int, optional): The number of conditions. Defaults to all the indexed conditions.
+
+        Returns:
+            numpy.ndarray: The positions of the conditions, from the most to the least enriched.
+        """
+        if gene_set_name not in self.gene_set_names:
+            raise KeyError(f"The gene set {gene_set_name} is not in the atlas.")
+        return self.file["top_k"][self.gene_set_names.get_loc(gene_set_name)][:k]
+
+    def condition_scores(self, position):
+        """
+        Return the scores of a condition against every gene set of the library.
+
+        Args:
+            position (int): The position of the condition.
+
+        Returns:
+            pandas.Series: The -log10 p-value of each gene set, indexed by gene set name.
+        """
+        return pd.Series(self.file["scores"][position].astype(np.float32), index=self.gene_set_names, name="estimate")
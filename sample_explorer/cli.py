@@ -1,11 +1,81 @@
 import argparse
 from .sample_explorer import Query_DB
+from .atlas import Enrichment_atlas
+from .execution_profile import Execution_profile
+from .ann_index import Hnsw_index
+import anndata as ad
 import os
 import datetime
 import sys
 import logging
 
+def atlas_main(argv):
+    parser = argparse.ArgumentParser(prog='biorag atlas', description='Build a precomputed enrichment atlas for a gene set library')
+    parser.add_argument('action', choices=['build'], help='Atlas action')
+    parser.add_argument('--transcriptome_db', type=str, required=True, help='Path to the transcriptome database')
+    parser.add_argument('--gmt', type=str, required=True, help='Path to the gene set library in GMT format')
+    parser.add_argument('--output', type=str, required=True, help='Path to the atlas file to write')
+    parser.add_argument('--k', type=int, default=1000, help='Number of top conditions indexed per gene set')
+    parser.add_argument('--batch_size', type=int, default=None, help='Number of conditions scored per block (default: from the execution profile, or 1000)')
+    parser.add_argument('--profile', type=str, default=None, help='Path to an execution profile written by biorag tune')
+    parser.add_argument('--max_memory', type=str, default=None, help='Memory budget of a block, e.g. 512M or 8G')
+    args = parser.parse_args(argv)
+
+    execution_profile = Execution_profile(args.profile, args.max_memory)
+    Enrichment_atlas.build(args.transcriptome_db, args.gmt, args.output, k=args.k, batch_size=args.batch_size,
+                           execution_profile=execution_profile)
+    logging.info(f"Enrichment atlas saved to {args.output}")
+
+def tune_main(argv):
+    parser = argparse.ArgumentParser(prog='biorag tune', description='Benchmark the block sizes of transcriptome search and enrichment on this machine')
+    parser.add_argument('--transcriptome_db', type=str, required=True, help='Path to the transcriptome database')
+    parser.add_argument('--output', type=str, required=True, help='Path to the execution profile to write (JSON)')
+    parser.add_argument('--max_memory', type=str, default=None, help='Memory budget of a block, e.g. 512M or 8G (default: a quarter of the physical memory)')
+    args = parser.parse_args(argv)
+
+    execution_profile = Execution_profile.autotune(args.transcriptome_db, args.output, max_memory=args.max_memory)
+    logging.info(f"Execution profile saved to {args.output} (block sizes: {execution_profile.batch_sizes})")
+
+def ann_main(argv):
+    parser = argparse.ArgumentParser(prog='biorag ann', description='Build an approximate nearest-neighbour index of the semantic database')
+    parser.add_argument('action', choices=['build'], help='Index action')
+    parser.add_argument('--semantic_db', type=str, required=True, help='Path to the semantic database')
+    parser.add_argument('--M', type=int, default=16, help='Number of neighbours per node of the graph')
+    parser.add_argument('--ef_construction', type=int, default=200, help='Number of candidates explored when inserting a node')
+    parser.add_argument('--ef_search', type=int, default=64, help='Default number of candidates explored by searches')
+    args = parser.parse_args(argv)
+
+    sem_obj = ad.read_h5ad(args.semantic_db, backed='r')
+    index = Hnsw_index.build(sem_obj.X[:], M=args.M, ef_construction=args.ef_construction, ef_search=args.ef_search)
+    index.save(Hnsw_index.index_path(args.semantic_db))
+    logging.info(f"Approximate nearest-neighbour index saved to {Hnsw_index.index_path(args.semantic_db)}")
+
+def encoder_main(argv):
+    parser = argparse.ArgumentParser(prog='biorag encoder', description='Export the sentence model to weights run in NumPy, without torch')
+    parser.add_argument('action', choices=['export'], help='Encoder action')
+    parser.add_argument('--model', type=str, default='paraphrase-MiniLM-L6-v2', help='Name of the sentence model, or path to a local model directory')
+    parser.add_argument('--output', type=str, required=True, help='Path to the weights file to write (npz)')
+    parser.add_argument('--int8', action='store_true', default=False, help='Store the weight matrices as int8')
+    args = parser.parse_args(argv)
+
+    from .numpy_encoder import Numpy_encoder
+    Numpy_encoder.export(args.model, args.output, int8=args.int8)
+    logging.info(f"Encoder weights saved to {args.output}")
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'atlas':
+        atlas_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'tune':
+        tune_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'ann':
+        ann_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'encoder':
+        encoder_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description='BioRAG Command Line Interface')
     parser.add_argument('--gene_list', type=str, nargs='?', default=None, help='Path to the gene list text file or comma-separated gene list (e.g. "IRF1,IRF2,IRF3")')
     parser.add_argument('--text_query', type=str, nargs='?', default=None, help='Path to a text file or a string, e.g. "studies with cardiac myocytes"')
@@ -16,6 +86,11 @@ def main():
     parser.add_argument('--expand', type=str, help='Expansion strategy', default='transcriptome')
     parser.add_argument('--enrichment', action='store_true', default=False, help='Enrichment parameter, if True, then performs ssGSEA')  # Added the --enrichment argument with default value False
     parser.add_argument('--usage', action='store_true', default=False, help='Print usage information')  # Added the --usage argument to print the usage information
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for transcriptome search')
+    parser.add_argument('--cache', type=str, default=None, help='Path to a SQLite file caching transcriptome search results across runs')
+    parser.add_argument('--profile', type=str, default=None, help='Path to an execution profile written by biorag tune')
+    parser.add_argument('--max_memory', type=str, default=None, help='Memory budget of a block, e.g. 512M or 8G')
+    parser.add_argument('--model', type=str, default=None, help='Name of the sentence model, path to a local model directory, or path to weights exported with biorag encoder export (default: paraphrase-MiniLM-L6-v2)')
 
     # Add any other command line arguments you need here
 
@@ -45,6 +120,10 @@ def main():
         print("2. When using files, the gene_list.txt should contain a list of gene names (in UPPERCASE), one gene per line.")
         print("3. The file containing the text query should have the query string, which may contain multiple sentences, in plain text format")
         print("4. To perform enrichment, add the --enrichment flag")
+        print("5. To precompute the enrichment of a gene set library, run: biorag atlas build --transcriptome_db transcriptome.h5 --gmt library.gmt --output atlas.h5")
+        print("6. To tune the block sizes of search and enrichment to this machine, run: biorag tune --transcriptome_db transcriptome.h5 --output profile.json, then pass --profile profile.json")
+        print("7. To speed up semantic search on large semantic databases, run: biorag ann build --semantic_db vector.h5")
+        print("8. To encode text queries without torch, run once: biorag encoder export --output minilm.npz, then pass --model minilm.npz")
         print("")    
         sys.exit(0)
 
@@ -76,7 +155,8 @@ def main():
     else:
         query = None
 
-    new_query_db = Query_DB(args.semantic_db, args.transcriptome_db, args.archs4_file)
+    new_query_db = Query_DB(args.semantic_db, args.transcriptome_db, args.archs4_file, workers=args.workers, cache_path=args.cache,
+                            profile_path=args.profile, max_memory=args.max_memory, model_name_or_path=args.model)
     result = new_query_db.search(geneset=gene_list, text_query=query, search=args.search, \
                                  expand=args.expand, perform_enrichment=args.enrichment)
 
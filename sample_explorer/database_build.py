@@ -0,0 +1,290 @@
+import numpy as np
+import anndata as ad
+import h5py
+from anndata.experimental import write_elem
+from anndata.utils import make_index_unique
+from tqdm import tqdm
+from .enrichment import Transcriptome_enrichment
+
+
+class Transcriptome_db_builder:
+    def __init__(self, h5ad_path):
+        """
+        Initializes the builder, which adds precomputed search layers to a transcriptomic vector store.
+
+        Parameters:
+        - h5ad_path (str): The path to the transcriptomic vector store (h5ad) to be modified in place.
+        """
+        self.h5ad_path = h5ad_path
+
+    def clean_matrix(self, batch_size=1000):
+        """
+        Replace non-finite values in the count matrix with zeros and make the gene names unique, in place.
+
+        These steps were previously repeated on every batch of every search. Once done, they are recorded
+        as flags in uns["preprocessing"] and skipped at query time.
+
+        Args:
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+
+        Returns:
+            None
+        """
+        target = ad.read_h5ad(self.h5ad_path, backed="r+")
+        X = target.file["X"]
+        if not isinstance(X, h5py.Dataset):
+            raise ValueError("Only dense transcriptomic vector stores can be cleaned.")
+
+        n_obs = X.shape[0]
+        for start in tqdm(range(0, n_obs, batch_size)):
+            stop = min(start + batch_size, n_obs)
+            block = X[start:stop]
+            if not np.isfinite(block).all():
+                X[start:stop] = np.nan_to_num(block, nan=0.0, posinf=0.0, neginf=0.0)
+
+        var = target.file["var"]
+        var_index = var[var.attrs["_index"]]
+        var_index[...] = np.array(make_index_unique(target.var_names.astype(str)), dtype=object)
+
+        uns = target.file["uns"]
+        if "preprocessing" in uns:
+            del uns["preprocessing"]
+        write_elem(uns, "preprocessing", {"finite_values": True, "unique_var_names": True})
+        target.file.close()
+
+    def prune_genes(self, output_path, min_expression=1.0, min_prevalence=0.01, batch_size=1000):
+        """
+        Write a copy of the transcriptomic vector store without the genes which are almost never expressed.
+
+        A gene is kept if its count is at least min_expression in at least a min_prevalence fraction of the
+        conditions. Every search then reads only the kept genes. The metadata, the embedding and the rows of the
+        projection of the kept genes are carried over. The top-gene index is not, and should be rebuilt with
+        ``add_top_gene_index`` on the pruned store.
+
+        ORA on the pruned store keeps the number of top genes per condition of the full gene universe, so the top
+        genes of a condition only change when one of them was dropped. The gene universe (the thresholds, the number
+        of genes before and after pruning and the number of top genes) is recorded in uns["gene_universe"].
+
+        Args:
+            output_path (str): The path of the pruned vector store (h5ad) to write.
+            min_expression (float, optional): The count at which a gene is considered expressed. Defaults to 1.
+            min_prevalence (float, optional): The minimal fraction of conditions expressing a kept gene. Defaults to 0.01.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+
+        Returns:
+            dict: The gene universe recorded in uns["gene_universe"], with the bytes read per condition before and after pruning.
+        """
+        source = ad.read_h5ad(self.h5ad_path, backed="r")
+        te = Transcriptome_enrichment(source)
+        reader = te.get_block_reader()
+        n_obs, n_vars = source.shape
+
+        n_expressed = np.zeros(n_vars, dtype=np.int64)
+        for start in tqdm(range(0, n_obs, batch_size)):
+            stop = min(start + batch_size, n_obs)
+            n_expressed += (reader.read(start, stop) >= min_expression).sum(axis=0)
+        keep = n_expressed >= min_prevalence * n_obs
+        if not keep.any():
+            raise ValueError("No gene passes the expression and prevalence thresholds.")
+
+        dtype = source.X.dtype
+        n_vars_full = int(source.uns.get("gene_universe", {}).get("n_vars_full", n_vars))
+        gene_universe = {
+            "min_expression": float(min_expression),
+            "min_prevalence": float(min_prevalence),
+            "n_vars_full": n_vars_full,
+            "n_vars": int(keep.sum()),
+            "n_up": te.default_n_up,
+            "bytes_per_condition_full": n_vars_full * dtype.itemsize,
+            "bytes_per_condition": int(keep.sum()) * dtype.itemsize,
+        }
+
+        var = source.var[keep].copy()
+        var.index = te.gene_index[keep]
+        uns = {key: value for key, value in source.uns.items() if key not in ("top_genes", "preprocessing", "gene_universe")}
+        # blocks are written from the reader, which cleans non-finite values
+        uns["preprocessing"] = {"finite_values": True, "unique_var_names": True}
+        uns["gene_universe"] = gene_universe
+        pruned = ad.AnnData(
+            obs=source.obs, var=var, uns=uns,
+            obsm={key: np.asarray(value) for key, value in source.obsm.items() if key != "top_genes"},
+            # log CPM moments depend on the library sizes, which change with the genes kept
+            varm={key: np.asarray(value)[keep] for key, value in source.varm.items() if key != "log_cpm_moments"}
+        )
+        pruned.write_h5ad(output_path)
+
+        with h5py.File(output_path, "r+") as f:
+            if "X" in f:
+                del f["X"]
+            X = f.create_dataset("X", shape=(n_obs, int(keep.sum())), dtype=dtype)
+            X.attrs["encoding-type"] = "array"
+            X.attrs["encoding-version"] = "0.2.0"
+            for start in tqdm(range(0, n_obs, batch_size)):
+                stop = min(start + batch_size, n_obs)
+                X[start:stop] = reader.read(start, stop)[:, keep]
+        source.file.close()
+        return gene_universe
+
+    def add_top_gene_index(self, n_up=None, batch_size=1000, source_path=None, chunk_rows=16384, chunk_bytes=4):
+        """
+        Store the top expressed genes of every condition as a packed bitset, in an HDF5 file next to the vector store.
+
+        Each row of the bitset has one bit per gene, set for the n_up most expressed genes of the condition.
+        The selection is the same as the one made by ``Transcriptome_enrichment.run_native_ora``, so searches
+        against the index return the same results without reading the expression matrix. The index is written to
+        ``Transcriptome_enrichment.top_gene_index_path`` rather than to obsm, which anndata loads into memory, and
+        is chunked by a few bytes of genes, so that searches only read the chunks holding gene set members.
+
+        Args:
+            n_up (int, optional): The number of top genes per condition. Defaults to 5% of the genes of the gene universe.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            source_path (str, optional): A dense transcriptomic vector store to read the counts from. Use this to
+                add the index to the embeddings-only store. Defaults to the store being indexed.
+            chunk_rows (int, optional): The number of conditions per chunk of the index. Defaults to 16384.
+            chunk_bytes (int, optional): The number of bytes (8 genes each) per chunk of the index. Defaults to 4.
+
+        Returns:
+            None
+        """
+        target = ad.read_h5ad(self.h5ad_path, backed="r")
+        source = target if source_path is None else ad.read_h5ad(source_path, backed="r")
+        if not (source.obs_names.equals(target.obs_names) and source.var_names.equals(target.var_names)):
+            raise ValueError("The source and target vector stores should have the same conditions and genes.")
+
+        te = Transcriptome_enrichment(source)
+        reader = te.get_block_reader()
+        n_obs, n_vars = source.shape
+        if n_up is None:
+            n_up = te.default_n_up
+        if te.top_gene_file is not None:
+            # the previous index of the store is rewritten
+            te.top_gene_file.close()
+
+        n_bytes = (n_vars + 7) // 8
+        chunk_rows = min(n_obs, chunk_rows)
+        with h5py.File(Transcriptome_enrichment.top_gene_index_path(self.h5ad_path), "w") as f:
+            bits = f.create_dataset(
+                "top_genes", shape=(n_obs, n_bytes), dtype=np.uint8,
+                chunks=(chunk_rows, min(n_bytes, chunk_bytes)), compression="gzip"
+            )
+            bits.attrs["n_up"] = n_up
+            bits.attrs["n_vars"] = n_vars
+            # every chunk spans many blocks of rows, so the rows of a chunk are packed in memory and written once
+            for chunk_start in tqdm(range(0, n_obs, chunk_rows)):
+                chunk_stop = min(chunk_start + chunk_rows, n_obs)
+                packed = np.empty((chunk_stop - chunk_start, n_bytes), dtype=np.uint8)
+                for start in range(chunk_start, chunk_stop, batch_size):
+                    stop = min(start + batch_size, chunk_stop)
+                    block = reader.read(start, stop)
+                    membership = np.zeros(block.shape, dtype=bool)
+                    np.put_along_axis(membership, Transcriptome_enrichment.get_top_genes(block, n_up), True, axis=1)
+                    # conditions without counts have no top genes
+                    membership[~block.any(axis=1)] = False
+                    packed[start - chunk_start:stop - chunk_start] = np.packbits(membership, axis=1)
+                bits[chunk_start:chunk_stop] = packed
+
+        if source is not target:
+            source.file.close()
+        target.file.close()
+
+    def add_projection(self, n_components=1000, random_state=0, batch_size=1000, source_path=None):
+        """
+        Embed every condition with a new Gaussian random projection, and store the projection matrix in varm["projection"].
+
+        The projection is drawn as in ``GaussianRandomProjection`` and replaces obsm["embedding"], so that gene sets
+        can be projected into the same space as the conditions for approximate transcriptome search. Distances
+        between conditions are preserved up to the Johnson-Lindenstrauss error, as in the original embedding.
+        Use this for vector stores built before the projection matrix was kept.
+
+        Args:
+            n_components (int, optional): The dimension of the embedding. Defaults to 1000.
+            random_state (int, optional): The seed of the projection. Stores embedded with the same seed share the
+                same projection. Defaults to 0.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            source_path (str, optional): A dense transcriptomic vector store to read the counts from. Use this to
+                embed the embeddings-only store. Defaults to the store being modified.
+
+        Returns:
+            None
+        """
+        target = ad.read_h5ad(self.h5ad_path, backed="r+")
+        source = target if source_path is None else ad.read_h5ad(source_path, backed="r")
+        if not (source.obs_names.equals(target.obs_names) and source.var_names.equals(target.var_names)):
+            raise ValueError("The source and target vector stores should have the same conditions and genes.")
+
+        reader = Transcriptome_enrichment(source).get_block_reader()
+        n_obs, n_vars = source.shape
+        rng = np.random.default_rng(random_state)
+        projection = rng.normal(0.0, 1.0 / np.sqrt(n_components), size=(n_vars, n_components)).astype(np.float32)
+
+        obsm = target.file["obsm"]
+        if "embedding" in obsm:
+            del obsm["embedding"]
+        embedding = obsm.create_dataset("embedding", shape=(n_obs, n_components), dtype=np.float32)
+        embedding.attrs["encoding-type"] = "array"
+        embedding.attrs["encoding-version"] = "0.2.0"
+        for start in tqdm(range(0, n_obs, batch_size)):
+            stop = min(start + batch_size, n_obs)
+            embedding[start:stop] = reader.read(start, stop) @ projection
+
+        varm = target.file["varm"]
+        if "projection" in varm:
+            del varm["projection"]
+        write_elem(varm, "projection", projection)
+
+        if source is not target:
+            source.file.close()
+        target.file.close()
+
+    def add_gene_moments(self, batch_size=1000):
+        """
+        Store the mean and standard deviation of the log CPM of every gene in varm["log_cpm_moments"].
+
+        Signature search standardizes every gene with these moments. Without them, each session computes them in
+        a first pass over the count matrix.
+
+        Args:
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+
+        Returns:
+            None
+        """
+        target = ad.read_h5ad(self.h5ad_path, backed="r+")
+        moments = Transcriptome_enrichment(target).compute_gene_moments(batch_size)
+        varm = target.file["varm"]
+        if "log_cpm_moments" in varm:
+            del varm["log_cpm_moments"]
+        write_elem(varm, "log_cpm_moments", moments)
+        target.file.close()
+
+    def write_gene_major_store(self, gene_store_path, batch_size=2048, genes_per_chunk=8):
+        """
+        Write a gene-major companion store, which holds the count matrix transposed (genes x conditions).
+
+        Each chunk holds genes_per_chunk genes over batch_size conditions and is written once, from one block of rows
+        of the count matrix. Reading the profile of one gene then touches about n_obs / batch_size small chunks
+        instead of the whole matrix.
+
+        Args:
+            gene_store_path (str): The path of the gene-major store (HDF5) to write.
+            batch_size (int, optional): The number of rows read per block, which is also the chunk width. Defaults to 2048.
+            genes_per_chunk (int, optional): The number of genes per chunk. Defaults to 8.
+
+        Returns:
+            None
+        """
+        source = ad.read_h5ad(self.h5ad_path, backed="r")
+        te = Transcriptome_enrichment(source)
+        reader = te.get_block_reader()
+        n_obs, n_vars = source.shape
+        with h5py.File(gene_store_path, "w") as f:
+            f.create_dataset("genes", data=np.array(te.gene_index, dtype=object), dtype=h5py.string_dtype())
+            f.create_dataset("conditions", data=np.array(source.obs_names, dtype=object), dtype=h5py.string_dtype())
+            X = f.create_dataset(
+                "X", shape=(n_vars, n_obs), dtype=source.X.dtype,
+                chunks=(min(n_vars, genes_per_chunk), min(n_obs, batch_size))
+            )
+            for start in tqdm(range(0, n_obs, batch_size)):
+                stop = min(start + batch_size, n_obs)
+                X[:, start:stop] = reader.read(start, stop).T
+        source.file.close()
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import numpy as np
+from .search_cache import Search_cache
+
+
+class Embedding_cache:
+    def __init__(self, model, model_name, cache_path=None, max_entries=10000, max_bytes=64 * 2**20):
+        """
+        Initializes a two-level cache of the embeddings of query texts, in front of a sentence encoder.
+
+        Embeddings are looked up in an in-process least recently used cache, then in an optional on-disk
+        ``Search_cache`` shared between processes and restarts, and only the texts found in neither are encoded,
+        with one batched call to the model. Entries are keyed by the model name and a hash of the text, so caches
+        of different models never mix.
+
+        Parameters:
+        - model (object): The encoder, with an ``encode`` method mapping a list of texts to one embedding per text,
+          e.g. a SentenceTransformer.
+        - model_name (str): The name of the model, part of the cache keys.
+        - cache_path (str): The path to the SQLite database of the on-disk cache (default is None, no on-disk cache).
+        - max_entries (int): The maximum number of embeddings kept in memory (default is 10000, 15 MiB of 384-d embeddings).
+        - max_bytes (int): The maximum total size of the on-disk embeddings in bytes (default is 64 MiB). Embeddings are
+          stored in their own table, with this budget, so that they never evict search results sharing the database.
+        """
+        self.model = model
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.disk_cache = None if cache_path is None else Search_cache(cache_path, max_bytes, table="embeddings")
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, text):
+        """
+        Compute the cache key of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            str: The hexadecimal key.
+        """
+        return Search_cache.make_key(model=self.model_name, text=text)
+
+    def remember(self, key, embedding):
+        """
+        Store an embedding in the in-process cache, evicting the least recently used embedding if it is full.
+
+        Args:
+            key (str): The cache key, as returned by ``make_key``.
+            embedding (numpy.ndarray): The float32 embedding.
+
+        Returns:
+            None
+        """
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def encode(self, texts):
+        """
+        Return the embeddings of texts, encoding only the texts which are not cached.
+
+        Args:
+            texts (str or list): A text or a list of texts.
+
+        Returns:
+            numpy.ndarray: The float32 embedding of the text, or one row per text.
+        """
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        keys = [self.make_key(text) for text in texts]
+        embeddings = {}
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                embeddings[key] = self.memory[key]
+        missing = {key: text for key, text in zip(keys, texts) if key not in embeddings}
+        if missing and self.disk_cache is not None:
+            for key, embedding in self.disk_cache.get_many(list(missing), np.float32).items():
+                embeddings[key] = embedding
+                self.remember(key, embedding)
+                del missing[key]
+        self.hits += len(set(keys)) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            encoded = np.asarray(self.model.encode(list(missing.values())), dtype=np.float32).reshape(len(missing), -1)
+            for key, embedding in zip(missing, encoded):
+                embeddings[key] = embedding
+                self.remember(key, embedding)
+            if self.disk_cache is not None:
+                self.disk_cache.put_many(dict(zip(missing, encoded)), np.float32)
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([embeddings[key] for key in keys])
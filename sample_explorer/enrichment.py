@@ -1,8 +1,128 @@
 
 import pandas as pd
+import anndata as ad
 import decoupler as dc
 import numpy as np
 import statsmodels.stats.multitest as smm
+import scipy.sparse as sp
+import h5py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from scipy.stats import hypergeom
+from anndata.experimental import sparse_dataset
+from anndata.utils import make_index_unique
+from tqdm import tqdm
+
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+class Block_reader:
+    def __init__(self, X, finite_values=False):
+        """
+        Initializes a positional reader of contiguous row blocks of a transcriptomic matrix.
+
+        Blocks are read into one float32 buffer which is reused across reads, so the returned
+        block is only valid until the next read.
+
+        Parameters:
+        - X: The (backed or in-memory, dense or sparse) transcriptomic matrix.
+        - finite_values (bool): Whether the matrix is known to contain only finite values, in which case
+          the NaN/Inf cleaning of each block is skipped.
+        """
+        self.X = X
+        self.finite_values = finite_values
+        self.buffer = None
+
+    def read(self, start, stop):
+        """
+        Read rows start to stop of the matrix into the reused float32 buffer.
+
+        Args:
+            start (int): The first row of the block.
+            stop (int): The row after the last row of the block.
+
+        Returns:
+            numpy.ndarray: A view of the buffer holding the block, with non-finite values set to zero.
+        """
+        n_rows = stop - start
+        block = self.get_buffer(n_rows)
+        if isinstance(self.X, h5py.Dataset):
+            # HDF5 converts float16 to float32 while reading, without an intermediate copy
+            self.X.read_direct(block, source_sel=np.s_[start:stop], dest_sel=np.s_[0:n_rows])
+        else:
+            rows = self.X[start:stop]
+            if sp.issparse(rows):
+                rows = rows.toarray()
+            block[...] = rows
+        if not self.finite_values:
+            np.nan_to_num(block, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        return block
+
+    def read_rows(self, rows):
+        """
+        Read the given rows of the matrix into the reused float32 buffer.
+
+        Args:
+            rows (numpy.ndarray): The positions of the rows, in increasing order.
+
+        Returns:
+            numpy.ndarray: A view of the buffer holding the rows, with non-finite values set to zero.
+        """
+        block = self.get_buffer(len(rows))
+        values = self.X[rows]
+        if sp.issparse(values):
+            values = values.toarray()
+        block[...] = values
+        if not self.finite_values:
+            np.nan_to_num(block, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        return block
+
+    def iter_rows(self, rows, batch_size=1000, scan_fraction=0.2):
+        """
+        Read the given rows of the matrix in blocks.
+
+        Selections holding at least scan_fraction of the rows between the first and the last selected row are read
+        with contiguous scans, from which the selected rows are kept, as reading many scattered rows one by one is
+        much slower than a scan on chunked and compressed matrices. Sparser selections are read with ``read_rows``.
+
+        Args:
+            rows (numpy.ndarray): The positions of the rows, in increasing order.
+            batch_size (int, optional): The number of rows per read. Defaults to 1000.
+            scan_fraction (float, optional): The fraction of selected rows from which selections are scanned.
+                Defaults to 0.2.
+
+        Yields:
+            tuple: The first and the last position in rows of each block, plus one, and the block, which is only
+                valid until the next read.
+        """
+        if len(rows) == 0:
+            return
+        first, last = int(rows[0]), int(rows[-1])
+        if len(rows) < scan_fraction * (last - first + 1):
+            for i in range(0, len(rows), batch_size):
+                yield i, min(i + batch_size, len(rows)), self.read_rows(rows[i:i + batch_size])
+            return
+        for start in range(first, last + 1, batch_size):
+            stop = min(start + batch_size, last + 1)
+            lo, hi = np.searchsorted(rows, [start, stop])
+            if lo < hi:
+                yield lo, hi, self.read(start, stop)[rows[lo:hi] - start]
+
+    def get_buffer(self, n_rows):
+        """
+        Return a view of n_rows rows of the float32 buffer, growing the buffer if needed.
+
+        Args:
+            n_rows (int): The number of rows.
+
+        Returns:
+            numpy.ndarray: The view of the buffer.
+        """
+        if self.buffer is None or self.buffer.shape[0] < n_rows:
+            self.buffer = np.empty((n_rows, self.X.shape[1]), dtype=np.float32)
+        return self.buffer[:n_rows]
+
 
 class Transcriptome_enrichment:
     def __init__(self, h5ad_obj):
@@ -13,7 +133,106 @@ class Transcriptome_enrichment:
         - h5ad_obj: An h5ad object representing the data to be enriched.
         """
         self.memmap_adata = h5ad_obj
+        # flags recorded by Transcriptome_db_builder.clean_matrix
+        flags = h5ad_obj.uns.get("preprocessing", {})
+        self.finite_values = bool(flags.get("finite_values", False))
+        if flags.get("unique_var_names", False):
+            self.gene_index = pd.Index(h5ad_obj.var_names.astype(str))
+        else:
+            self.gene_index = make_index_unique(pd.Index(h5ad_obj.var_names.astype(str)))
+        self.block_reader = Block_reader(h5ad_obj.X, self.finite_values)
+        # the top-gene index is kept next to the vector store rather than in obsm, which anndata loads into memory,
+        # and stays on disk: searches read the bytes of the gene set members, block by block
+        index_path = None if h5ad_obj.filename is None else self.top_gene_index_path(str(h5ad_obj.filename))
+        if index_path is not None and os.path.exists(index_path):
+            self.top_gene_file = h5py.File(index_path, "r", rdcc_nbytes=64 * 2**20)
+            self.top_gene_index = self.top_gene_file["top_genes"]
+            if self.top_gene_index.shape[0] != h5ad_obj.n_obs or self.top_gene_index.attrs["n_vars"] != h5ad_obj.n_vars:
+                raise ValueError(f"The top-gene index {index_path} was built for a different vector store.")
+            self.top_gene_n_up = int(self.top_gene_index.attrs["n_up"])
+        else:
+            self.top_gene_file = None
+            self.top_gene_index = None
+            self.top_gene_n_up = None
+        # the number of top genes per condition in ORA, recorded by Transcriptome_db_builder.prune_genes so that
+        # pruned vector stores select the same top genes as the full gene universe
+        gene_universe = h5ad_obj.uns.get("gene_universe", {})
+        self.default_n_up = int(gene_universe.get("n_up", np.ceil(0.05 * h5ad_obj.n_vars)))
+        # decoupler sets n_up to 5% of the genes expressed in each block, which only pruned stores override
+        self.decoupler_n_up = int(gene_universe["n_up"]) if "n_up" in gene_universe else None
+        # the projection used to embed the conditions, stored by the database build
+        if "projection" in h5ad_obj.varm:
+            self.projection = h5ad_obj.varm["projection"]
+        else:
+            self.projection = None
+        self.embedding_norms = None
+        # the mean and standard deviation of the log CPM of every gene, used by signature search
+        if "log_cpm_moments" in h5ad_obj.varm:
+            self.gene_moments = np.asarray(h5ad_obj.varm["log_cpm_moments"])
+        else:
+            self.gene_moments = None
    
+    @staticmethod
+    def top_gene_index_path(transcriptomic_vector_store):
+        """
+        Return the path of the top-gene index stored next to a transcriptomic vector store.
+
+        Args:
+            transcriptomic_vector_store (str): The path to the transcriptomic vector store, e.g. transcriptomic_db.h5ad.
+
+        Returns:
+            str: The path of the index, e.g. transcriptomic_db.top_genes.h5.
+        """
+        return os.path.splitext(transcriptomic_vector_store)[0] + ".top_genes.h5"
+
+    def read_top_gene_bytes(self, rows, cols):
+        """
+        Read columns of the packed top-gene index for some conditions.
+
+        The index is chunked by blocks of conditions and a few bytes of genes, so only the chunks holding the
+        requested bytes are read and decompressed.
+
+        Args:
+            rows (slice or numpy.ndarray): The conditions, as a range or as positions in increasing order.
+            cols (numpy.ndarray): The bytes of the packed rows, in increasing order.
+
+        Returns:
+            numpy.ndarray: The uint8 (conditions x cols) bytes.
+        """
+        index = self.top_gene_index
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+            bits = np.zeros((len(rows), len(cols)), dtype=np.uint8)
+            # positions are gathered per chunk of conditions, so that every chunk is read once
+            chunk_rows = index.chunks[0] if index.chunks is not None else index.shape[0]
+            windows = rows // chunk_rows
+            bounds = np.flatnonzero(np.diff(windows)) + 1
+            for selected in np.split(np.arange(len(rows)), bounds):
+                if len(selected) == 0:
+                    continue
+                start = int(windows[selected[0]]) * chunk_rows
+                stop = min(start + chunk_rows, index.shape[0])
+                bits[selected] = self.read_top_gene_bytes(slice(start, stop), cols)[rows[selected] - start]
+            return bits
+        start, stop, _ = rows.indices(index.shape[0])
+        if len(cols) == 0 or stop <= start:
+            return np.zeros((max(stop - start, 0), len(cols)), dtype=np.uint8)
+        if len(cols) > index.shape[1] // 2:
+            # selecting most of the bytes costs more than reading whole rows
+            return index[start:stop][:, cols]
+        return index[start:stop, cols]
+
+    def get_block_reader(self):
+        """
+        Return the positional reader of the transcriptomic matrix, bound to the currently open backing file.
+
+        Returns:
+            Block_reader: The reader, whose float32 buffer is shared by all reads of this object.
+        """
+        # anndata may reopen the backing file, which invalidates previously obtained datasets
+        self.block_reader.X = self.memmap_adata.X
+        return self.block_reader
+
     def list_to_dc_geneset(self, list_test_geneset):
         """
         Convert a list of genes to a pandas DataFrame representing a gene set.
@@ -64,17 +283,51 @@ class Transcriptome_enrichment:
             pandas.DataFrame: A DataFrame containing the results of the decouplr algorithm, including the p-values,
             estimates, and corrected p-values (if applicable).
         """
+        positions = self.memmap_adata.obs.index.get_indexer(samples_list)
+        positions = np.unique(positions[positions >= 0])
+        if len(positions) > 0 and positions[-1] - positions[0] + 1 == len(positions):
+            block = self.get_block_reader().read(positions[0], positions[-1] + 1)
+        else:
+            block = Block_reader(self.memmap_adata.X[positions], self.finite_values).read(0, len(positions))
+        return self.run_decouplr_on_block(genelist, block, self.memmap_adata.obs.index[positions])
+
+    def run_decouplr_on_rows(self, genelist, start, stop):
+        """
+        Runs the decouplr algorithm on a contiguous range of rows of the memmaped AnnData object.
+
+        Args:
+            genelist (dict or list): The gene list to use for the decouplr algorithm. It can be either a dictionary
+                representing a geneset or a list of genes.
+            start (int): The first row of the range.
+            stop (int): The row after the last row of the range.
+
+        Returns:
+            pandas.DataFrame: The results of the decouplr algorithm, as for ``run_decouplr_on_memmaped_adata_with_samples``.
+        """
+        block = self.get_block_reader().read(start, stop)
+        return self.run_decouplr_on_block(genelist, block, self.memmap_adata.obs.index[start:stop])
+
+    def run_decouplr_on_block(self, genelist, block, obs_names):
+        """
+        Runs the decouplr algorithm on a dense block of the transcriptomic matrix.
+
+        Args:
+            genelist (dict or list): The gene list to use for the decouplr algorithm. It can be either a dictionary
+                representing a geneset or a list of genes.
+            block (numpy.ndarray): A float32 (conditions x genes) block without non-finite values.
+            obs_names (pandas.Index): The names of the conditions in the block.
+
+        Returns:
+            pandas.DataFrame: The results of the decouplr algorithm, as for ``run_decouplr_on_memmaped_adata_with_samples``.
+        """
         if isinstance(genelist, dict):
             geneset = self.list_to_dc_geneset_dictionary(genelist)
         elif isinstance(genelist, list):
             geneset = self.list_to_dc_geneset(genelist)
         else:
-            print(genelist)
+            raise TypeError(f"genelist should be a dict or a list, not {type(genelist).__name__}.")
 
-        adata = self.memmap_adata
-        query_adata = adata[adata.obs.index.isin(samples_list)].to_memory()
-        query_adata.var_names_make_unique()
-        np.nan_to_num(query_adata.X, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        query_adata = ad.AnnData(block, obs=pd.DataFrame(index=obs_names), var=pd.DataFrame(index=self.gene_index))
 
         dc.run_ora(
             mat=query_adata,
@@ -83,7 +336,8 @@ class Transcriptome_enrichment:
             target='genesymbol',
             verbose=False,
             use_raw=False,
-            min_n=1
+            min_n=1,
+            n_up=self.decoupler_n_up
         )
 
         if query_adata.obsm["ora_pvals"].shape[1] > 1:
@@ -94,5 +348,727 @@ class Transcriptome_enrichment:
             _, p_corrected, _, _ = smm.multipletests(res['pvals'], method='fdr_bh')
             res['p_corrected'] = p_corrected
             return res
-    
 
+    def geneset_to_mask(self, genelist):
+        """
+        Convert a list of genes to a boolean mask over the genes of the transcriptomic matrix.
+
+        Gene symbols are matched against the deduplicated gene names, in the same way as
+        ``var_names_make_unique`` does for the decoupler path.
+
+        Args:
+            genelist (list): A list of gene symbols.
+
+        Returns:
+            numpy.ndarray: A boolean array with one entry per gene, True for genes in the gene set.
+        """
+        return self.gene_index.isin(genelist)
+
+    @staticmethod
+    def get_top_genes(block, n_up):
+        """
+        Select the indices of the n_up most expressed genes in each row of a block.
+
+        Args:
+            block (numpy.ndarray): A dense (conditions x genes) block of the transcriptomic matrix.
+            n_up (int): The number of top genes to select per row.
+
+        Returns:
+            numpy.ndarray: A (conditions x n_up) array of gene indices. The order within a row is arbitrary.
+        """
+        return np.argpartition(block, block.shape[1] - n_up, axis=1)[:, -n_up:]
+
+    @staticmethod
+    def hypergeometric_pvals(overlaps, set_size, n_up, n_background=20000):
+        """
+        Compute one-sided hypergeometric p-values for gene set overlaps.
+
+        This is the right tail of the Fisher's exact test used by ``dc.run_ora``.
+
+        Overlaps only take a few distinct values, so the survival function is evaluated once per value
+        and gene set and looked up for every condition.
+
+        Args:
+            overlaps (numpy.ndarray): The number of gene set members among the top genes of each condition, with one
+                column per gene set when several gene sets are scored.
+            set_size (int or numpy.ndarray): The number of genes in the gene set, or in each gene set.
+            n_up (int): The number of top genes selected per condition.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Returns:
+            numpy.ndarray: The p-values, with the shape of overlaps.
+        """
+        overlaps = np.asarray(overlaps, dtype=np.int64)
+        set_sizes = np.atleast_1d(set_size)
+        table = hypergeom.sf(np.arange(overlaps.max(initial=0) + 1)[:, None] - 1, n_background, set_sizes, n_up)
+        if np.ndim(set_size) == 0:
+            return table[overlaps, 0]
+        return table[overlaps, np.arange(len(set_sizes))]
+
+    def pvals_to_dataframe(self, pvals, index=None):
+        """
+        Assemble ORA p-values into the result layout of ``run_decouplr_on_memmaped_adata_with_samples``.
+
+        Args:
+            pvals (numpy.ndarray): The p-values, one per condition.
+            index (pandas.Index, optional): The conditions scored. Defaults to all conditions.
+
+        Returns:
+            pandas.DataFrame: A DataFrame with the columns 'pvals', 'estimate' and 'p_corrected', where the
+            Benjamini-Hochberg correction is applied over all the p-values at once.
+        """
+        if index is None:
+            index = self.memmap_adata.obs.index
+        res = pd.DataFrame({"pvals": pvals}, index=index)
+        with np.errstate(divide="ignore"):
+            res["estimate"] = -np.log10(res["pvals"])
+        _, p_corrected, _, _ = smm.multipletests(res["pvals"], method="fdr_bh")
+        res["p_corrected"] = p_corrected
+        return res
+
+    @staticmethod
+    def native_ora_pvals(reader, mask, start, stop, n_up, n_background=20000, batch_size=1000, progress=True):
+        """
+        Compute ORA p-values of a gene set for a contiguous range of rows of a transcriptomic matrix.
+
+        Args:
+            reader (Block_reader): The reader of the transcriptomic matrix.
+            mask (numpy.ndarray): A boolean gene mask, as returned by ``geneset_to_mask``.
+            start (int): The first row of the range.
+            stop (int): The row after the last row of the range.
+            n_up (int): The number of top genes per condition.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            progress (bool, optional): Whether to show a progress bar. Defaults to True.
+
+        Returns:
+            numpy.ndarray: The p-values of the rows in the range.
+        """
+        pvals = np.ones(stop - start, dtype=np.float64)
+        for i in tqdm(range(start, stop, batch_size), disable=not progress):
+            block = reader.read(i, min(i + batch_size, stop))
+            pvals[i - start:i - start + len(block)] = Transcriptome_enrichment.block_ora_pvals(block, mask, n_up, n_background)
+        return pvals
+
+    @staticmethod
+    def block_ora_pvals(block, mask, n_up, n_background=20000):
+        """
+        Compute ORA p-values of a gene set for a block of conditions.
+
+        Args:
+            block (numpy.ndarray): The counts of the conditions, with one row per condition.
+            mask (numpy.ndarray): A boolean gene mask, as returned by ``geneset_to_mask``.
+            n_up (int): The number of top genes per condition.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Returns:
+            numpy.ndarray: The p-values of the conditions in the block.
+        """
+        top_genes = Transcriptome_enrichment.get_top_genes(block, n_up)
+        overlaps = mask[top_genes].sum(axis=1)
+        pvals = Transcriptome_enrichment.hypergeometric_pvals(overlaps, int(mask.sum()), n_up, n_background)
+        # decoupler drops conditions without counts; keep them, but never as hits
+        pvals[~block.any(axis=1)] = 1.0
+        return pvals
+
+    def iter_native_ora_pvals(self, genelist, batch_size=1000, n_up=None, n_background=20000, workers=1):
+        """
+        Compute ORA p-values of a gene set against every condition, yielding them one row range at a time.
+
+        Rows are streamed in contiguous blocks, the top n_up genes of each row are selected with ``argpartition``,
+        overlaps are counted against a gene mask, and p-values are computed in one call per block. With more than
+        one worker, the rows are split into contiguous ranges which are scored by a process pool, and each worker
+        opens the backing h5ad file read-only.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            n_up (int, optional): The number of top genes per condition. Defaults to 5% of the genes of the gene universe, as in decoupler.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+            workers (int, optional): The number of worker processes. Defaults to 1.
+
+        Yields:
+            tuple: The first row, the row after the last row, and the p-values of each range, in row order.
+        """
+        adata = self.memmap_adata
+        n_obs = adata.n_obs
+        if n_up is None:
+            n_up = self.default_n_up
+        mask = self.geneset_to_mask(genelist)
+        if mask.sum() == 0:
+            raise ValueError("No genes from the gene set found in the transcriptome.")
+
+        if workers <= 1:
+            reader = self.get_block_reader()
+            for start in tqdm(range(0, n_obs, batch_size)):
+                stop = min(start + batch_size, n_obs)
+                yield start, stop, self.native_ora_pvals(reader, mask, start, stop, n_up, n_background, batch_size, progress=False)
+            return
+
+        if adata.filename is None:
+            raise ValueError("Parallel transcriptome search requires a backed transcriptomic vector store.")
+        # several ranges per worker, so that a slow range does not hold up the pool
+        bounds = np.linspace(0, n_obs, workers * 4 + 1).astype(int)
+        starts, stops = bounds[:-1], bounds[1:]
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = executor.map(
+                score_row_range, repeat(str(adata.filename)), repeat(mask), starts, stops,
+                repeat(n_up), repeat(n_background), repeat(batch_size), repeat(self.finite_values)
+            )
+            for start, stop, range_pvals in tqdm(zip(starts, stops, results), total=len(starts)):
+                yield start, stop, range_pvals
+
+    def run_native_ora(self, genelist, batch_size=1000, n_up=None, n_background=20000, workers=1):
+        """
+        Run over-representation analysis of a gene set against every condition in the transcriptomic matrix.
+
+        This is a vectorized equivalent of ``run_decouplr_on_memmaped_adata_with_samples`` for a single gene set,
+        computed by ``iter_native_ora_pvals``. Unlike the decoupler path, the gene universe is the full matrix rather
+        than the genes expressed in each batch, ties are not randomized, and the Benjamini-Hochberg correction is
+        applied once over all conditions.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            n_up (int, optional): The number of top genes per condition. Defaults to 5% of the genes of the gene universe, as in decoupler.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+            workers (int, optional): The number of worker processes. Defaults to 1.
+
+        Returns:
+            pandas.DataFrame: A DataFrame indexed by condition with the columns 'pvals', 'estimate' and 'p_corrected'.
+        """
+        pvals = np.ones(self.memmap_adata.n_obs, dtype=np.float64)
+        for start, stop, range_pvals in self.iter_native_ora_pvals(genelist, batch_size, n_up, n_background, workers):
+            pvals[start:stop] = range_pvals
+        return self.pvals_to_dataframe(pvals)
+
+    def count_overlaps_from_index(self, mask, rows=slice(None)):
+        """
+        Count gene set members among the top genes of each condition using the packed top-gene index.
+
+        Only the bytes of the bitset that hold gene set members are read from the index (see ``read_top_gene_bytes``),
+        and overlaps are counted with a popcount of the intersection with the packed gene set mask.
+
+        Args:
+            mask (numpy.ndarray): A boolean gene mask, as returned by ``geneset_to_mask``.
+            rows (slice or numpy.ndarray, optional): The conditions to score, as a range or as positions in
+                increasing order. Defaults to all conditions.
+
+        Returns:
+            numpy.ndarray: The number of overlapping genes per condition.
+        """
+        packed_mask = np.packbits(mask)
+        cols = np.flatnonzero(packed_mask)
+        bits = self.read_top_gene_bytes(rows, cols)
+        return POPCOUNT_TABLE[bits & packed_mask[cols]].sum(axis=1, dtype=np.int64)
+
+    def iter_indexed_ora_pvals(self, genelist, batch_size=50000, n_background=20000):
+        """
+        Compute ORA p-values of a gene set from the top-gene index, yielding them one row range at a time.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            batch_size (int, optional): The number of conditions scored per range. Defaults to 50000.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Yields:
+            tuple: The first row, the row after the last row, and the p-values of each range, in row order.
+        """
+        if self.top_gene_index is None:
+            raise RuntimeError("The transcriptomic vector store has no top-gene index.")
+        mask = self.geneset_to_mask(genelist)
+        set_size = int(mask.sum())
+        if set_size == 0:
+            raise ValueError("No genes from the gene set found in the transcriptome.")
+
+        n_obs = self.memmap_adata.n_obs
+        for start in range(0, n_obs, batch_size):
+            stop = min(start + batch_size, n_obs)
+            overlaps = self.count_overlaps_from_index(mask, slice(start, stop))
+            yield start, stop, self.hypergeometric_pvals(overlaps, set_size, self.top_gene_n_up, n_background)
+
+    def run_indexed_ora(self, genelist, n_background=20000):
+        """
+        Run over-representation analysis of a gene set against every condition using the top-gene index.
+
+        Gives the same results as ``run_native_ora`` with the n_up used to build the index, without reading
+        the expression matrix. The index is added with ``Transcriptome_db_builder.add_top_gene_index``.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Returns:
+            pandas.DataFrame: A DataFrame indexed by condition with the columns 'pvals', 'estimate' and 'p_corrected'.
+        """
+        pvals = np.ones(self.memmap_adata.n_obs, dtype=np.float64)
+        for start, stop, range_pvals in self.iter_indexed_ora_pvals(genelist, n_background=n_background):
+            pvals[start:stop] = range_pvals
+        return self.pvals_to_dataframe(pvals)
+
+    def genesets_to_masks(self, genesets):
+        """
+        Convert gene sets into a sparse gene by gene set membership matrix.
+
+        Args:
+            genesets (dict): A dictionary mapping gene set names to lists of gene symbols.
+
+        Returns:
+            scipy.sparse.csc_matrix: A float32 matrix with one row per gene and one column per gene set, in the order of the dictionary.
+        """
+        masks = np.column_stack([self.geneset_to_mask(genelist) for genelist in genesets.values()])
+        missing = [name for name, found in zip(genesets, masks.any(axis=0)) if not found]
+        if missing:
+            raise ValueError(f"No genes from the gene sets {missing} found in the transcriptome.")
+        return sp.csc_matrix(masks, dtype=np.float32)
+
+    @staticmethod
+    def count_overlaps_many(membership, masks):
+        """
+        Count the members of every gene set among the top genes of each condition.
+
+        Args:
+            membership (scipy.sparse.csr_matrix): A condition by gene matrix with ones at the top genes of each condition.
+            masks (scipy.sparse.csc_matrix): A gene by gene set matrix, as returned by ``genesets_to_masks``.
+
+        Returns:
+            numpy.ndarray: The number of overlapping genes, with one row per condition and one column per gene set.
+        """
+        # sparse by sparse product: the cost grows with the gene set memberships of the top genes only
+        return (membership @ masks).toarray().astype(np.int64)
+
+    def iter_native_ora_pvals_many(self, genesets, batch_size=1000, n_up=None, n_background=20000):
+        """
+        Compute ORA p-values of many gene sets against every condition, reading the transcriptomic matrix once.
+
+        Each row block is read and its top genes selected once, then every gene set is scored against the block
+        with a single sparse matrix product. The p-values are the ones of ``iter_native_ora_pvals`` for each gene set.
+
+        Args:
+            genesets (dict): A dictionary mapping gene set names to lists of gene symbols.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            n_up (int, optional): The number of top genes per condition. Defaults to 5% of the genes of the gene universe, as in decoupler.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Yields:
+            tuple: The first row, the row after the last row, and the p-values of each block, with one column per gene set.
+        """
+        n_obs, n_vars = self.memmap_adata.shape
+        if n_up is None:
+            n_up = self.default_n_up
+        masks = self.genesets_to_masks(genesets)
+        set_sizes = np.asarray(masks.sum(axis=0)).ravel()
+
+        reader = self.get_block_reader()
+        for start in tqdm(range(0, n_obs, batch_size)):
+            stop = min(start + batch_size, n_obs)
+            block = reader.read(start, stop)
+            top_genes = self.get_top_genes(block, n_up)
+            membership = sp.csr_matrix(
+                (np.ones(top_genes.size, dtype=np.float32), top_genes.ravel(), np.arange(0, top_genes.size + 1, n_up)),
+                shape=(len(block), n_vars)
+            )
+            pvals = self.hypergeometric_pvals(self.count_overlaps_many(membership, masks), set_sizes, n_up, n_background)
+            # decoupler drops conditions without counts; keep them, but never as hits
+            pvals[~block.any(axis=1)] = 1.0
+            yield start, stop, pvals
+
+    def iter_indexed_ora_pvals_many(self, genesets, batch_size=1000, n_background=20000):
+        """
+        Compute ORA p-values of many gene sets against every condition, reading the top-gene index once.
+
+        Only the bytes of the bitset that hold members of at least one gene set are read and unpacked.
+
+        Args:
+            genesets (dict): A dictionary mapping gene set names to lists of gene symbols.
+            batch_size (int, optional): The number of conditions scored per block. Defaults to 1000.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Yields:
+            tuple: The first row, the row after the last row, and the p-values of each block, with one column per gene set.
+        """
+        if self.top_gene_index is None:
+            raise RuntimeError("The transcriptomic vector store has no top-gene index.")
+        masks = self.genesets_to_masks(genesets)
+        set_sizes = np.asarray(masks.sum(axis=0)).ravel()
+
+        n_obs, n_vars = self.memmap_adata.shape
+        cols = np.flatnonzero(np.packbits(masks.getnnz(axis=1) > 0))
+        # the genes held by the unpacked bits, with the padding bits of the last byte mapped to no gene set
+        genes = (cols[:, None] * 8 + np.arange(8)).ravel()
+        col_masks = sp.vstack([masks, sp.csc_matrix((8, masks.shape[1]), dtype=np.float32)]).tocsr()[np.minimum(genes, n_vars)]
+        for start in tqdm(range(0, n_obs, batch_size)):
+            stop = min(start + batch_size, n_obs)
+            membership = sp.csr_matrix(np.unpackbits(self.read_top_gene_bytes(slice(start, stop), cols), axis=1), dtype=np.float32)
+            yield start, stop, self.hypergeometric_pvals(
+                self.count_overlaps_many(membership, col_masks), set_sizes, self.top_gene_n_up, n_background
+            )
+
+
+    def sketch_scores(self, genelist):
+        """
+        Approximate the expression of a gene set in every condition from the condition embeddings.
+
+        The embeddings are a Gaussian random projection of the count matrix, so projecting the indicator vector
+        of the gene set with the same matrix gives approximate inner products with every condition in one
+        matrix-vector product. Scores are divided by the norm of each embedding, so that deeply sequenced
+        conditions are not favoured.
+
+        Args:
+            genelist (list): A list of gene symbols.
+
+        Returns:
+            numpy.ndarray: The score of each condition, higher for conditions expressing the gene set more.
+        """
+        if self.projection is None:
+            raise RuntimeError("The transcriptomic vector store has no projection matrix.")
+        mask = self.geneset_to_mask(genelist)
+        if mask.sum() == 0:
+            raise ValueError("No genes from the gene set found in the transcriptome.")
+        embedding = self.memmap_adata.obsm["embedding"]
+        if self.embedding_norms is None:
+            self.embedding_norms = np.linalg.norm(embedding, axis=1)
+            self.embedding_norms[self.embedding_norms == 0] = 1.0
+        return (embedding @ self.projection[mask].sum(axis=0)) / self.embedding_norms
+
+    def shortlist_conditions(self, genelist, n_candidates=5000, positions=None):
+        """
+        Select the conditions with the highest sketch scores for a gene set.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            n_candidates (int, optional): The number of conditions to select. Defaults to 5000.
+            positions (numpy.ndarray, optional): The positions of the conditions to select from, in row order.
+                Defaults to all conditions.
+
+        Returns:
+            numpy.ndarray: The positions of the selected conditions, in row order.
+        """
+        scores = self.sketch_scores(genelist)
+        if positions is None:
+            positions = np.arange(len(scores))
+        scores = scores[positions]
+        n_candidates = min(n_candidates, len(scores))
+        if n_candidates == 0:
+            return positions[:0]
+        return np.sort(positions[np.argpartition(-scores, n_candidates - 1)[:n_candidates]])
+
+    def run_ora_on_positions(self, genelist, positions, use_index=None, batch_size=1000, n_up=None, n_background=20000):
+        """
+        Compute exact ORA p-values of a gene set for the conditions at the given positions.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            positions (numpy.ndarray): The positions of the conditions, in row order.
+            use_index (bool, optional): Whether to count overlaps from the top-gene index instead of reading the
+                count matrix. Defaults to True when the vector store has a top-gene index.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+            n_up (int, optional): The number of top genes per condition when reading the count matrix.
+                Defaults to 5% of the genes of the gene universe, as in decoupler.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Returns:
+            numpy.ndarray: The p-values, one per position.
+        """
+        mask = self.geneset_to_mask(genelist)
+        if mask.sum() == 0:
+            raise ValueError("No genes from the gene set found in the transcriptome.")
+        if use_index is None:
+            use_index = self.top_gene_index is not None
+        if use_index:
+            if self.top_gene_index is None:
+                raise RuntimeError("The transcriptomic vector store has no top-gene index.")
+            overlaps = self.count_overlaps_from_index(mask, positions)
+            return self.hypergeometric_pvals(overlaps, int(mask.sum()), self.top_gene_n_up, n_background)
+
+        if n_up is None:
+            n_up = self.default_n_up
+        pvals = np.ones(len(positions), dtype=np.float64)
+        for lo, hi, block in self.get_block_reader().iter_rows(positions, batch_size):
+            pvals[lo:hi] = self.block_ora_pvals(block, mask, n_up, n_background)
+        return pvals
+
+
+    @staticmethod
+    def stratified_row_ranges(n_obs, batch_size=1000, n_strata=20, random_state=0):
+        """
+        Order the row blocks of the transcriptomic matrix for progressive search.
+
+        The blocks are split into n_strata contiguous strata and shuffled within each stratum. Every n_strata
+        consecutive blocks of the order take one block from each stratum, so any prefix of the order covers the
+        whole matrix evenly, while each block is still read contiguously.
+
+        Args:
+            n_obs (int): The number of conditions.
+            batch_size (int, optional): The number of rows per block. Defaults to 1000.
+            n_strata (int, optional): The number of strata. Defaults to 20.
+            random_state (int, optional): The seed of the shuffle. Defaults to 0.
+
+        Returns:
+            list: The first row and the row after the last row of each block, in visiting order.
+        """
+        starts = np.arange(0, n_obs, batch_size)
+        rng = np.random.default_rng(random_state)
+        strata = [rng.permutation(stratum) for stratum in np.array_split(starts, min(n_strata, len(starts)))]
+        order = [stratum[r] for r in range(max(len(stratum) for stratum in strata)) for stratum in strata if r < len(stratum)]
+        return [(int(start), int(min(start + batch_size, n_obs))) for start in order]
+
+    def iter_ora_pvals_for_row_ranges(self, genelist, row_ranges, use_index=None, n_up=None, n_background=20000):
+        """
+        Compute ORA p-values of a gene set for the given row ranges, in the given order.
+
+        Args:
+            genelist (list): A list of gene symbols.
+            row_ranges (list): The first row and the row after the last row of each range.
+            use_index (bool, optional): Whether to count overlaps from the top-gene index instead of reading the
+                count matrix. Defaults to True when the vector store has a top-gene index.
+            n_up (int, optional): The number of top genes per condition when reading the count matrix.
+                Defaults to 5% of the genes of the gene universe, as in decoupler.
+            n_background (int, optional): The size of the gene background. Defaults to 20000.
+
+        Yields:
+            tuple: The first row, the row after the last row, and the p-values of each range.
+        """
+        mask = self.geneset_to_mask(genelist)
+        set_size = int(mask.sum())
+        if set_size == 0:
+            raise ValueError("No genes from the gene set found in the transcriptome.")
+        if use_index is None:
+            use_index = self.top_gene_index is not None
+        if use_index and self.top_gene_index is None:
+            raise RuntimeError("The transcriptomic vector store has no top-gene index.")
+        if n_up is None:
+            n_up = self.default_n_up
+
+        reader = self.get_block_reader()
+        for start, stop in row_ranges:
+            if use_index:
+                overlaps = self.count_overlaps_from_index(mask, slice(start, stop))
+                yield start, stop, self.hypergeometric_pvals(overlaps, set_size, self.top_gene_n_up, n_background)
+            else:
+                yield start, stop, self.block_ora_pvals(reader.read(start, stop), mask, n_up, n_background)
+
+
+    @staticmethod
+    def log_cpm(block):
+        """
+        Normalize a block of counts to log counts per million, in place.
+
+        Args:
+            block (numpy.ndarray): A float32 (conditions x genes) block without non-finite values.
+
+        Returns:
+            numpy.ndarray: The block, holding log1p of the counts per million. Conditions without counts stay at zero.
+        """
+        totals = block.sum(axis=1, keepdims=True)
+        np.divide(block, np.where(totals > 0, totals, 1.0) / 1e6, out=block)
+        return np.log1p(block, out=block)
+
+    def compute_gene_moments(self, batch_size=1000):
+        """
+        Compute the mean and standard deviation of the log CPM of every gene across the conditions with counts.
+
+        Args:
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+
+        Returns:
+            numpy.ndarray: A float32 (genes x 2) array with the mean and the standard deviation of each gene.
+        """
+        reader = self.get_block_reader()
+        n_obs, n_vars = self.memmap_adata.shape
+        sums = np.zeros(n_vars, dtype=np.float64)
+        squares = np.zeros(n_vars, dtype=np.float64)
+        n_expressed = 0
+        for start in tqdm(range(0, n_obs, batch_size)):
+            block = reader.read(start, min(start + batch_size, n_obs))
+            block = self.log_cpm(block[block.any(axis=1)])
+            sums += block.sum(axis=0)
+            squares += np.square(block, dtype=np.float64).sum(axis=0)
+            n_expressed += len(block)
+        mean = sums / max(n_expressed, 1)
+        std = np.sqrt(np.maximum(squares / max(n_expressed, 1) - mean ** 2, 0.0))
+        return np.column_stack([mean, std]).astype(np.float32)
+
+    def signatures_to_weights(self, signatures):
+        """
+        Convert up and down gene signatures into a sparse gene by signature weight matrix.
+
+        Each gene is weighted by the inverse of its standard deviation across conditions, so that the product with
+        a block of log CPM values gives the mean z-score of the up genes minus the mean z-score of the down genes,
+        up to a constant per signature which is returned as the offset.
+
+        Args:
+            signatures (dict): A dictionary mapping signature names to dictionaries with "up" and/or "down" lists of
+                gene symbols.
+
+        Returns:
+            tuple: A float32 scipy.sparse.csc_matrix with one row per gene and one column per signature, in the order
+                of the dictionary, and the offset of each signature.
+        """
+        if self.gene_moments is None:
+            self.gene_moments = self.compute_gene_moments()
+        mean, std = self.gene_moments[:, 0], self.gene_moments[:, 1]
+        # genes which are constant across conditions carry no signal
+        inverse_std = np.divide(1.0, std, out=np.zeros_like(std), where=std > 0)
+        weights = np.zeros((len(self.gene_index), len(signatures)), dtype=np.float32)
+        missing = []
+        for j, (name, signature) in enumerate(signatures.items()):
+            for direction, sign in (("up", 1.0), ("down", -1.0)):
+                mask = self.geneset_to_mask(signature.get(direction, []))
+                if mask.any():
+                    weights[mask, j] += sign / mask.sum()
+            if not weights[:, j].any():
+                missing.append(name)
+        if missing:
+            raise ValueError(f"No genes from the signatures {missing} found in the transcriptome.")
+        weights *= inverse_std[:, None]
+        return sp.csc_matrix(weights), mean @ weights
+
+    def iter_signature_scores(self, signatures, batch_size=1000):
+        """
+        Score signatures of up and down genes against every condition, reading the transcriptomic matrix once.
+
+        Counts are normalized to log CPM and standardized per gene across conditions. The score of a condition is the
+        mean z-score of the up genes minus the mean z-score of the down genes, so that conditions where the up genes
+        are high and the down genes are low rank first. Each block is scored against every signature with a single
+        matrix product. The mean and standard deviation of the genes are read from varm["log_cpm_moments"] (see
+        ``Transcriptome_db_builder.add_gene_moments``), or computed in a first pass over the matrix.
+
+        Args:
+            signatures (dict): A dictionary mapping signature names to dictionaries with "up" and/or "down" lists of
+                gene symbols.
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+
+        Yields:
+            tuple: The first row, the row after the last row, and the scores of each block, with one column per
+                signature. Conditions without counts score -inf.
+        """
+        weights, offsets = self.signatures_to_weights(signatures)
+        reader = self.get_block_reader()
+        n_obs = self.memmap_adata.n_obs
+        for start in range(0, n_obs, batch_size):
+            stop = min(start + batch_size, n_obs)
+            block = reader.read(start, stop)
+            empty = ~block.any(axis=1)
+            scores = np.asarray(self.log_cpm(block) @ weights) - offsets
+            scores[empty] = -np.inf
+            yield start, stop, scores
+
+    def top_signature_conditions(self, signatures, nsamples=1000, groups=None, selected=None, batch_size=1000):
+        """
+        Select the top conditions of many signatures of up and down genes, in a single pass over the transcriptomic matrix.
+
+        Args:
+            signatures (dict): A dictionary mapping signature names to dictionaries with "up" and/or "down" lists of
+                gene symbols.
+            nsamples (int, optional): The number of conditions kept per signature. Defaults to 1000.
+            groups (numpy.ndarray, optional): An integer group code for every condition, as for ``Top_k_conditions``,
+                to keep the best condition of each group. Defaults to None.
+            selected (numpy.ndarray, optional): A boolean mask of the conditions which may be selected. Defaults to
+                None (every condition).
+            batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+
+        Returns:
+            list: One ``Top_k_conditions`` per signature, in the order of signatures.
+        """
+        top_conditions = [Top_k_conditions(nsamples, groups) for _ in signatures]
+        for start, stop, scores in self.iter_signature_scores(signatures, batch_size=batch_size):
+            positions = np.arange(start, stop)
+            # conditions without counts are never returned
+            keep = np.isfinite(scores).all(axis=1)
+            if selected is not None:
+                keep &= selected[start:stop]
+            for j, selection in enumerate(top_conditions):
+                # the selection keeps the lowest values
+                selection.update(positions[keep], -scores[keep, j])
+        return top_conditions
+
+
+def score_row_range(h5ad_path, mask, start, stop, n_up, n_background=20000, batch_size=1000, finite_values=False):
+    """
+    Compute ORA p-values for a range of rows of a transcriptomic vector store on disk.
+
+    This is the task run by each worker of a parallel transcriptome search. Only the count matrix is
+    opened, so workers do not load the embeddings and metadata of the vector store.
+
+    Args:
+        h5ad_path (str): The path to the transcriptomic vector store.
+        mask (numpy.ndarray): A boolean gene mask, as returned by ``Transcriptome_enrichment.geneset_to_mask``.
+        start (int): The first row of the range.
+        stop (int): The row after the last row of the range.
+        n_up (int): The number of top genes per condition.
+        n_background (int, optional): The size of the gene background. Defaults to 20000.
+        batch_size (int, optional): The number of rows read per block. Defaults to 1000.
+        finite_values (bool, optional): Whether the matrix was cleaned of non-finite values at build time. Defaults to False.
+
+    Returns:
+        numpy.ndarray: The p-values of the rows in the range.
+    """
+    with h5py.File(h5ad_path, "r") as f:
+        X = f["X"] if isinstance(f["X"], h5py.Dataset) else sparse_dataset(f["X"])
+        return Transcriptome_enrichment.native_ora_pvals(
+            Block_reader(X, finite_values), mask, start, stop, n_up, n_background, batch_size, progress=False
+        )
+
+
+class Top_k_conditions:
+    def __init__(self, k, groups=None):
+        """
+        Initializes a running selection of the k conditions with the lowest p-values.
+
+        Only the current best k candidates are kept between updates, so memory does not grow with the
+        number of conditions scored.
+
+        Parameters:
+        - k (int): The number of conditions to keep.
+        - groups (numpy.ndarray, optional): An integer group code (e.g. the series) for every condition. When given,
+          only the best condition of each group is kept, so the selection holds k distinct groups.
+        """
+        self.k = k
+        self.groups = groups
+        self.positions = np.empty(0, dtype=np.int64)
+        self.pvals = np.empty(0, dtype=np.float64)
+
+    def update(self, positions, pvals):
+        """
+        Merge newly scored conditions into the selection.
+
+        Args:
+            positions (numpy.ndarray): The row positions of the scored conditions.
+            pvals (numpy.ndarray): The p-values of the scored conditions.
+
+        Returns:
+            None
+        """
+        positions = np.concatenate([self.positions, np.asarray(positions, dtype=np.int64)])
+        pvals = np.concatenate([self.pvals, np.asarray(pvals, dtype=np.float64)])
+        if self.groups is not None:
+            groups = self.groups[positions]
+            order = np.lexsort((positions, pvals, groups))
+            first_of_group = np.r_[True, groups[order][1:] != groups[order][:-1]]
+            keep = order[first_of_group]
+            positions, pvals = positions[keep], pvals[keep]
+        if len(pvals) > self.k:
+            # ties are broken in favour of the earlier row, so results do not depend on the update order
+            keep = np.lexsort((positions, pvals))[:self.k]
+            positions, pvals = positions[keep], pvals[keep]
+        self.positions, self.pvals = positions, pvals
+
+    def get_positions(self):
+        """
+        Return the row positions of the selected conditions.
+
+        Returns:
+            numpy.ndarray: The positions, sorted in row order.
+        """
+        return np.sort(self.positions)
+
+    def get_ranked_positions(self):
+        """
+        Return the row positions of the selected conditions, from the best to the worst.
+
+        Returns:
+            numpy.ndarray: The positions, sorted by p-value, with ties in row order.
+        """
+        return self.positions[np.lexsort((self.positions, self.pvals))]
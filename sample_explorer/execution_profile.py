@@ -0,0 +1,208 @@
+import glob
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+import anndata as ad
+from .enrichment import Transcriptome_enrichment
+from .search_cache import Search_cache
+
+
+class Execution_profile:
+    # approximate peak bytes allocated per condition and per gene by each batched path: the float32 block and
+    # the int64 argpartition of native ORA and signature scores, the packed top-gene bytes of the index, and
+    # the AnnData copies and rank matrices of decoupler, which for ARCHS4 samples also hold the integer counts
+    bytes_per_gene = {"native": 13, "index": 0.25, "decoupler": 32, "signature": 13, "samples": 48}
+    # the block sizes used before profiles existed, kept when a path has not been tuned
+    default_batch_sizes = {"native": 1000, "index": 50000, "decoupler": 500, "signature": 1000, "samples": 2500}
+
+    def __init__(self, profile_path=None, max_memory=None):
+        """
+        Initializes the execution profile, which sets the number of conditions per block of every batched search and enrichment path.
+
+        A profile written by ``autotune`` holds the fastest block size of each path on the machine and vector store it
+        was tuned on. Block sizes are then capped so that the memory of a block stays within max_memory. Without a
+        profile, the historical block sizes are used, capped in the same way.
+
+        Parameters:
+        - profile_path (str): The path to a JSON profile written by ``autotune`` (default is None, no tuned block sizes).
+          Missing files are ignored.
+        - max_memory (int or str): The memory budget of a block in bytes, or a size such as "512M" or "8G" (default is
+          the budget of the profile, or no budget).
+        """
+        self.profile_path = profile_path
+        self.profile = {}
+        if profile_path is not None and os.path.exists(profile_path):
+            with open(profile_path) as f:
+                self.profile = json.load(f)
+        self.batch_sizes = self.profile.get("batch_sizes", {})
+        if max_memory is None:
+            max_memory = self.profile.get("max_memory")
+        self.max_memory = None if max_memory is None else self.parse_memory(max_memory)
+
+    @staticmethod
+    def parse_memory(value):
+        """
+        Convert a memory size to bytes.
+
+        Args:
+            value (int or str): A number of bytes, or a number followed by one of the binary units K, M, G or T,
+                e.g. "512M" or "8G".
+
+        Returns:
+            int: The number of bytes.
+        """
+        if isinstance(value, (int, np.integer, float)):
+            return int(value)
+        match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)i?B?\s*", str(value), flags=re.IGNORECASE)
+        if match is None:
+            raise ValueError(f"Invalid memory size {value}, expected e.g. 512M or 8G.")
+        return int(float(match.group(1)) * 1024 ** " KMGT".index(match.group(2).upper() or " "))
+
+    @staticmethod
+    def get_machine():
+        """
+        Describe the resources of the machine which affect the block sizes.
+
+        Returns:
+            dict: The number of CPUs, the physical memory in bytes and the size of the largest CPU cache in bytes,
+                with None for values the platform does not report.
+        """
+        try:
+            total_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (AttributeError, ValueError, OSError):
+            total_memory = None
+        cache_sizes = []
+        for path in glob.glob("/sys/devices/system/cpu/cpu0/cache/index*/size"):
+            with open(path) as f:
+                cache_sizes.append(Execution_profile.parse_memory(f.read()))
+        return {
+            "cpu_count": os.cpu_count(),
+            "total_memory": total_memory,
+            "cache_bytes": max(cache_sizes) if cache_sizes else None,
+        }
+
+    def get_batch_size(self, path, n_genes, workers=1, extra_bytes_per_row=0, default=None):
+        """
+        Return the number of conditions per block of a batched path.
+
+        Args:
+            path (str): The batched path, one of "native", "index", "decoupler", "signature" or "samples".
+            n_genes (int): The number of genes of the blocks.
+            workers (int, optional): The number of processes holding a block at the same time. Defaults to 1.
+            extra_bytes_per_row (int, optional): The bytes allocated per condition on top of the gene blocks, e.g.
+                the p-values of many gene sets. Defaults to 0.
+            default (int, optional): The block size when the path has not been tuned. Defaults to the historical
+                block size of the path.
+
+        Returns:
+            int: The block size, at least one condition.
+        """
+        if path not in self.bytes_per_gene:
+            raise ValueError(f"path should be one of {list(self.bytes_per_gene)}.")
+        batch_size = self.batch_sizes.get(path, self.default_batch_sizes[path] if default is None else default)
+        if self.max_memory is not None:
+            bytes_per_row = self.bytes_per_gene[path] * n_genes + extra_bytes_per_row
+            batch_size = min(batch_size, self.max_memory // (bytes_per_row * workers))
+        return max(int(batch_size), 1)
+
+    @staticmethod
+    def time_blocks(run, n_rows, batch_size):
+        """
+        Time a batched path over the first n_rows conditions.
+
+        Args:
+            run (callable): A function scoring a list of (start, stop) row ranges.
+            n_rows (int): The number of conditions scored.
+            batch_size (int): The number of conditions per block.
+
+        Returns:
+            float: The seconds per condition.
+        """
+        row_ranges = [(start, min(start + batch_size, n_rows)) for start in range(0, n_rows, batch_size)]
+        started = time.perf_counter()
+        run(row_ranges)
+        return (time.perf_counter() - started) / n_rows
+
+    @staticmethod
+    def autotune(transcriptomic_vector_store, profile_path, max_memory=None, candidates=(250, 500, 1000, 2000, 4000, 8000),
+                 n_rows=16000, random_state=0):
+        """
+        Benchmark the batched paths on this machine and vector store, and write the fastest block sizes to a profile.
+
+        Every path scores a random gene set over the same leading conditions with each candidate block size which
+        fits in max_memory; the conditions are read once beforehand, so the candidates are compared on warm reads.
+        The fastest candidate is kept, or the smallest candidate within 5% of it, which leaves more memory and
+        cache to the rest of the search. decoupler is benchmarked on a quarter of the conditions, as it is much
+        slower. Signature search reads the same blocks as native ORA and takes its block size. ARCHS4 sample
+        enrichment depends on the ARCHS4 file rather than on the vector store and is only capped by max_memory.
+
+        Args:
+            transcriptomic_vector_store (str): The path to the transcriptomic vector store.
+            profile_path (str): The path of the JSON profile to write.
+            max_memory (int or str, optional): The memory budget of a block, as for ``Execution_profile``.
+                Defaults to a quarter of the physical memory.
+            candidates (tuple, optional): The block sizes benchmarked. Defaults to 250 to 8000 conditions.
+            n_rows (int, optional): The number of conditions scored per candidate. Defaults to 16000.
+            random_state (int, optional): The seed of the benchmark gene set. Defaults to 0.
+
+        Returns:
+            Execution_profile: The tuned profile.
+        """
+        machine = Execution_profile.get_machine()
+        if max_memory is None and machine["total_memory"] is not None:
+            max_memory = machine["total_memory"] // 4
+        profile = Execution_profile(max_memory=max_memory)
+        adata = ad.read_h5ad(transcriptomic_vector_store, backed="r")
+        te = Transcriptome_enrichment(adata)
+        n_rows = min(n_rows, adata.n_obs)
+        genelist = list(np.random.default_rng(random_state).choice(te.gene_index, size=min(100, adata.n_vars), replace=False))
+
+        def consume(blocks):
+            for _ in blocks:
+                pass
+
+        paths = {
+            "native": (n_rows, lambda row_ranges: consume(te.iter_ora_pvals_for_row_ranges(genelist, row_ranges, use_index=False))),
+            "decoupler": (max(n_rows // 4, 1), lambda row_ranges: [te.run_decouplr_on_rows(genelist, start, stop) for start, stop in row_ranges]),
+        }
+        if te.top_gene_index is not None:
+            paths["index"] = (n_rows, lambda row_ranges: consume(te.iter_ora_pvals_for_row_ranges(genelist, row_ranges, use_index=True)))
+
+        reader = te.get_block_reader()
+        for start in range(0, n_rows, min(candidates)):
+            reader.read(start, min(start + min(candidates), n_rows))
+
+        seconds_per_row = {}
+        for path, (path_rows, run) in paths.items():
+            cap = profile.get_batch_size(path, adata.n_vars, default=max(candidates))
+            sizes = sorted({min(size, cap, path_rows) for size in candidates})
+            try:
+                seconds_per_row[path] = {str(size): Execution_profile.time_blocks(run, path_rows, size) for size in sizes}
+            except Exception as e:
+                # e.g. decoupler drops conditions without counts; the path keeps its historical block size
+                logging.warning(f"The {path} path could not be benchmarked: {str(e)}")
+                continue
+            fastest = min(seconds_per_row[path].values())
+            profile.batch_sizes[path] = min(int(size) for size, seconds in seconds_per_row[path].items() if seconds <= fastest * 1.05)
+        # signature scores read the same float32 blocks as native ORA and always scan the whole store
+        if "native" in profile.batch_sizes:
+            profile.batch_sizes["signature"] = profile.batch_sizes["native"]
+
+        profile.profile = {
+            "max_memory": profile.max_memory,
+            "machine": machine,
+            "transcriptomic_vector_store": {
+                "path": transcriptomic_vector_store,
+                "fingerprint": Search_cache.fingerprint_file(transcriptomic_vector_store),
+                "shape": list(adata.shape),
+            },
+            "batch_sizes": profile.batch_sizes,
+            "seconds_per_row": seconds_per_row,
+        }
+        profile.profile_path = profile_path
+        with open(profile_path, "w") as f:
+            json.dump(profile.profile, f, indent=2)
+        return profile
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import anndata as ad
+import scipy.sparse as sp
+from anndata.utils import make_index_unique
+
+
+class Expression_profile:
+    def __init__(self, gene_index, projection):
+        """
+        Initializes the embedding of user count matrices into the space of the transcriptomic vector store.
+
+        Samples are aligned to the genes of the vector store, averaged per condition and stored as float16 counts, as
+        the conditions of the vector store were built, then projected with the stored random projection matrix.
+
+        Parameters:
+        - gene_index (pandas.Index): The unique gene names of the transcriptomic vector store, in column order.
+        - projection (numpy.ndarray): The (genes x components) random projection matrix of the vector store (varm["projection"]).
+        """
+        self.gene_index = gene_index
+        self.projection = projection
+
+    def iter_count_blocks(self, counts, batch_size=1000):
+        """
+        Read a user count matrix in blocks of samples, with the genes aligned to the transcriptomic vector store.
+
+        Genes are matched by symbol after making duplicated symbols unique, as in the vector store. Genes missing
+        from the user matrix are zero, and genes absent from the vector store are dropped.
+
+        Args:
+            counts (str or anndata.AnnData or pandas.DataFrame): The counts, with one row per sample and one column per
+                gene, as an AnnData object, a DataFrame, or the path to an h5ad or a CSV file (samples as rows, with
+                the sample names in the first column). h5ad files are read in backed mode, and CSV files in chunks.
+            batch_size (int, optional): The number of samples per block. Defaults to 1000.
+
+        Yields:
+            tuple: The names of the samples of each block, and a float32 (samples x genes) block in the gene order of
+                the vector store, without non-finite values.
+        """
+        if isinstance(counts, str) and counts.endswith(".csv"):
+            chunks = pd.read_csv(counts, index_col=0, chunksize=batch_size)
+        elif isinstance(counts, pd.DataFrame):
+            chunks = (counts.iloc[start:start + batch_size] for start in range(0, len(counts), batch_size))
+        else:
+            adata = ad.read_h5ad(counts, backed="r") if isinstance(counts, str) else counts
+            chunks = (
+                (adata.obs_names[start:start + batch_size], adata.var_names, adata.X[start:start + batch_size])
+                for start in range(0, adata.n_obs, batch_size)
+            )
+
+        columns = None
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                samples, genes, values = chunk.index, chunk.columns, chunk.values
+            else:
+                samples, genes, values = chunk
+            if columns is None:
+                columns = self.gene_index.get_indexer(make_index_unique(pd.Index(genes.astype(str))))
+                if (columns < 0).all():
+                    raise ValueError("No genes from the count matrix found in the transcriptome.")
+            if sp.issparse(values):
+                values = values.toarray()
+            block = np.zeros((len(samples), len(self.gene_index)), dtype=np.float32)
+            block[:, columns[columns >= 0]] = np.asarray(values, dtype=np.float32)[:, columns >= 0]
+            yield pd.Index(samples), np.nan_to_num(block, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+    def aggregate(self, counts, groups=None, batch_size=1000):
+        """
+        Average the samples of a user count matrix into conditions, as the conditions of the vector store were built.
+
+        Args:
+            counts (str or anndata.AnnData or pandas.DataFrame): The counts, as for ``iter_count_blocks``.
+            groups (dict or pandas.Series or str, optional): The condition of every sample, as a mapping from sample
+                names to condition names, or the name of an obs column of an h5ad file or AnnData object. Defaults to
+                one condition per sample.
+            batch_size (int, optional): The number of samples read per block. Defaults to 1000.
+
+        Returns:
+            pandas.DataFrame: The mean counts, rounded to float16, with one row per condition and one column per gene
+                of the vector store.
+        """
+        if isinstance(groups, str):
+            adata = ad.read_h5ad(counts, backed="r") if isinstance(counts, str) else counts
+            groups = adata.obs[groups].astype(str)
+            counts = adata
+        sums, sizes = {}, {}
+        for samples, block in self.iter_count_blocks(counts, batch_size):
+            labels = samples if groups is None else pd.Index(pd.Series(samples).map(groups))
+            if labels.isna().any():
+                raise ValueError(f"No condition given for the samples {list(samples[labels.isna()])}.")
+            codes, names = pd.factorize(labels)
+            # sums of the block rows of each condition, with one sparse product
+            indicator = sp.csr_matrix((np.ones(len(codes), dtype=np.float32), (codes, np.arange(len(codes)))), shape=(len(names), len(codes)))
+            block_sums = indicator @ block
+            for name, row, size in zip(names, block_sums, np.bincount(codes)):
+                sums[name] = sums[name] + row if name in sums else row
+                sizes[name] = sizes.get(name, 0) + size
+        names = list(sums)
+        means = np.vstack([sums[name] / sizes[name] for name in names])
+        return pd.DataFrame(means.astype(np.float16), index=pd.Index(names, name="condition"), columns=self.gene_index)
+
+    def embed(self, condition_counts, batch_size=1000):
+        """
+        Project condition counts with the random projection matrix of the vector store.
+
+        Args:
+            condition_counts (pandas.DataFrame): The counts of the conditions, as returned by ``aggregate``.
+            batch_size (int, optional): The number of conditions projected per block. Defaults to 1000.
+
+        Returns:
+            numpy.ndarray: The float32 (conditions x components) embeddings.
+        """
+        values = condition_counts.values
+        embeddings = np.empty((len(values), self.projection.shape[1]), dtype=np.float32)
+        for start in range(0, len(values), batch_size):
+            embeddings[start:start + batch_size] = values[start:start + batch_size].astype(np.float32) @ self.projection
+        return embeddings
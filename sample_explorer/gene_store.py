@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import h5py
+
+
+class Gene_major_store:
+    def __init__(self, gene_store_path):
+        """
+        Initializes a gene-major companion store of the transcriptomic count matrix.
+
+        The store holds the count matrix transposed (genes x conditions), chunked over a few genes at a time, so the
+        profile of a gene across every condition is read without touching the rest of the matrix. Stores are
+        written with ``Transcriptome_db_builder.write_gene_major_store``.
+
+        Parameters:
+        - gene_store_path (str): The path to the gene-major store (HDF5).
+        """
+        self.gene_store_path = gene_store_path
+        self.file = h5py.File(gene_store_path, "r")
+        self.X = self.file["X"]
+        self.genes = pd.Index(self.file["genes"].asstr()[:])
+        self.conditions = pd.Index(self.file["conditions"].asstr()[:])
+
+    def read_genes(self, genes):
+        """
+        Read the counts of the given genes across every condition.
+
+        Args:
+            genes (list): A list of gene symbols. Genes missing from the store are skipped.
+
+        Returns:
+            tuple: The genes found, in the order given, and a float32 array with one row per gene found and one column per condition.
+        """
+        genes = pd.Index(pd.unique(np.asarray(genes, dtype=object)))
+        found = genes[genes.isin(self.genes)]
+        rows = self.genes.get_indexer(found)
+        order = np.argsort(rows)
+        values = np.empty((len(rows), self.X.shape[1]), dtype=np.float32)
+        if len(rows):
+            # HDF5 point selections must be increasing
+            values[order] = self.X[rows[order]]
+        return list(found), values
+
+    def gene_profile(self, genes):
+        """
+        Return the expression profile of the given genes across every condition.
+
+        Args:
+            genes (list): A list of gene symbols.
+
+        Returns:
+            pandas.DataFrame: The counts, with one row per condition and one column per gene found.
+        """
+        found, values = self.read_genes(genes)
+        return pd.DataFrame(values.T, index=self.conditions, columns=found)
+
+    def panel_scores(self, genes, method="zscore"):
+        """
+        Score every condition by the expression of a gene panel.
+
+        Counts are log1p transformed. With "mean", the score is the mean of the panel genes. With "zscore", each gene
+        is first standardized across conditions, so that highly expressed genes do not dominate the panel.
+
+        Args:
+            genes (list): A list of gene symbols.
+            method (str, optional): Either "mean" or "zscore". Defaults to "zscore".
+
+        Returns:
+            numpy.ndarray: The score of each condition, higher for conditions expressing the panel more.
+        """
+        if method not in ("mean", "zscore"):
+            raise ValueError("method should be one of 'mean' or 'zscore'.")
+        found, values = self.read_genes(genes)
+        if len(found) == 0:
+            raise ValueError("No genes from the gene panel found in the gene-major store.")
+        values = np.log1p(values)
+        if method == "zscore":
+            std = values.std(axis=1, keepdims=True)
+            values = (values - values.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1.0)
+        return values.mean(axis=0)
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import statsmodels.stats.multitest as smm
+from scipy.special import gammaln
+from .utils import read_gmt
+
+
+class Gene_set_library:
+    def __init__(self, gmt_path, name=None):
+        """
+        Initializes a gene set library, held as a sparse gene by term matrix, for local Enrichr-style enrichment analysis.
+
+        Query gene sets are scored against every term of the library with one sparse matrix product, so that
+        thousands of gene sets are enriched without calling the Enrichr API.
+
+        Parameters:
+        - gmt_path (str): The path to the gene set library in GMT format, e.g. RNAseq_Automatic_GEO_Signatures_Human_Up
+          downloaded from the Enrichr libraries or an MSigDB file.
+        - name (str): The name of the library, reported in the Gene_set column (default is the file name).
+        """
+        self.name = name if name is not None else gmt_path.rsplit("/", 1)[-1].replace(".gmt", "")
+        gene_sets = read_gmt(gmt_path)
+        # Enrichr libraries may weight their genes as "GENE,1.0"
+        gene_sets = {term: [gene.split(",")[0] for gene in genes] for term, genes in gene_sets.items()}
+        self.terms = pd.Index(list(gene_sets))
+        self.genes = pd.Index(pd.unique(np.concatenate([np.asarray(genes, dtype=object) for genes in gene_sets.values()])))
+        rows = np.concatenate([self.genes.get_indexer(pd.unique(np.asarray(genes, dtype=object))) for genes in gene_sets.values()])
+        term_sizes = [len(pd.unique(np.asarray(genes, dtype=object))) for genes in gene_sets.values()]
+        cols = np.repeat(np.arange(len(self.terms)), term_sizes)
+        self.matrix = sp.csc_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(self.genes), len(self.terms))
+        )
+        self.term_sizes = np.asarray(term_sizes, dtype=np.int64)
+
+    @staticmethod
+    def hypergeometric_sf(k, n_background, m, n, rtol=1e-17):
+        """
+        Compute the probability of an overlap of at least k genes between random gene sets of sizes m and n.
+
+        The tail which does not contain the mode of the distribution is summed term by term, with the ratio of
+        consecutive probabilities, until the terms are negligible. This is vectorized over all the overlaps, unlike
+        ``scipy.stats.hypergeom.sf`` which costs tens of microseconds per value.
+
+        Args:
+            k (numpy.ndarray): The overlaps.
+            n_background (int): The number of genes in the background.
+            m (numpy.ndarray): The sizes of the first gene sets.
+            n (numpy.ndarray): The sizes of the second gene sets.
+            rtol (float, optional): The relative size at which the summation stops. Defaults to 1e-17.
+
+        Returns:
+            numpy.ndarray: The p-values, equal to ``hypergeom.sf(k - 1, n_background, m, n)``.
+        """
+        k, m, n = np.broadcast_arrays(np.asarray(k, dtype=np.int64), np.asarray(m, dtype=np.int64), np.asarray(n, dtype=np.int64))
+        shape = k.shape
+        k, m, n = k.ravel(), m.ravel(), n.ravel()
+        lower, upper = np.maximum(0, m + n - n_background), np.minimum(m, n)
+        # the right tail is summed from k, otherwise the left tail is summed from k - 1 and subtracted from one
+        right = k > (n + 1) * (m + 1) // (n_background + 2)
+        x = np.where(right, k, k - 1).astype(np.float64)
+        m, n, total_genes = m.astype(np.float64), n.astype(np.float64), float(n_background)
+
+        def log_binom(a, b):
+            return gammaln(a + 1) - gammaln(b + 1) - gammaln(a - b + 1)
+
+        in_support = (x >= lower) & (x <= upper)
+        start = np.clip(x, lower, upper)
+        term = np.where(
+            in_support, np.exp(log_binom(m, start) + log_binom(total_genes - m, n - start) - log_binom(total_genes, n)), 0.0
+        )
+        total = term.copy()
+        active = np.flatnonzero(in_support & (term > 0) & np.where(right, x < upper, x > lower))
+        while len(active):
+            xi, mi, ni, ri = x[active], m[active], n[active], right[active]
+            term[active] *= np.where(
+                ri,
+                (mi - xi) * (ni - xi) / ((xi + 1) * (total_genes - mi - ni + xi + 1)),
+                xi * (total_genes - mi - ni + xi) / ((mi - xi + 1) * (ni - xi + 1))
+            )
+            x[active] = np.where(ri, xi + 1, xi - 1)
+            total[active] += term[active]
+            active = active[(term[active] > total[active] * rtol) & np.where(ri, x[active] < upper[active], x[active] > lower[active])]
+        return np.clip(np.where(right, total, 1.0 - total), 0.0, 1.0).reshape(shape)
+
+    def queries_to_matrix(self, gene_sets):
+        """
+        Convert query gene sets into a sparse query by gene membership matrix over the genes of the library.
+
+        Args:
+            gene_sets (dict): A dictionary mapping query names to lists of gene symbols. Genes absent from the
+                library are ignored, as they cannot overlap any term.
+
+        Returns:
+            scipy.sparse.csr_matrix: A float32 matrix with one row per query and one column per gene of the library.
+        """
+        if not gene_sets:
+            return sp.csr_matrix((0, len(self.genes)), dtype=np.float32)
+        rows, cols = [], []
+        for i, genes in enumerate(gene_sets.values()):
+            positions = self.genes.get_indexer(pd.unique(np.asarray(genes, dtype=object)))
+            positions = positions[positions >= 0]
+            rows.append(np.full(len(positions), i))
+            cols.append(positions)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        return sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(gene_sets), len(self.genes))
+        )
+
+    def enrich_many(self, gene_sets, n_background=None, return_genes=False):
+        """
+        Compute the enrichment of every term of the library for many query gene sets.
+
+        The overlaps of all queries with all terms are counted with one sparse matrix product, and the p-values of
+        all the overlaps are computed at once (see ``hypergeometric_sf``). As in Enrichr, only the terms overlapping
+        a query are reported, and the p-values are adjusted over these terms with the Benjamini-Hochberg procedure.
+
+        Args:
+            gene_sets (dict): A dictionary mapping query names to lists of gene symbols.
+            n_background (int, optional): The number of genes in the background. Defaults to the number of genes
+                in the library.
+            return_genes (bool, optional): Whether to list the overlapping genes of every term in a Genes column, which
+                is slower as one string is built per overlapping term. Defaults to False.
+
+        Returns:
+            dict: A dictionary mapping each query name to a DataFrame with the columns of ``gseapy.enrichr`` results
+                (Gene_set, Term, Overlap, P-value, Adjusted P-value, Odds Ratio, Combined Score and optionally Genes),
+                sorted by p-value.
+        """
+        if not gene_sets:
+            return {}
+        if n_background is None:
+            n_background = len(self.genes)
+        queries = self.queries_to_matrix(gene_sets)
+        query_sizes = np.asarray(queries.sum(axis=1)).ravel().astype(np.int64)
+        overlaps = (queries @ self.matrix).tocsr()
+        overlaps.sort_indices()
+        query_rows = np.repeat(np.arange(len(gene_sets)), np.diff(overlaps.indptr))
+        k = overlaps.data.astype(np.int64)
+        m = self.term_sizes[overlaps.indices]
+        n = query_sizes[query_rows]
+
+        # the p-value only depends on the overlap and the two set sizes, which repeat across queries and terms
+        size_limit = max(len(self.genes), n_background) + 1
+        keys, inverse = np.unique((k * size_limit + m) * size_limit + n, return_inverse=True)
+        pvals = self.hypergeometric_sf(keys // size_limit ** 2, n_background, keys // size_limit % size_limit, keys % size_limit)[inverse]
+        pairs, pair_inverse = np.unique(k * size_limit + m, return_inverse=True)
+        overlap_labels = np.array([f"{pair // size_limit}/{pair % size_limit}" for pair in pairs], dtype=object)[pair_inverse]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            odds_ratios = (k * (n_background - m - n + k)) / ((m - k) * (n - k))
+            combined_scores = -np.log(pvals) * odds_ratios
+
+        results = {}
+        for i, name in enumerate(gene_sets):
+            entries = slice(overlaps.indptr[i], overlaps.indptr[i + 1])
+            terms = overlaps.indices[entries]
+            res = pd.DataFrame({
+                "Gene_set": self.name,
+                "Term": self.terms[terms],
+                "Overlap": overlap_labels[entries],
+                "P-value": pvals[entries],
+                "Adjusted P-value": smm.multipletests(pvals[entries], method="fdr_bh")[1] if len(terms) else [],
+                "Odds Ratio": odds_ratios[entries],
+                "Combined Score": combined_scores[entries],
+            })
+            if return_genes:
+                query_genes = queries.indices[queries.indptr[i]:queries.indptr[i + 1]]
+                # the library restricted to the query genes, whose columns list the overlapping genes of each term
+                members = self.matrix[query_genes][:, terms].tocsc()
+                gene_names = self.genes[query_genes]
+                res["Genes"] = [
+                    ";".join(gene_names[members.indices[members.indptr[j]:members.indptr[j + 1]]])
+                    for j in range(len(terms))
+                ]
+            results[name] = res.sort_values("P-value", kind="stable").reset_index(drop=True)
+        return results
+
+    def enrich(self, gene_list, n_background=None, return_genes=False):
+        """
+        Compute the enrichment of every term of the library for a query gene set.
+
+        Args:
+            gene_list (list): A list of gene symbols.
+            n_background (int, optional): The number of genes in the background. Defaults to the number of genes
+                in the library.
+            return_genes (bool, optional): Whether to list the overlapping genes of every term in a Genes column, which
+                is slower as one string is built per overlapping term. Defaults to False.
+
+        Returns:
+            pandas.DataFrame: The enrichment results, as returned by ``enrich_many``.
+        """
+        return self.enrich_many({"query": gene_list}, n_background, return_genes)["query"]
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+class Metadata_index:
+    operators = ("==", "!=", "in", "not in", "contains", "not contains")
+
+    def __init__(self, obs):
+        """
+        Initializes an index of the condition metadata, which evaluates predicates on obs columns as row bitmaps.
+
+        Each column is dictionary encoded once, so a predicate is evaluated on the distinct values of the column
+        rather than on every condition. The bitmap of every evaluated predicate is kept for later searches.
+
+        Parameters:
+        - obs (pandas.DataFrame): The metadata of the conditions, e.g. the obs of the transcriptomic vector store.
+        """
+        self.obs = obs
+        self.codes = {}
+        self.bitmaps = {}
+
+    def get_codes(self, column):
+        """
+        Return the dictionary encoding of a metadata column.
+
+        Args:
+            column (str): The name of the column.
+
+        Returns:
+            tuple: The code of each condition (-1 for missing values) and the distinct values of the column.
+        """
+        if column not in self.codes:
+            if column not in self.obs.columns:
+                raise ValueError(f"The metadata has no column {column}. Available columns: {list(self.obs.columns)}.")
+            self.codes[column] = pd.factorize(self.obs[column])
+        return self.codes[column]
+
+    def evaluate(self, predicate):
+        """
+        Evaluate a predicate on the conditions.
+
+        Args:
+            predicate (tuple): A (column, operator, value) tuple. The operator is one of "==", "!=", "in", "not in",
+                "contains" or "not contains", where "contains" is a case-insensitive substring match and "in" takes a
+                list of values. Missing values only match negated predicates.
+
+        Returns:
+            numpy.ndarray: A boolean bitmap with one entry per condition.
+        """
+        column, operator, value = predicate
+        if operator not in self.operators:
+            raise ValueError(f"operator should be one of {self.operators}.")
+        if operator in ("in", "not in"):
+            value = tuple(value)
+        key = (column, operator, value)
+        if key not in self.bitmaps:
+            codes, uniques = self.get_codes(column)
+            uniques = pd.Index(uniques)
+            if operator in ("==", "!="):
+                matches = np.asarray(uniques == value)
+            elif operator in ("in", "not in"):
+                matches = uniques.isin(value)
+            else:
+                matches = np.asarray(uniques.astype(str).str.contains(value, case=False, regex=False))
+            negated = operator in ("!=", "not in", "not contains")
+            # the last entry is taken by missing values, whose code is -1
+            self.bitmaps[key] = np.append(matches != negated, negated)[codes]
+        return self.bitmaps[key]
+
+    def filter_positions(self, predicates):
+        """
+        Return the positions of the conditions which satisfy every predicate.
+
+        Args:
+            predicates (list): A list of (column, operator, value) tuples, as described in ``evaluate``.
+
+        Returns:
+            numpy.ndarray: The positions of the conditions, in row order.
+        """
+        selected = np.ones(len(self.obs), dtype=bool)
+        for predicate in predicates:
+            selected &= self.evaluate(predicate)
+        return np.flatnonzero(selected)
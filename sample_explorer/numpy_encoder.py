@@ -0,0 +1,316 @@
+import json
+import unicodedata
+import numpy as np
+from scipy.special import erf
+
+
+class Numpy_encoder:
+    def __init__(self, weights_path):
+        """
+        Initializes a sentence encoder which runs the forward pass of a BERT SentenceTransformer model, such as
+        paraphrase-MiniLM-L6-v2, in NumPy, without importing torch or sentence-transformers.
+
+        Texts are split into WordPiece tokens as by the uncased BERT tokenizer, encoded by the transformer layers
+        and mean pooled over their tokens, as by the SentenceTransformer model the weights were exported from with
+        ``export``. Weights exported as int8 stay int8 in memory and are scaled back per row when used.
+
+        Parameters:
+        - weights_path (str): The path to the weights (npz) written by ``export``.
+        """
+        self.weights_path = weights_path
+        with np.load(weights_path) as f:
+            self.weights = {name: f[name] for name in f.files if name not in ("config", "vocab")}
+            self.config = json.loads(str(f["config"]))
+            vocab = f["vocab"].tolist()
+        self.vocab = {token: i for i, token in enumerate(vocab)}
+        self.word_pieces = {}
+        self.n_layers = self.config["n_layers"]
+        self.n_heads = self.config["n_heads"]
+
+    @staticmethod
+    def quantize(weight):
+        """
+        Quantize a weight matrix to int8, with one symmetric scale per row.
+
+        Args:
+            weight (numpy.ndarray): The float32 matrix.
+
+        Returns:
+            tuple: The int8 matrix and the float32 scale of each row.
+        """
+        scale = np.abs(weight).max(axis=1) / 127
+        scale[scale == 0] = 1
+        return np.round(weight / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+    @staticmethod
+    def export(model_name_or_path, weights_path, int8=False):
+        """
+        Export the weights and vocabulary of a SentenceTransformer model to an npz file, once, with torch installed.
+
+        Args:
+            model_name_or_path (str): The name of a BERT SentenceTransformer model with mean pooling, or the path
+                to a local model directory, e.g. paraphrase-MiniLM-L6-v2.
+            weights_path (str): The path of the npz file to write.
+            int8 (bool, optional): Whether to store the token embeddings and the weight matrices of the layers as
+                int8, which makes the file and the resident weights about four times smaller. Defaults to False.
+
+        Returns:
+            None
+        """
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name_or_path, device="cpu")
+        transformer, pooling = model[0], model[1]
+        if getattr(pooling, "pooling_mode_mean_tokens", True) is not True or len(model) > 2:
+            raise ValueError(f"{model_name_or_path} is not a transformer with mean pooling only.")
+        config = transformer.auto_model.config
+        tokenizer = transformer.tokenizer
+        vocab = sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])
+        arrays = {
+            name: tensor.detach().cpu().numpy().astype(np.float32)
+            for name, tensor in transformer.auto_model.state_dict().items()
+            if name.startswith(("embeddings.", "encoder.")) and tensor.is_floating_point()
+        }
+        if int8:
+            for name in [name for name, array in arrays.items() if array.ndim == 2 and "position" not in name and "token_type" not in name]:
+                arrays[name], arrays[name + ".scale"] = Numpy_encoder.quantize(arrays[name])
+        arrays["config"] = np.array(json.dumps({
+            "model": str(model_name_or_path),
+            "n_layers": config.num_hidden_layers,
+            "n_heads": config.num_attention_heads,
+            "layer_norm_eps": config.layer_norm_eps,
+            "max_seq_length": transformer.max_seq_length,
+            "do_lower_case": getattr(tokenizer, "do_lower_case", True),
+        }))
+        arrays["vocab"] = np.array([token for token, _ in vocab])
+        with open(weights_path, "wb") as f:
+            np.savez(f, **arrays)
+
+    def split_words(self, text):
+        """
+        Split a text into words and punctuation, as the basic BERT tokenizer.
+
+        Control characters are removed, Chinese characters and punctuation become words of their own, and, for
+        uncased models, words are lowercased and stripped of their accents.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            list: The words.
+        """
+        characters = []
+        for character in unicodedata.normalize("NFC", text):
+            category = unicodedata.category(character)
+            if character in " \t\n\r" or category == "Zs":
+                characters.append(" ")
+            elif character == "\ufffd" or ord(character) == 0 or category.startswith("C"):
+                continue
+            elif self.is_chinese(character):
+                characters.append(f" {character} ")
+            else:
+                characters.append(character)
+        words = []
+        for word in "".join(characters).split():
+            if self.config["do_lower_case"]:
+                word = "".join(c for c in unicodedata.normalize("NFD", word.lower()) if unicodedata.category(c) != "Mn")
+            start = 0
+            for i, character in enumerate(word):
+                if self.is_punctuation(character):
+                    words.extend([word[start:i], character])
+                    start = i + 1
+            words.append(word[start:])
+        return [word for word in words if word]
+
+    @staticmethod
+    def is_chinese(character):
+        """
+        Return whether a character is a CJK ideograph, which BERT tokenizes as a word of its own.
+
+        Args:
+            character (str): The character.
+
+        Returns:
+            bool: Whether the character is in a CJK unified ideographs block.
+        """
+        code = ord(character)
+        return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0x20000 <= code <= 0x2A6DF
+                or 0x2A700 <= code <= 0x2B73F or 0x2B740 <= code <= 0x2B81F or 0x2B820 <= code <= 0x2CEAF
+                or 0xF900 <= code <= 0xFAFF or 0x2F800 <= code <= 0x2FA1F)
+
+    @staticmethod
+    def is_punctuation(character):
+        """
+        Return whether a character is punctuation for BERT, which counts all non-alphanumeric ASCII symbols.
+
+        Args:
+            character (str): The character.
+
+        Returns:
+            bool: Whether the character is punctuation.
+        """
+        code = ord(character)
+        if 33 <= code <= 47 or 58 <= code <= 64 or 91 <= code <= 96 or 123 <= code <= 126:
+            return True
+        return unicodedata.category(character).startswith("P")
+
+    def get_word_pieces(self, word):
+        """
+        Split a word into the longest WordPiece tokens of the vocabulary, from the left.
+
+        Args:
+            word (str): The word.
+
+        Returns:
+            list: The token ids, or the id of [UNK] when the word cannot be split.
+        """
+        if word in self.word_pieces:
+            return self.word_pieces[word]
+        ids = []
+        start = 0
+        while start < len(word) and len(word) <= 100:
+            stop = len(word)
+            while stop > start:
+                piece = word[start:stop] if start == 0 else "##" + word[start:stop]
+                if piece in self.vocab:
+                    ids.append(self.vocab[piece])
+                    break
+                stop -= 1
+            if stop == start:
+                break
+            start = stop
+        if start < len(word):
+            ids = [self.vocab["[UNK]"]]
+        self.word_pieces[word] = ids
+        return ids
+
+    def tokenize(self, texts):
+        """
+        Convert texts to padded token ids, truncated to the maximum sequence length of the model.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            tuple: The (texts x tokens) int64 token ids, and the attention mask, 1 for tokens and 0 for padding.
+        """
+        sequences = []
+        for text in texts:
+            ids = [i for word in self.split_words(text) for i in self.get_word_pieces(word)]
+            sequences.append([self.vocab["[CLS]"]] + ids[:self.config["max_seq_length"] - 2] + [self.vocab["[SEP]"]])
+        length = max(len(ids) for ids in sequences)
+        input_ids = np.full((len(sequences), length), self.vocab["[PAD]"], dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), length), dtype=np.float32)
+        for row, ids in enumerate(sequences):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        return input_ids, attention_mask
+
+    def linear(self, x, name):
+        """
+        Apply a linear layer, x W^T + b, with the weight scaled back per row if it is stored as int8.
+
+        Args:
+            x (numpy.ndarray): The float32 input, with features on the last axis.
+            name (str): The name of the layer in the weights, e.g. encoder.layer.0.intermediate.dense.
+
+        Returns:
+            numpy.ndarray: The float32 output.
+        """
+        weight = self.weights[name + ".weight"]
+        if weight.dtype == np.int8:
+            return (x @ weight.T.astype(np.float32)) * self.weights[name + ".weight.scale"] + self.weights[name + ".bias"]
+        return x @ weight.T + self.weights[name + ".bias"]
+
+    def layer_norm(self, x, name):
+        """
+        Apply a layer normalization over the features.
+
+        Args:
+            x (numpy.ndarray): The float32 input.
+            name (str): The name of the layer in the weights.
+
+        Returns:
+            numpy.ndarray: The normalized input.
+        """
+        mean = x.mean(axis=-1, keepdims=True)
+        variance = np.square(x - mean).mean(axis=-1, keepdims=True)
+        x = (x - mean) / np.sqrt(variance + self.config["layer_norm_eps"])
+        return x * self.weights[name + ".weight"] + self.weights[name + ".bias"]
+
+    def embed_tokens(self, input_ids):
+        """
+        Compute the input embeddings of the tokens: token, position and token type embeddings, normalized.
+
+        Args:
+            input_ids (numpy.ndarray): The token ids.
+
+        Returns:
+            numpy.ndarray: The float32 (texts x tokens x features) embeddings.
+        """
+        word_embeddings = self.weights["embeddings.word_embeddings.weight"]
+        x = word_embeddings[input_ids].astype(np.float32)
+        if word_embeddings.dtype == np.int8:
+            x *= self.weights["embeddings.word_embeddings.weight.scale"][input_ids][..., None]
+        x += self.weights["embeddings.position_embeddings.weight"][:input_ids.shape[1]]
+        x += self.weights["embeddings.token_type_embeddings.weight"][0]
+        return self.layer_norm(x, "embeddings.LayerNorm")
+
+    def forward(self, input_ids, attention_mask):
+        """
+        Run the transformer layers and mean pool the token states.
+
+        Args:
+            input_ids (numpy.ndarray): The token ids, as returned by ``tokenize``.
+            attention_mask (numpy.ndarray): The attention mask, as returned by ``tokenize``.
+
+        Returns:
+            numpy.ndarray: The float32 (texts x features) sentence embeddings.
+        """
+        x = self.embed_tokens(input_ids)
+        n_texts, n_tokens, n_features = x.shape
+        head_size = n_features // self.n_heads
+        # padding tokens get no attention
+        mask = ((1 - attention_mask) * np.finfo(np.float32).min)[:, None, None, :]
+        for i in range(self.n_layers):
+            prefix = f"encoder.layer.{i}."
+            q, k, v = (
+                self.linear(x, prefix + f"attention.self.{name}").reshape(n_texts, n_tokens, self.n_heads, head_size).transpose(0, 2, 1, 3)
+                for name in ("query", "key", "value")
+            )
+            scores = q @ k.transpose(0, 1, 3, 2) / np.float32(np.sqrt(head_size)) + mask
+            scores = np.exp(scores - scores.max(axis=-1, keepdims=True))
+            scores /= scores.sum(axis=-1, keepdims=True)
+            context = (scores @ v).transpose(0, 2, 1, 3).reshape(n_texts, n_tokens, n_features)
+            x = self.layer_norm(self.linear(context, prefix + "attention.output.dense") + x, prefix + "attention.output.LayerNorm")
+            hidden = self.linear(x, prefix + "intermediate.dense")
+            hidden = hidden * 0.5 * (1 + erf(hidden / np.float32(np.sqrt(2))))
+            x = self.layer_norm(self.linear(hidden, prefix + "output.dense") + x, prefix + "output.LayerNorm")
+        counts = np.maximum(attention_mask.sum(axis=1, keepdims=True), 1e-9)
+        return (x * attention_mask[..., None]).sum(axis=1) / counts
+
+    def encode(self, texts, batch_size=32):
+        """
+        Encode texts into sentence embeddings, as ``SentenceTransformer.encode``.
+
+        Texts are sorted by length, so that the texts of a batch are padded to similar lengths.
+
+        Args:
+            texts (str or list): A text or a list of texts.
+            batch_size (int, optional): The number of texts encoded together. Defaults to 32.
+
+        Returns:
+            numpy.ndarray: The float32 embedding of the text, or one row per text.
+        """
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = None
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self.forward(*self.tokenize([texts[row] for row in rows])).astype(np.float32)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[rows] = batch
+        if embeddings is None:
+            return np.zeros((0, self.weights["embeddings.word_embeddings.weight"].shape[1]), dtype=np.float32)
+        return embeddings
@@ -1,12 +1,14 @@
 import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import logging 
 import sys
+from .ann_index import Hnsw_index
+from .embedding_cache import Embedding_cache
+from .sentence_encoder import Sentence_encoder
 
 class Rag_embedding:
-    def __init__(self, rag_index, rag_embedding_matrix):
+    def __init__(self, rag_index, rag_embedding_matrix, ann_index=None, embedding_cache_path=None, model_name_or_path=None):
         self.logger = logging.getLogger(__name__)
         H = logging.StreamHandler(sys.stdout)
         H.setLevel(logging.INFO)
@@ -18,10 +20,29 @@ class Rag_embedding:
         self.logger.addHandler(H)
 
 
-        self.model = SentenceTransformer("paraphrase-MiniLM-L6-v2")
-        self.logger.info("Loaded SentenceTransformer model.")
+        # the model is loaded on the first encode and shared by every RAG embedding of the process
+        self.model = Sentence_encoder(model_name_or_path)
+        # query embeddings are cached in memory and, with embedding_cache_path, on disk across processes
+        self.embedding_cache = Embedding_cache(self.model, self.model.model_name_or_path, embedding_cache_path)
         self.rag_embedding_index = rag_index
+        # columnar lookup tables built once, so that results are assembled by gathers instead of pandas lookups:
+        # the id and text of every row, the hash index of the series, and the rows of every series in CSR layout,
+        # where the rows of series i are series_rows[series_offsets[i]:series_offsets[i + 1]]
+        self.gse_ids = rag_index.iloc[:, 0].to_numpy(dtype=object)
+        self.gse_texts = rag_index.iloc[:, 1].to_numpy(dtype=object)
+        codes, series = pd.factorize(rag_index["series_id"])
+        self.series_index = pd.Index(series)
+        self.series_rows = np.flatnonzero(codes >= 0)[np.argsort(codes[codes >= 0], kind="stable")]
+        self.series_offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(series)))])
         self.rag_embedding_matrix = rag_embedding_matrix
+        # an optional Hnsw_index over the rows of rag_embedding_matrix, used by query_rag
+        self.ann_index = ann_index
+        # one resident unit-normalized float32 copy of the embeddings, shared with the index, so that cosine
+        # similarities are dot products instead of reads and renormalizations of the whole matrix per query
+        if ann_index is not None:
+            self.normalized_matrix = ann_index.vectors
+        else:
+            self.normalized_matrix = Hnsw_index.normalize(rag_embedding_matrix[:])
 
     def get_gse_from_rag_index(self, ind):
         """Get the GSE ID from the RAG embedding index.
@@ -32,7 +53,7 @@ class Rag_embedding:
         Returns:
             str: The GSE ID corresponding to the given index.
         """
-        gse_id = self.rag_embedding_index.iloc[ind, :].to_list()[0]
+        gse_id = self.gse_ids[ind]
         return gse_id
 
     def get_gse_text_from_rag_index(self, ind):
@@ -45,7 +66,7 @@ class Rag_embedding:
         Returns:
         - gse_id_text (str): The GSE text corresponding to the given index.
         """
-        gse_id_text = self.rag_embedding_index.iloc[ind, :].to_list()[1]
+        gse_id_text = self.gse_texts[ind]
         return gse_id_text
 
     def get_text_linked_to_gse(self, gse_id_query):
@@ -58,11 +79,64 @@ class Rag_embedding:
         Returns:
         - str: The text linked to the specified GSE ID.
         """
-        gse_id_text = self.rag_embedding_index[
-            self.rag_embedding_index["series_id"].isin([gse_id_query])
-        ]["rag_text"].to_list()[0]
+        rows = self.get_series_rows(gse_id_query)
+        if len(rows) == 0:
+            raise IndexError(f"The series {gse_id_query} is not in the RAG embedding index.")
+        gse_id_text = self.gse_texts[rows[0]]
         return gse_id_text
 
+    def get_texts_linked_to_gse(self, gse_id_queries):
+        """
+        Retrieves the texts linked to many GSE IDs at once.
+
+        Parameters:
+        - gse_id_queries (list): The GSE IDs to query.
+
+        Returns:
+        - numpy.ndarray: The text linked to each GSE ID, as for ``get_text_linked_to_gse``.
+        """
+        codes = self.series_index.get_indexer(pd.Index(gse_id_queries))
+        if (codes < 0).any():
+            missing = list(pd.Index(gse_id_queries)[codes < 0])
+            raise IndexError(f"The series {missing} are not in the RAG embedding index.")
+        return self.gse_texts[self.series_rows[self.series_offsets[codes]]]
+
+    def get_series_rows(self, gse_id_query):
+        """
+        Retrieves the rows of the RAG embedding index which belong to a GSE ID.
+
+        Parameters:
+        - gse_id_query (str): The GSE ID to query.
+
+        Returns:
+        - numpy.ndarray: The positions of the rows, in increasing order, empty if the GSE ID is not in the index.
+        """
+        if gse_id_query not in self.series_index:
+            return self.series_rows[:0]
+        code = self.series_index.get_loc(gse_id_query)
+        return self.series_rows[self.series_offsets[code]:self.series_offsets[code + 1]]
+
+    @staticmethod
+    def get_top_k(scores, k):
+        """
+        Return the positions of the k highest scores, from the highest.
+
+        The k highest scores are selected with ``argpartition`` and only they are sorted.
+
+        Args:
+            scores (numpy.ndarray): The scores, or one row of scores per query.
+            k (int): The number of positions.
+
+        Returns:
+            numpy.ndarray: The positions, or one row of positions per query.
+        """
+        k = min(k, scores.shape[-1])
+        if k == 0:
+            return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+        top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1, kind="stable")
+        return np.take_along_axis(top, order, axis=-1)
+
     def get_closest_semantic_studies(self, query_gse_id, k=5):
         """
         Retrieves the closest semantic studies based on a given query GSE ID.
@@ -75,78 +149,103 @@ class Rag_embedding:
             pandas.DataFrame: A DataFrame containing the closest studies along with their similarity scores.
 
         """
-        relevant_embedding_indices = np.where(
-            self.rag_embedding_index["series_id"].isin([query_gse_id])
-        )
-        numpy_array = relevant_embedding_indices[0]
-        flattened_array = numpy_array.flatten()
-        query_embeddings = self.rag_embedding_matrix[flattened_array,]
-
-        cosine_similarities = cosine_similarity(
-            self.rag_embedding_matrix, query_embeddings
-        )
-        average_cosine_similarities = np.mean(cosine_similarities, axis=1)
-
-        sorted_indices = np.argsort(average_cosine_similarities)[::-1]
-
-        top_k = k
-        results_data = []
-
-        for i in range(top_k):
-            index = sorted_indices[i]
-            similarity = average_cosine_similarities[index]
-            results_data.append({"Index": index, "similarity_score": similarity})
-
-        # Create a Pandas DataFrame from the results_data
-        results_df = pd.DataFrame(results_data)
-        results_df["gse_id"] = [
-            self.get_gse_from_rag_index(i) for i in results_df.Index
-        ]
-        results_df["gse_id_text"] = [
-            self.get_gse_text_from_rag_index(i) for i in results_df.Index
-        ]
+        rows = self.get_series_rows(query_gse_id)
+        if len(rows) == 0:
+            raise IndexError(f"The series {query_gse_id} is not in the RAG embedding index.")
+        query_embeddings = self.normalized_matrix[rows]
+
+        # the mean cosine similarity to the query embeddings is the dot product with their mean
+        average_cosine_similarities = self.normalized_matrix @ query_embeddings.mean(axis=0)
+
+        sorted_indices = self.get_top_k(average_cosine_similarities, k)
+
+        # Create a Pandas DataFrame from the closest studies
+        results_df = pd.DataFrame({"Index": sorted_indices, "similarity_score": average_cosine_similarities[sorted_indices]})
+        results_df["gse_id"] = self.gse_ids[sorted_indices]
+        results_df["gse_id_text"] = self.gse_texts[sorted_indices]
         # results_df["similarity_source"] = "transcriptome"
         return results_df
     
-    def query_rag(self, query, k=5):
+    def query_rag(self, query, k=5, ef=None, exact=False):
         """
         Query the RAG (Retrieval-Augmented Generation) model with a given query.
 
+        When an approximate nearest-neighbour index is loaded, the closest studies are found with the index
+        instead of comparing the query with every study.
+
         Args:
             query (str): The query text.
             k (int, optional): The number of top results to retrieve. Defaults to 5.
+            ef (int, optional): The number of candidates explored by the index, which trades latency for recall.
+                Defaults to the ef_search of the index.
+            exact (bool, optional): Whether to compare the query with every study even when an index is loaded.
+                Defaults to False.
 
         Returns:
             pandas.DataFrame: A DataFrame containing the top k results with columns 'similarity_score', 'gse_id', 'gse_id_text', and 'similarity_source'.
         """
-        query_embedding = self.model.encode(query).reshape(1, -1)
-        cosine_similarities = cosine_similarity(
-            self.rag_embedding_matrix, query_embedding
-        )
-        cosine_distances = 1 - cosine_similarities
-        sorted_indices = np.argsort(cosine_distances.flatten())
-
-        if len(sorted_indices) < k:
-            k = len(sorted_indices)
-
-        top_k = k
-        results_data = []
-
-        for i in range(top_k):
-            index = sorted_indices[i]
-            distance = cosine_distances[index]
-            results_data.append({"Index": index, "similarity_score": distance[0]})
-
-        # Create a Pandas DataFrame from the results_data
-        results_df = pd.DataFrame(results_data)
-        results_df["gse_id"] = [self.get_gse_from_rag_index(i) for i in results_df.Index]
-        results_df["gse_id_text"] = [
-            self.get_gse_text_from_rag_index(i) for i in results_df.Index
-        ]
+        return self.query_rag_many({"query": query}, k, ef, exact)["query"]
+
+    def query_rag_many(self, queries, k=5, ef=None, exact=False, max_bytes=256 * 2**20):
+        """
+        Query the RAG model with many queries at once.
+
+        All the queries which are not in the embedding cache are encoded in one batched call to the model. Without an index, the similarities of a block
+        of queries to every study are computed with one matrix product, with blocks small enough for the similarity
+        matrix to fit in max_bytes.
+
+        Args:
+            queries (dict or list): A dictionary mapping query names to query texts, or a list of query texts, which
+                are then also the names.
+            k (int, optional): The number of top results to retrieve per query. Defaults to 5.
+            ef (int, optional): The number of candidates explored by the index, as for ``query_rag``.
+            exact (bool, optional): Whether to compare the queries with every study even when an index is loaded.
+                Defaults to False.
+            max_bytes (int, optional): The maximum size of the similarity matrix of a block of queries. Defaults to 256 MiB.
+
+        Returns:
+            dict: A dictionary mapping each query name to the DataFrame returned by ``query_rag``.
+        """
+        if not isinstance(queries, dict):
+            queries = {query: query for query in queries}
+        if not queries:
+            return {}
+        query_embeddings = self.embedding_cache.encode(list(queries.values())).reshape(len(queries), -1)
+        results = {}
+        if self.ann_index is not None and not exact:
+            for name, query_embedding in zip(queries, query_embeddings):
+                sorted_indices, distances = self.ann_index.search(query_embedding, k, ef)
+                results[name] = self.get_results_dataframe(sorted_indices, distances)
+            return results
+
+        names = list(queries)
+        batch_size = max(1, max_bytes // (4 * len(self.normalized_matrix)))
+        for start in range(0, len(names), batch_size):
+            cosine_similarities = Hnsw_index.normalize(query_embeddings[start:start + batch_size]) @ self.normalized_matrix.T
+            sorted_indices = self.get_top_k(cosine_similarities, k)
+            distances = 1 - np.take_along_axis(cosine_similarities, sorted_indices, axis=1)
+            for name, row_indices, row_distances in zip(names[start:start + batch_size], sorted_indices, distances):
+                results[name] = self.get_results_dataframe(row_indices, row_distances)
+        return results
+
+    def get_results_dataframe(self, sorted_indices, distances):
+        """
+        Assemble the closest studies of a query into the result layout of ``query_rag``.
+
+        Args:
+            sorted_indices (numpy.ndarray): The positions of the closest studies, from the closest.
+            distances (numpy.ndarray): Their cosine distances to the query.
+
+        Returns:
+            pandas.DataFrame: A DataFrame with columns 'similarity_score', 'gse_id', 'gse_id_text', and 'similarity_source'.
+        """
+        # Create a Pandas DataFrame from the closest studies
+        results_df = pd.DataFrame({"similarity_score": distances})
+        results_df["gse_id"] = self.gse_ids[sorted_indices]
+        results_df["gse_id_text"] = self.gse_texts[sorted_indices]
         results_df["similarity_source"] = "semantic"
+        return results_df
 
-        return results_df.drop("Index", axis=1)
-    
     def get_averages_between_queries(self, query, list_of_queries):
         """
         Calculates the average cosine similarity between a query and a list of queries.
@@ -158,9 +257,9 @@ class Rag_embedding:
         Returns:
         float: The average cosine similarity between the query and the list of queries.
         """
-        query_embedding = self.model.encode([query])[0]
-        list_embeddings = self.model.encode(list_of_queries)
-        
+        embeddings = self.embedding_cache.encode([query] + list(list_of_queries))
+        query_embedding, list_embeddings = embeddings[0], embeddings[1:]
+
         query_embedding = query_embedding.reshape(1, -1)
         list_embeddings = list_embeddings.reshape(len(list_of_queries), -1)
 
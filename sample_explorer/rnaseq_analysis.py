@@ -4,21 +4,25 @@ import anndata as ad
 import decoupler as dc
 import numpy as np
 import archs4py as a4
+import h5py
 import statsmodels.stats.multitest as smt
 from tqdm import tqdm
 
 class RNASeqAnalysis:
-    def __init__(self, file):
+    def __init__(self, file, execution_profile=None):
         """
         Initializes a new instance of the `rnaseq_analysis` class.
 
         Args:
             file (str): The file path to be assigned to the `file` attribute.
+            execution_profile (Execution_profile, optional): The profile setting the number of samples per batch of
+                ``perform_enrichment_on_samples_batched``. Defaults to None (2500 samples per batch).
 
         Returns:
             None
         """
         self.file = file
+        self.execution_profile = execution_profile
 
     def create_anndata_from_series(self, series):
         """Create an AnnData object with counts and metadata for a given series.
@@ -68,18 +72,26 @@ class RNASeqAnalysis:
         df["geneset"] = "enrichment_score"
         return df
 
-    def perform_enrichment_on_samples_batched(self, element_list, geneset, batch_size=2500):
+    def perform_enrichment_on_samples_batched(self, element_list, geneset, batch_size=None):
         """
         Perform enrichment analysis on a list of elements in batches.
 
         Args:
             element_list (list): A list of elements to perform enrichment analysis on.
             geneset (str): The geneset to use for enrichment analysis.
-            batch_size (int, optional): The size of each batch. Defaults to 5000.
+            batch_size (int, optional): The size of each batch. Defaults to the sample block size of the execution
+                profile, or 2500.
 
         Returns:
             pandas.DataFrame: A combined DataFrame containing the results of enrichment analysis for all batches.
         """
+        if batch_size is None:
+            if self.execution_profile is None:
+                batch_size = 2500
+            else:
+                with h5py.File(self.file, "r") as f:
+                    n_genes = f["data/expression"].shape[0]
+                batch_size = self.execution_profile.get_batch_size("samples", n_genes)
 
         # Calculate the number of batches
         num_batches = (len(element_list) + batch_size - 1) // batch_size
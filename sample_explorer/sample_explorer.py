@@ -6,9 +6,19 @@ import os
 import traceback
 from .rnaseq_analysis import RNASeqAnalysis
 from .rag_embedding import Rag_embedding
+from .ann_index import Hnsw_index
 from .transcriptome_embedding import Transcriptome_embedding
-from .enrichment import Transcriptome_enrichment
+from .enrichment import Transcriptome_enrichment, Top_k_conditions
+from .search_cache import Search_cache
+from .metadata_index import Metadata_index
+from .atlas import Enrichment_atlas
+from .gene_store import Gene_major_store
+from .expression_profile import Expression_profile
+from .execution_profile import Execution_profile
+import numpy as np
 import scipy.sparse as sp
+import time
+from scipy.stats import hypergeom
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 import warnings
@@ -21,7 +31,8 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(mess
 class Query_DB:
     logger = logging.getLogger(__name__)
     
-    def __init__(self, semantic_vector_store, transcriptomic_vector_store, h5file=None):
+    def __init__(self, semantic_vector_store, transcriptomic_vector_store, h5file=None, workers=1, cache_path=None, atlas_path=None, gene_store_path=None,
+                 profile_path=None, max_memory=None, model_name_or_path=None):
         self.logger = logging.getLogger(__name__)
         H = logging.StreamHandler(sys.stdout)
         H.setLevel(logging.INFO)
@@ -31,6 +42,16 @@ class Query_DB:
                 datefmt="%d/%m/%Y ( %H:%M:%S )"
             ))
         self.logger.addHandler(H)
+        self.workers = workers
+        self.series_codes = None
+
+        # identifies the transcriptomic vector store in search cache keys and progressive search checkpoints
+        self.transcriptome_fingerprint = Search_cache.fingerprint_file(transcriptomic_vector_store)
+        if cache_path is not None:
+            self.search_cache = Search_cache(cache_path)
+            self.logger.info(f"Using search cache {cache_path}.")
+        else:
+            self.search_cache = None
 
         self.logger.info("Loading transcriptomic vector store...")
         trans_obj = ad.read_h5ad(transcriptomic_vector_store, backed="r")
@@ -44,16 +65,47 @@ class Query_DB:
         self.logger.info("Semantic vector store loaded.")
         
         self.transcriptome_embedding = Transcriptome_embedding(trans_obj.obs, trans_obj.obsm["embedding"])
+        self.metadata_index = Metadata_index(trans_obj.obs)
         self.logger.info("Transcriptome embedding initialized.")
-        self.rag_embedding = Rag_embedding(sem_obj.obs, sem_obj.X)
+        # the search cache file also holds the embeddings of text queries, in their own table with their own budget
+        self.rag_embedding = Rag_embedding(sem_obj.obs, sem_obj.X, embedding_cache_path=cache_path, model_name_or_path=model_name_or_path)
+        if os.path.exists(Hnsw_index.index_path(semantic_vector_store)):
+            # the index shares the resident normalized embeddings of the RAG embedding
+            self.rag_embedding.ann_index = Hnsw_index.load(Hnsw_index.index_path(semantic_vector_store), self.rag_embedding.normalized_matrix)
+            self.logger.info("Approximate nearest-neighbour index of the semantic vector store loaded.")
         self.logger.info("RAG embedding initialized.")
         self.transcriptome_enrichment = Transcriptome_enrichment(trans_obj)     
+        top_gene_index_path = Transcriptome_enrichment.top_gene_index_path(transcriptomic_vector_store)
+        self.top_gene_index_fingerprint = Search_cache.fingerprint_file(top_gene_index_path) if os.path.exists(top_gene_index_path) else None
         
         self.logger.info("Transcriptome object initialized.")
+
+        self.execution_profile = Execution_profile(profile_path, max_memory)
+        if profile_path is not None:
+            tuned_store = self.execution_profile.profile.get("transcriptomic_vector_store", {})
+            if tuned_store and tuned_store["fingerprint"] != Search_cache.fingerprint_file(transcriptomic_vector_store):
+                self.logger.warning(f"The execution profile {profile_path} was tuned on a different transcriptomic vector store.")
+            self.logger.info(f"Using execution profile {profile_path} (block sizes: {self.execution_profile.batch_sizes}).")
+
+        if atlas_path is not None:
+            self.enrichment_atlas = Enrichment_atlas(atlas_path)
+            if not self.enrichment_atlas.conditions.equals(trans_obj.obs_names):
+                raise ValueError("The enrichment atlas was built from a different transcriptomic vector store.")
+            self.logger.info("Enrichment atlas loaded.")
+        else:
+            self.enrichment_atlas = None
+
+        if gene_store_path is not None:
+            self.gene_store = Gene_major_store(gene_store_path)
+            if not self.gene_store.conditions.equals(trans_obj.obs_names):
+                raise ValueError("The gene-major store was built from a different transcriptomic vector store.")
+            self.logger.info("Gene-major store loaded.")
+        else:
+            self.gene_store = None
         
         if h5file is not None:
             self.logger.info("Loading ARCHS4 database object...")
-            self.RNASeqAnalysis = RNASeqAnalysis(h5file)
+            self.RNASeqAnalysis = RNASeqAnalysis(h5file, self.execution_profile)
             self.h5file = h5file    
             self.logger.info("ARCHS4 database object loaded.")
             
@@ -79,8 +131,11 @@ class Query_DB:
         """
 
         if sp.issparse(trans_obj.X):
-            self.transcriptome_search_possible = False
-            self.logger.warning("Transcriptomic matrix is sparse. Transcriptome search not possible.")
+            if trans_obj.filename is not None and os.path.exists(Transcriptome_enrichment.top_gene_index_path(str(trans_obj.filename))):
+                self.logger.info("Transcriptomic matrix is sparse. Transcriptome search will use the top-gene index.")
+            else:
+                self.transcriptome_search_possible = False
+                self.logger.warning("Transcriptomic matrix is sparse. Transcriptome search not possible.")
 
     def process_metadata(self, h5_path):
         """
@@ -123,58 +178,559 @@ class Query_DB:
         Returns:
         - pandas.DataFrame: A subset of the original DataFrame containing the top samples.
         """
-        df_meta = self.transcriptome_embedding.embeddings_index.copy()
+        df_meta = self.transcriptome_embedding.embeddings_index
         samps = df.iloc[:, 1].sort_values(ascending=False).head(n).index.to_list()
         series_of_interest = df_meta[df_meta.index.isin(samps)]
         return series_of_interest
 
-    def transcriptome_search(self, geneset, nsamples=1000):
+    def transcriptome_search(self, geneset, nsamples=1000, method=None, workers=None, per_series=False, mode="exact", n_candidates=5000, filters=None):
         """
         Perform a transcriptome search using a given geneset.
 
+        Conditions are scored in row ranges and only the best nsamples seen so far are kept, so memory
+        does not grow with the size of the transcriptomic vector store.
+
         Args:
             geneset (list): A list of genes to search for in the transcriptome.
             nsamples (int, optional): The number of top samples to retrieve. Defaults to 1000.
+            method (str, optional): The ORA engine, either "index" (precomputed top-gene index), "native" (vectorized NumPy)
+                or "decoupler". Defaults to "index" when the vector store has a top-gene index, otherwise "native".
+            workers (int, optional): The number of processes used by the "native" engine. Defaults to the value given to Query_DB.
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series,
+                instead of the top nsamples conditions. Defaults to False.
+            mode (str, optional): Either "exact", which scores every condition, "approximate", which scores the n_candidates
+                conditions closest to the geneset in the embedding space (see ``Transcriptome_enrichment.sketch_scores``),
+                or "progressive", which stops once the results are stable (see ``progressive_transcriptome_search``).
+                Defaults to "exact".
+            n_candidates (int, optional): The number of conditions scored in approximate mode. Defaults to 5000.
+            filters (list, optional): Predicates on the metadata of the conditions, as (column, operator, value) tuples,
+                e.g. [("characteristics_ch1", "not contains", "cell line")] (see ``Metadata_index.evaluate``). Conditions
+                failing a predicate are neither read nor scored. Defaults to None.
 
         Returns:
             tuple: A tuple containing two pandas DataFrames. The first DataFrame contains the top samples of interest,
                    and the second DataFrame contains the relevant series (studies) associated with the top samples.
         """
-        my_list = self.transcriptome_enrichment.memmap_adata.obs.index
-        user_batch_size = 500
-        output_df1_list = []
+        if method is None:
+            method = "native" if self.transcriptome_enrichment.top_gene_index is None else "index"
+        if method not in ("index", "native", "decoupler"):
+            raise ValueError("method should be one of 'index', 'native' or 'decoupler'.")
+        if workers is None:
+            workers = self.workers
+        if mode not in ("exact", "approximate", "progressive"):
+            raise ValueError("mode should be one of 'exact', 'approximate' or 'progressive'.")
+        if mode != "exact" and method == "decoupler":
+            raise ValueError("Approximate and progressive transcriptome search support the 'index' and 'native' methods.")
+        if mode == "progressive" and filters is not None:
+            raise ValueError("Progressive transcriptome search does not support filters.")
+        if self.search_cache is not None:
+            key = Search_cache.make_key(
+                geneset=list(geneset), nsamples=nsamples, method=method, per_series=per_series, mode=mode,
+                n_candidates=n_candidates if mode == "approximate" else None,
+                filters=None if filters is None else repr(list(filters)),
+                # decoupler drops the genes without counts in a block before choosing the top genes, so its results depend on the block
+                batch_size=self.execution_profile.get_batch_size("decoupler", self.transcriptome_enrichment.memmap_adata.n_vars) if method == "decoupler" else None,
+                transcriptomic_vector_store=self.transcriptome_fingerprint,
+                top_gene_index=self.top_gene_index_fingerprint if method == "index" else None
+            )
+            positions = self.search_cache.get(key)
+            self.logger.info(f"Search cache {'miss' if positions is None else 'hit'} "
+                             f"(hits: {self.search_cache.hits}, misses: {self.search_cache.misses}).")
+            if positions is not None:
+                return self.get_conditions_from_positions(positions)
+        embeddings_index = self.transcriptome_embedding.embeddings_index
+        if per_series:
+            if self.series_codes is None:
+                self.series_codes = pd.factorize(embeddings_index["series_id"])[0]
+            top_conditions = Top_k_conditions(nsamples, self.series_codes)
+        else:
+            top_conditions = Top_k_conditions(nsamples)
+
+        if filters is not None:
+            selected = self.metadata_index.filter_positions(filters)
+            self.logger.info(f"{len(selected)} of {len(embeddings_index)} conditions pass the filters.")
+        else:
+            selected = None
+
+        n_genes = self.transcriptome_enrichment.memmap_adata.n_vars
         self.logger.info("Starting transcriptome search...")
-        for i in tqdm(range(0, len(my_list), user_batch_size)):
-            try:
-                samps = my_list[i:i + user_batch_size]
-                df1 = self.transcriptome_enrichment.run_decouplr_on_memmaped_adata_with_samples(geneset, samps)
-                # Store the output from each iteration
-                output_df1_list.append(df1)
-            except Exception as e:
-                self.logger.error(f"Failure in batch {i}: {str(e)}")
-                self.logger.error(traceback.format_exc())
-        final_df1 = pd.concat(output_df1_list)
-        series_of_interest = self.get_top_samples(final_df1, n=nsamples)
+        if mode == "progressive":
+            *_, (_, _, progress) = self.progressive_transcriptome_search(geneset, nsamples, method, per_series)
+            self.logger.info(f"Scored {progress['scored']} of {progress['total']} conditions.")
+            positions = progress["positions"]
+        elif mode == "approximate":
+            positions = self.transcriptome_enrichment.shortlist_conditions(geneset, n_candidates, selected)
+            pvals = self.transcriptome_enrichment.run_ora_on_positions(
+                geneset, positions, use_index=method == "index",
+                batch_size=self.execution_profile.get_batch_size("native", n_genes)
+            )
+            top_conditions.update(positions, pvals)
+        elif selected is not None and method == "decoupler":
+            user_batch_size = self.execution_profile.get_batch_size("decoupler", n_genes)
+            for i in tqdm(range(0, len(selected), user_batch_size)):
+                try:
+                    samples = embeddings_index.index[selected[i:i + user_batch_size]]
+                    df1 = self.transcriptome_enrichment.run_decouplr_on_memmaped_adata_with_samples(geneset, samples)
+                    top_conditions.update(embeddings_index.index.get_indexer(df1.index), df1["pvals"].values)
+                except Exception as e:
+                    self.logger.error(f"Failure in batch {i}: {str(e)}")
+                    self.logger.error(traceback.format_exc())
+        elif selected is not None:
+            pvals = self.transcriptome_enrichment.run_ora_on_positions(
+                geneset, selected, use_index=method == "index",
+                batch_size=self.execution_profile.get_batch_size("native", n_genes)
+            )
+            top_conditions.update(selected, pvals)
+        elif method == "index":
+            batch_size = self.execution_profile.get_batch_size("index", n_genes)
+            for start, stop, pvals in self.transcriptome_enrichment.iter_indexed_ora_pvals(geneset, batch_size=batch_size):
+                top_conditions.update(np.arange(start, stop), pvals)
+        elif method == "native":
+            batch_size = self.execution_profile.get_batch_size("native", n_genes, workers=workers)
+            for start, stop, pvals in self.transcriptome_enrichment.iter_native_ora_pvals(geneset, batch_size=batch_size, workers=workers):
+                top_conditions.update(np.arange(start, stop), pvals)
+        else:
+            n_obs = self.transcriptome_enrichment.memmap_adata.n_obs
+            user_batch_size = self.execution_profile.get_batch_size("decoupler", n_genes)
+            for i in tqdm(range(0, n_obs, user_batch_size)):
+                try:
+                    df1 = self.transcriptome_enrichment.run_decouplr_on_rows(geneset, i, min(i + user_batch_size, n_obs))
+                    top_conditions.update(embeddings_index.index.get_indexer(df1.index), df1["pvals"].values)
+                except Exception as e:
+                    self.logger.error(f"Failure in batch {i}: {str(e)}")
+                    self.logger.error(traceback.format_exc())
+        if mode != "progressive":
+            positions = top_conditions.get_positions()
+        if self.search_cache is not None:
+            self.search_cache.put(key, positions)
+        return self.get_conditions_from_positions(positions)
+
+    def transcriptome_search_many(self, genesets, nsamples=1000, method=None, per_series=False, return_scores=False):
+        """
+        Perform a transcriptome search for many genesets in a single pass over the transcriptomic vector store.
+
+        Each row block is read once and scored against every geneset, so searching N genesets costs about
+        one pass over the vector store instead of N.
+
+        Args:
+            genesets (dict): A dictionary mapping geneset names to lists of genes.
+            nsamples (int, optional): The number of top samples to retrieve per geneset. Defaults to 1000.
+            method (str, optional): The ORA engine, either "index" (precomputed top-gene index) or "native" (vectorized NumPy).
+                Defaults to "index" when the vector store has a top-gene index, otherwise "native".
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series
+                for every geneset. Defaults to False.
+            return_scores (bool, optional): If True, return the scores of every condition instead of the top samples.
+                Defaults to False.
+
+        Returns:
+            dict or pandas.DataFrame: A dictionary mapping each geneset name to the tuple returned by ``transcriptome_search``,
+                or, if return_scores is True, a float32 DataFrame of -log10 p-values with one row per condition and
+                one column per geneset.
+        """
+        if self.transcriptome_search_possible is False:
+            # throw an error if the transcriptome is sparse
+            raise RuntimeError("This database cannot be used for search. Download the full database to perform search.")
+        if method is None:
+            method = "native" if self.transcriptome_enrichment.top_gene_index is None else "index"
+        if method not in ("index", "native"):
+            raise ValueError("method should be one of 'index' or 'native'.")
+        # the overlaps and p-values of every geneset are held for each condition of a block
+        batch_size = self.execution_profile.get_batch_size(
+            method, self.transcriptome_enrichment.memmap_adata.n_vars, extra_bytes_per_row=24 * len(genesets), default=1000
+        )
+        if method == "index":
+            blocks = self.transcriptome_enrichment.iter_indexed_ora_pvals_many(genesets, batch_size=batch_size)
+        else:
+            blocks = self.transcriptome_enrichment.iter_native_ora_pvals_many(genesets, batch_size=batch_size)
+        embeddings_index = self.transcriptome_embedding.embeddings_index
+
+        self.logger.info(f"Starting transcriptome search for {len(genesets)} genesets...")
+        if return_scores:
+            scores = np.zeros((len(embeddings_index), len(genesets)), dtype=np.float32)
+            with np.errstate(divide="ignore"):
+                for start, stop, pvals in blocks:
+                    scores[start:stop] = -np.log10(pvals)
+            return pd.DataFrame(scores, index=embeddings_index.index, columns=list(genesets))
+
+        if per_series and self.series_codes is None:
+            self.series_codes = pd.factorize(embeddings_index["series_id"])[0]
+        top_conditions = [Top_k_conditions(nsamples, self.series_codes if per_series else None) for _ in genesets]
+        for start, stop, pvals in blocks:
+            positions = np.arange(start, stop)
+            for j, selection in enumerate(top_conditions):
+                selection.update(positions, pvals[:, j])
+        return {
+            name: self.get_conditions_from_positions(selection.get_positions())
+            for name, selection in zip(genesets, top_conditions)
+        }
+
+    def progressive_transcriptome_search(self, geneset, nsamples=1000, method=None, per_series=False, batch_size=None,
+                                         n_strata=20, time_budget=None, tolerance=0.0, patience=3, checkpoint_path=None,
+                                         random_state=0):
+        """
+        Perform a transcriptome search which yields provisional results while it scans the transcriptomic vector store.
+
+        Row blocks are scored in a randomized order, stratified over the vector store (see
+        ``Transcriptome_enrichment.stratified_row_ranges``), in rounds of n_strata blocks. After every round the
+        provisional top nsamples conditions are yielded. The search stops once the provisional results have changed
+        by at most tolerance for patience consecutive rounds, once time_budget is spent, or once every block is scored.
+
+        Since every condition of the final results is in the provisional results as soon as it has been scored, the
+        fraction of the final results already found follows a hypergeometric distribution over the scored rows, which
+        gives the 95% bounds on recall reported with each round.
+
+        Args:
+            geneset (list): A list of genes to search for in the transcriptome.
+            nsamples (int, optional): The number of top samples to retrieve. Defaults to 1000.
+            method (str, optional): The ORA engine, either "index" or "native". Defaults to "index" when the vector store
+                has a top-gene index, otherwise "native".
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series.
+                Defaults to False.
+            batch_size (int, optional): The number of rows per block. Defaults to the block size of the method in the
+                execution profile, or 1000.
+            n_strata (int, optional): The number of strata, which is also the number of blocks per round. Defaults to 20.
+            time_budget (float, optional): The number of seconds after which the search stops. Defaults to None (no limit).
+            tolerance (float, optional): The largest fraction of the provisional results which may change in a round
+                for the round to count as stable. Defaults to 0.0.
+            patience (int, optional): The number of consecutive stable rounds after which the search stops.
+                Defaults to 3. Set to None to never stop early.
+            checkpoint_path (str, optional): A file where the progress is saved after every round. If it holds the
+                progress of the same search, the search resumes from it. Defaults to None.
+            random_state (int, optional): The seed of the block order. Defaults to 0.
+
+        Yields:
+            tuple: The provisional top samples and their series, as returned by ``transcriptome_search``, and a dictionary
+                describing the progress, with the keys 'scored', 'total', 'rounds', 'changed', 'kth_pval',
+                'recall_low', 'recall_high', 'status' ("running", "stable", "time_budget" or "complete") and
+                'positions', the positions of the provisional top samples in the transcriptomic vector store.
+        """
+        if self.transcriptome_search_possible is False:
+            # throw an error if the transcriptome is sparse
+            raise RuntimeError("This database cannot be used for search. Download the full database to perform search.")
+        if method is None:
+            method = "native" if self.transcriptome_enrichment.top_gene_index is None else "index"
+        if method not in ("index", "native"):
+            raise ValueError("method should be one of 'index' or 'native'.")
+        if batch_size is None:
+            batch_size = self.execution_profile.get_batch_size(method, self.transcriptome_enrichment.memmap_adata.n_vars, default=1000)
+        embeddings_index = self.transcriptome_embedding.embeddings_index
+        n_obs = len(embeddings_index)
+        row_ranges = Transcriptome_enrichment.stratified_row_ranges(n_obs, batch_size, n_strata, random_state)
+        rounds = [row_ranges[i:i + n_strata] for i in range(0, len(row_ranges), n_strata)]
+        if per_series and self.series_codes is None:
+            self.series_codes = pd.factorize(embeddings_index["series_id"])[0]
+        top_conditions = Top_k_conditions(nsamples, self.series_codes if per_series else None)
+
+        key = Search_cache.make_key(
+            geneset=list(geneset), nsamples=nsamples, method=method, per_series=per_series, batch_size=batch_size,
+            n_strata=n_strata, random_state=random_state, shape="x".join(map(str, self.transcriptome_enrichment.memmap_adata.shape)),
+            transcriptomic_vector_store=self.transcriptome_fingerprint,
+            top_gene_index=self.top_gene_index_fingerprint if method == "index" else None
+        )
+        rounds_done, stable_rounds = 0, 0
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            checkpoint = np.load(checkpoint_path)
+            if str(checkpoint["key"]) != key:
+                raise ValueError(f"The checkpoint {checkpoint_path} was saved by a different search.")
+            top_conditions.positions, top_conditions.pvals = checkpoint["positions"], checkpoint["pvals"]
+            rounds_done, stable_rounds = int(checkpoint["rounds_done"]), int(checkpoint["stable_rounds"])
+            self.logger.info(f"Resuming transcriptome search from round {rounds_done} of {len(rounds)}.")
+
+        self.logger.info("Starting progressive transcriptome search...")
+        started = time.perf_counter()
+        scored = sum(stop - start for round_ranges in rounds[:rounds_done] for start, stop in round_ranges)
+        status = "complete" if rounds_done == len(rounds) else "running"
+        changed = 0.0
+        while status == "running":
+            previous = top_conditions.positions
+            blocks = self.transcriptome_enrichment.iter_ora_pvals_for_row_ranges(geneset, rounds[rounds_done], use_index=method == "index")
+            for start, stop, pvals in blocks:
+                top_conditions.update(np.arange(start, stop), pvals)
+                scored += stop - start
+            rounds_done += 1
+
+            changed = 1 - len(np.intersect1d(previous, top_conditions.positions)) / max(len(top_conditions.positions), 1)
+            stable_rounds = stable_rounds + 1 if changed <= tolerance else 0
+            if rounds_done == len(rounds):
+                status = "complete"
+            elif patience is not None and stable_rounds >= patience:
+                status = "stable"
+            elif time_budget is not None and time.perf_counter() - started >= time_budget:
+                status = "time_budget"
+
+            if checkpoint_path is not None:
+                with open(checkpoint_path + ".tmp", "wb") as f:
+                    np.savez(f, key=key, positions=top_conditions.positions, pvals=top_conditions.pvals,
+                             rounds_done=rounds_done, stable_rounds=stable_rounds)
+                os.replace(checkpoint_path + ".tmp", checkpoint_path)
+            if status == "running":
+                yield (*self.get_conditions_from_positions(top_conditions.get_positions()),
+                       self.get_search_progress(top_conditions, scored, n_obs, rounds_done, changed, status))
+
+        self.logger.info(f"Progressive transcriptome search finished ({status}) after scoring {scored} of {n_obs} conditions.")
+        yield (*self.get_conditions_from_positions(top_conditions.get_positions()),
+               self.get_search_progress(top_conditions, scored, n_obs, rounds_done, changed, status))
+
+    @staticmethod
+    def get_search_progress(top_conditions, scored, total, rounds, changed, status):
+        """
+        Describe the progress of a progressive transcriptome search.
+
+        Args:
+            top_conditions (Top_k_conditions): The provisional selection.
+            scored (int): The number of conditions scored.
+            total (int): The number of conditions in the transcriptomic vector store.
+            rounds (int): The number of rounds done.
+            changed (float): The fraction of the provisional results which changed in the last round.
+            status (str): The state of the search.
+
+        Returns:
+            dict: The progress, as described in ``progressive_transcriptome_search``.
+        """
+        k = min(top_conditions.k, total)
+        return {
+            "scored": scored,
+            "total": total,
+            "rounds": rounds,
+            "changed": changed,
+            "kth_pval": float(top_conditions.pvals.max()) if len(top_conditions.pvals) else np.nan,
+            "recall_low": hypergeom.ppf(0.025, total, k, scored) / k,
+            "recall_high": hypergeom.ppf(0.975, total, k, scored) / k,
+            "status": status,
+            "positions": top_conditions.get_positions(),
+        }
+
+    def atlas_search(self, gene_set_name, nsamples=1000):
+        """
+        Retrieve the top conditions of a library gene set from the enrichment atlas, without scanning the transcriptomic vector store.
+
+        Args:
+            gene_set_name (str): The name of a gene set of the library the atlas was built from.
+            nsamples (int, optional): The number of top samples to retrieve, at most the k of the atlas. Defaults to 1000.
+
+        Returns:
+            tuple: A tuple containing two pandas DataFrames, as returned by ``transcriptome_search``.
+        """
+        if self.enrichment_atlas is None:
+            raise RuntimeError("No enrichment atlas loaded. Pass atlas_path to Query_DB.")
+        return self.get_conditions_from_positions(np.sort(self.enrichment_atlas.top_conditions(gene_set_name, nsamples)))
+
+    def atlas_enriched_gene_sets(self, condition, n=20):
+        """
+        Retrieve the library gene sets most enriched in a condition from the enrichment atlas.
+
+        Args:
+            condition (str): The GSM identifier of the condition.
+            n (int, optional): The number of gene sets to retrieve. Defaults to 20.
+
+        Returns:
+            pandas.DataFrame: The gene sets, from the most to the least enriched, with the columns 'estimate' (-log10 p-value)
+                and 'pvals'.
+        """
+        if self.enrichment_atlas is None:
+            raise RuntimeError("No enrichment atlas loaded. Pass atlas_path to Query_DB.")
+        position = self.transcriptome_embedding.embeddings_index.index.get_loc(condition)
+        res = self.enrichment_atlas.condition_scores(position).sort_values(ascending=False, kind="stable").head(n).to_frame()
+        res["pvals"] = 10 ** -res["estimate"].astype(np.float64)
+        return res
+
+    def gene_profile(self, genes):
+        """
+        Retrieve the expression of the given genes across every condition from the gene-major store.
+
+        Only the rows of the requested genes are read, so the cost grows with the number of genes rather than with
+        the size of the transcriptomic vector store.
+
+        Args:
+            genes (list): A list of gene symbols.
+
+        Returns:
+            pandas.DataFrame: The counts, with one row per condition and one column per gene found.
+        """
+        if self.gene_store is None:
+            raise RuntimeError("No gene-major store loaded. Pass gene_store_path to Query_DB.")
+        return self.gene_store.gene_profile(genes)
+
+    def panel_search(self, genes, nsamples=1000, method="zscore", per_series=False, filters=None):
+        """
+        Retrieve the conditions with the highest expression of a gene panel, reading only the panel genes from the gene-major store.
+
+        Args:
+            genes (list): A list of gene symbols.
+            nsamples (int, optional): The number of top samples to retrieve. Defaults to 1000.
+            method (str, optional): The panel score, either "mean" (mean log expression) or "zscore" (mean of the log
+                expression standardized per gene). Defaults to "zscore".
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series.
+                Defaults to False.
+            filters (list, optional): Predicates on the metadata of the conditions, as in ``transcriptome_search``. Defaults to None.
+
+        Returns:
+            tuple: A tuple containing two pandas DataFrames, as returned by ``transcriptome_search``.
+        """
+        if self.gene_store is None:
+            raise RuntimeError("No gene-major store loaded. Pass gene_store_path to Query_DB.")
+        scores = self.gene_store.panel_scores(genes, method)
+        positions = np.arange(len(scores)) if filters is None else self.metadata_index.filter_positions(filters)
+        if per_series and self.series_codes is None:
+            self.series_codes = pd.factorize(self.transcriptome_embedding.embeddings_index["series_id"])[0]
+        top_conditions = Top_k_conditions(nsamples, self.series_codes if per_series else None)
+        # the selection keeps the lowest values
+        top_conditions.update(positions, -scores[positions])
+        return self.get_conditions_from_positions(top_conditions.get_positions())
+
+    def signature_search(self, up_genes=None, down_genes=None, nsamples=1000, per_series=False, filters=None):
+        """
+        Retrieve the conditions matching a signature of up and down genes, scored locally against the transcriptomic vector store.
+
+        A condition scores high when the up genes are more expressed and the down genes less expressed than in
+        other conditions (see ``Transcriptome_enrichment.iter_signature_scores``).
+
+        Args:
+            up_genes (list, optional): The genes up in the signature. Defaults to None.
+            down_genes (list, optional): The genes down in the signature. Defaults to None.
+            nsamples (int, optional): The number of top samples to retrieve. Defaults to 1000.
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series.
+                Defaults to False.
+            filters (list, optional): Predicates on the metadata of the conditions, as in ``transcriptome_search``. Defaults to None.
+
+        Returns:
+            tuple: A tuple containing two pandas DataFrames, as returned by ``transcriptome_search``.
+        """
+        signature = {"up": up_genes or [], "down": down_genes or []}
+        return self.signature_search_many({"signature": signature}, nsamples, per_series, filters)["signature"]
+
+    def signature_search_many(self, signatures, nsamples=1000, per_series=False, filters=None):
+        """
+        Retrieve the conditions matching many signatures of up and down genes, in a single pass over the transcriptomic vector store.
+
+        Args:
+            signatures (dict): A dictionary mapping signature names to dictionaries with "up" and/or "down" lists of genes.
+            nsamples (int, optional): The number of top samples to retrieve per signature. Defaults to 1000.
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series
+                for every signature. Defaults to False.
+            filters (list, optional): Predicates on the metadata of the conditions, as in ``transcriptome_search``. Defaults to None.
+
+        Returns:
+            dict: A dictionary mapping each signature name to the tuple returned by ``transcriptome_search``.
+        """
+        if self.transcriptome_search_possible is False:
+            # throw an error if the transcriptome is sparse
+            raise RuntimeError("This database cannot be used for search. Download the full database to perform search.")
+        if filters is not None:
+            selected = np.zeros(self.transcriptome_enrichment.memmap_adata.n_obs, dtype=bool)
+            selected[self.metadata_index.filter_positions(filters)] = True
+        else:
+            selected = None
+        if per_series and self.series_codes is None:
+            self.series_codes = pd.factorize(self.transcriptome_embedding.embeddings_index["series_id"])[0]
+
+        self.logger.info(f"Starting signature search for {len(signatures)} signatures...")
+        batch_size = self.execution_profile.get_batch_size(
+            "signature", self.transcriptome_enrichment.memmap_adata.n_vars, extra_bytes_per_row=16 * len(signatures)
+        )
+        top_conditions = self.transcriptome_enrichment.top_signature_conditions(
+            signatures, nsamples, self.series_codes if per_series else None, selected, batch_size
+        )
+        return {
+            name: self.get_conditions_from_positions(selection.get_positions())
+            for name, selection in zip(signatures, top_conditions)
+        }
+
+    def profile_search(self, counts, groups=None, k=10, batch_size=None):
+        """
+        Retrieve the conditions and studies closest to user expression profiles.
+
+        The samples are aligned to the genes of the transcriptomic vector store, averaged per condition as in the
+        database build, and projected with the stored random projection matrix (varm["projection"]), in blocks of
+        samples. The closest conditions of all the profiles are then found in one batched similarity pass over the
+        condition embeddings.
+
+        Args:
+            counts (str or anndata.AnnData or pandas.DataFrame): The counts, with one row per sample and one column per
+                gene, or the path to an h5ad or a CSV file (see ``Expression_profile.iter_count_blocks``).
+            groups (dict or pandas.Series or str, optional): The condition of every sample, or the name of an obs
+                column of the h5ad file. Defaults to one condition per sample.
+            k (int, optional): The number of closest conditions per profile. Defaults to 10.
+            batch_size (int, optional): The number of samples read per block. Defaults to the native block size of
+                the execution profile, or 1000.
+
+        Returns:
+            tuple: A DataFrame of the closest conditions of every profile, with the profile in the 'query' column,
+                the series in the 'gse_id' column and the cosine similarity in the 'similarity_score' column, and a
+                DataFrame of the closest studies of every profile, with their best similarity.
+        """
+        if self.transcriptome_enrichment.projection is None:
+            raise RuntimeError("The transcriptomic vector store has no projection matrix.")
+        if batch_size is None:
+            batch_size = self.execution_profile.get_batch_size("native", self.transcriptome_enrichment.memmap_adata.n_vars, default=1000)
+        expression_profile = Expression_profile(self.transcriptome_enrichment.gene_index, self.transcriptome_enrichment.projection)
+        condition_counts = expression_profile.aggregate(counts, groups, batch_size)
+        embeddings = expression_profile.embed(condition_counts, batch_size)
+        positions, similarities = self.transcriptome_embedding.get_closest_conditions_by_embedding(embeddings, k)
+
+        embeddings_index = self.transcriptome_embedding.embeddings_index
+        conditions = embeddings_index.iloc[positions.ravel()].rename(columns={"series_id": "gse_id"})
+        conditions.insert(0, "query", np.repeat(condition_counts.index, positions.shape[1]))
+        conditions["similarity_score"] = similarities.ravel()
+        studies = (
+            conditions.groupby(["query", "gse_id"], observed=True, sort=False)["similarity_score"].max()
+            .reset_index().sort_values(["query", "similarity_score"], ascending=[True, False], kind="stable")
+            .reset_index(drop=True)
+        )
+        return conditions, studies
+
+    def get_conditions_from_positions(self, positions):
+        """
+        Retrieve the conditions at the given row positions of the transcriptomic vector store.
+
+        Args:
+            positions (numpy.ndarray): The row positions of the conditions.
+
+        Returns:
+            tuple: A DataFrame of the conditions, with the series in the 'gse_id' column, and the series of the conditions.
+        """
+        series_of_interest = self.transcriptome_embedding.embeddings_index.iloc[positions]
         relevant_series = series_of_interest["series_id"]  # extract only studies (series)
         series_of_interest = series_of_interest.rename(columns={"series_id": "gse_id"})
         return series_of_interest, relevant_series
         
     
-    def semantic_search(self, test_text, k=50):
+    def semantic_search(self, test_text, k=50, ef=None):
         """
         Perform semantic search using the RAG embedding model.
 
         Parameters:
         - test_text (str): The text to search for.
         - k (int): The number of results to retrieve (default is 50).
+        - ef (int): The number of candidates explored by the approximate nearest-neighbour index of the semantic
+          vector store, if present (default is the ef_search of the index).
 
         Returns:
         - df_res (DataFrame): The search results as a DataFrame.
         - df_res["gse_id"] (Series): The series containing the "gse_id" column from the search results.
         """
         self.logger.info("Starting semantic search...")
-        df_res = self.rag_embedding.query_rag(test_text, k=k)
+        df_res = self.rag_embedding.query_rag(test_text, k=k, ef=ef)
         return df_res, df_res["gse_id"]
+
+    def semantic_search_many(self, text_queries, k=50, ef=None):
+        """
+        Perform semantic search for many text queries at once.
+
+        The queries are encoded in one batch and compared with the studies in blocks of queries (see
+        ``Rag_embedding.query_rag_many``), instead of one encoding and one pass over the studies per query.
+
+        Parameters:
+        - text_queries (dict or list): A dictionary mapping query names to texts, or a list of texts.
+        - k (int): The number of results to retrieve per query (default is 50).
+        - ef (int): The number of candidates explored by the approximate nearest-neighbour index, as for ``semantic_search``.
+
+        Returns:
+        - dict: A dictionary mapping each query name to the tuple returned by ``semantic_search``.
+        """
+        self.logger.info(f"Starting semantic search for {len(text_queries)} queries...")
+        results = self.rag_embedding.query_rag_many(text_queries, k=k, ef=ef)
+        return {name: (df_res, df_res["gse_id"]) for name, df_res in results.items()}
  
     def get_transcriptome_series_of_relevance_from_series(self, series_of_interest, k=5):
         """
@@ -194,7 +750,7 @@ class Query_DB:
             res_temp = self.transcriptome_embedding.get_closest_transcriptional_studies(i, k=k)
             series_list.append(res_temp)
         additional_series = pd.concat(series_list)
-        additional_series["gse_id_text"] = [self.rag_embedding.get_text_linked_to_gse(i) for i in additional_series["gse_id"]]
+        additional_series["gse_id_text"] = self.rag_embedding.get_texts_linked_to_gse(additional_series["gse_id"])
         return additional_series
     
     def get_semantic_series_of_relevance_from_series(self, series_of_interest, k=5):
@@ -218,7 +774,53 @@ class Query_DB:
         return additional_series
     
 
-    def transcriptome_search_with_semantic_expansion(self, geneset_query, search=1000, expand=5):
+    def semantically_prefiltered_transcriptome_search(self, geneset, text_query, nsamples=1000, n_series=200, method=None, per_series=False, filters=None):
+        """
+        Perform a transcriptome search restricted to the conditions of the series most relevant to a text query.
+
+        The n_series series closest to the text query are retrieved with ``semantic_search``, and only their conditions
+        are scored, which reduces the number of conditions scored from the whole vector store to a few thousand.
+
+        Args:
+            geneset (list): A list of genes to search for in the transcriptome.
+            text_query (str): The text query selecting the series to search.
+            nsamples (int, optional): The number of top samples to retrieve. Defaults to 1000.
+            n_series (int, optional): The number of semantically relevant series to search. Defaults to 200.
+            method (str, optional): The ORA engine, either "index" or "native". Defaults to "index" when the vector store
+                has a top-gene index, otherwise "native".
+            per_series (bool, optional): If True, return the best condition of each of the top nsamples distinct series.
+                Defaults to False.
+            filters (list, optional): Predicates on the metadata of the conditions, as in ``transcriptome_search``. Defaults to None.
+
+        Returns:
+            tuple: A tuple containing two pandas DataFrames, as returned by ``transcriptome_search``.
+        """
+        if self.transcriptome_search_possible is False:
+            # throw an error if the transcriptome is sparse
+            raise RuntimeError("This database cannot be used for search. Download the full database to perform search.")
+        if method is None:
+            method = "native" if self.transcriptome_enrichment.top_gene_index is None else "index"
+        if method not in ("index", "native"):
+            raise ValueError("method should be one of 'index' or 'native'.")
+        _, relevant_series = self.semantic_search(text_query, k=n_series)
+        embeddings_index = self.transcriptome_embedding.embeddings_index
+        positions = np.flatnonzero(embeddings_index["series_id"].isin(relevant_series).values)
+        if filters is not None:
+            positions = np.intersect1d(positions, self.metadata_index.filter_positions(filters))
+        self.logger.info(f"Scoring {len(positions)} conditions from {len(relevant_series)} semantically relevant series...")
+
+        if per_series and self.series_codes is None:
+            self.series_codes = pd.factorize(embeddings_index["series_id"])[0]
+        top_conditions = Top_k_conditions(nsamples, self.series_codes if per_series else None)
+        if len(positions) > 0:
+            pvals = self.transcriptome_enrichment.run_ora_on_positions(
+                geneset, positions, use_index=method == "index",
+                batch_size=self.execution_profile.get_batch_size("native", self.transcriptome_enrichment.memmap_adata.n_vars)
+            )
+            top_conditions.update(positions, pvals)
+        return self.get_conditions_from_positions(top_conditions.get_positions())
+
+    def transcriptome_search_with_semantic_expansion(self, geneset_query, search=1000, expand=5, per_series=False, filters=None):
         """
         Perform a transcriptome search with semantic expansion.
 
@@ -226,6 +828,8 @@ class Query_DB:
             geneset_query (str): The query for the geneset.
             search (int, optional): The number of samples to search. Defaults to 1000.
             expand (int, optional): The number of additional series to expand the search. Defaults to 5.
+            per_series (bool, optional): Whether the search returns distinct series. Defaults to False.
+            filters (list, optional): Predicates on the metadata of the conditions, as in ``transcriptome_search``. Defaults to None.
 
         Returns:
             tuple or None: A tuple containing the additional series and the series dataframe if expand is not 0,
@@ -240,14 +844,14 @@ class Query_DB:
         self.logger.info("search: " + str(search)),
         self.logger.info("expand: " + str(expand))
         if expand == 0:
-            series_df, series_of_interest = self.transcriptome_search(geneset_query, search)
+            series_df, series_of_interest = self.transcriptome_search(geneset_query, search, per_series=per_series, filters=filters)
             return None, series_df
         else:
-            series_df, series_of_interest = self.transcriptome_search(geneset=geneset_query, nsamples=search)
+            series_df, series_of_interest = self.transcriptome_search(geneset=geneset_query, nsamples=search, per_series=per_series, filters=filters)
             additional_series = self.get_semantic_series_of_relevance_from_series(series_of_interest, expand)
             return additional_series, series_df
 
-    def transcriptome_search_with_transcriptome_expansion(self, geneset_query, search=1000, expand=10):
+    def transcriptome_search_with_transcriptome_expansion(self, geneset_query, search=1000, expand=10, per_series=False, filters=None):
         """
         Perform a transcriptome search with transcriptome expansion.
 
@@ -255,6 +859,8 @@ class Query_DB:
             geneset_query (str): The geneset query to search for.
             search (int): The number of search results to retrieve. Default is 1000.
             expand (int): The number of additional series to expand the search. Default is 10.
+            per_series (bool): Whether the search returns distinct series. Default is False.
+            filters (list): Predicates on the metadata of the conditions, as in ``transcriptome_search``. Default is None.
 
         Returns:
             tuple or None: A tuple containing the additional series and the series dataframe if expand is not 0,
@@ -270,10 +876,10 @@ class Query_DB:
         self.logger.info("search: " + str(search))
         self.logger.info("expand: " + str(expand))  
         if expand == 0:
-            series_df, series_of_interest = self.transcriptome_search(geneset_query, search)
+            series_df, series_of_interest = self.transcriptome_search(geneset_query, search, per_series=per_series, filters=filters)
             return None, series_df
         else:
-            series_df, series_of_interest = self.transcriptome_search(geneset_query, search)
+            series_df, series_of_interest = self.transcriptome_search(geneset_query, search, per_series=per_series, filters=filters)
             additional_series = self.get_transcriptome_series_of_relevance_from_series(series_of_interest, expand)
             return additional_series, series_df
 
@@ -325,18 +931,22 @@ class Query_DB:
             additional_series = self.get_transcriptome_series_of_relevance_from_series(series_of_interest, expand)
             return additional_series, series_df
 
-    def search(self, geneset, text_query, search="semantic", expand="transcriptome", perform_enrichment=False, n_seed=None, n_expansion=None):
+    def search(self, geneset, text_query, search="semantic", expand="transcriptome", perform_enrichment=False, n_seed=None, n_expansion=None, per_series=False, filters=None):
         """
         Perform a search using the specified parameters.
 
         Args:
             geneset (list): A list of genes to search for.
             text_query (str): The text query to search for.
-            search (str, optional): The type of search to perform. Defaults to "semantic".
+            search (str, optional): The type of search to perform, either "semantic", "transcriptome" or "prefiltered"
+                (a transcriptome search restricted to the series most relevant to the text query). Defaults to "semantic".
             expand (str, optional): The type of expansion to perform. Defaults to "transcriptome".
             perform_enrichment (bool, optional): Whether to perform enrichment analysis. Defaults to False.
             n_seed (int, optional): The number of seed studies to include. Defaults to None.
             n_expansion (int, optional): The number of expansion studies to include. Defaults to None.
+            per_series (bool, optional): Whether transcriptome search returns distinct series. Defaults to False.
+            filters (list, optional): Predicates on the metadata of the conditions scored by transcriptome search, as
+                (column, operator, value) tuples (see ``transcriptome_search``). Defaults to None.
 
         Raises:
             ValueError: If the gene set is empty or has less than 5 genes.
@@ -369,6 +979,9 @@ class Query_DB:
 
         results_object = Results(None, None, None) # new results object
 
+        if search == "prefiltered" and (geneset is None or text_query is None):
+            raise ValueError("Prefiltered search requires both a gene set and a text query.")
+
         if text_query is None:
             search = "transcriptome"
             self.logger.info("Search type set to transcriptome by default.")
@@ -399,19 +1012,32 @@ class Query_DB:
                     additional_series, seed_series = self.semantic_search_with_semantic_expansion(text_query, search = n_seed, expand = n_expansion)
                 results_object.seed_studies = seed_series
                 results_object.expansion_studies = additional_series
+        if search == "prefiltered":
+            if n_seed is None and n_expansion is None:
+                seed_series, series_of_interest = self.semantically_prefiltered_transcriptome_search(geneset, text_query, per_series=per_series, filters=filters)
+                n_expansion = 10 if expand == "transcriptome" else 5
+            else:
+                seed_series, series_of_interest = self.semantically_prefiltered_transcriptome_search(geneset, text_query, nsamples=n_seed, per_series=per_series, filters=filters)
+            if n_expansion == 0:
+                results_object.expansion_studies = None
+            elif expand == "transcriptome":
+                results_object.expansion_studies = self.get_transcriptome_series_of_relevance_from_series(series_of_interest, n_expansion)
+            elif expand == "semantic":
+                results_object.expansion_studies = self.get_semantic_series_of_relevance_from_series(series_of_interest, n_expansion)
+            results_object.seed_studies = seed_series
         if search == "transcriptome":
             if expand == "transcriptome":
                 if n_seed is None and n_expansion is None:
-                    additional_series, seed_series = self.transcriptome_search_with_transcriptome_expansion(geneset)
+                    additional_series, seed_series = self.transcriptome_search_with_transcriptome_expansion(geneset, per_series=per_series, filters=filters)
                 else:
-                    additional_series, seed_series = self.transcriptome_search_with_transcriptome_expansion(geneset, search = n_seed, expand = n_expansion)
+                    additional_series, seed_series = self.transcriptome_search_with_transcriptome_expansion(geneset, search = n_seed, expand = n_expansion, per_series = per_series, filters = filters)
                 results_object.seed_studies = seed_series
                 results_object.expansion_studies = additional_series
             elif expand == "semantic":
                 if n_seed is None and n_expansion is None:
-                    additional_series, seed_series = self.transcriptome_search_with_semantic_expansion(geneset)
+                    additional_series, seed_series = self.transcriptome_search_with_semantic_expansion(geneset, per_series=per_series, filters=filters)
                 else :
-                    additional_series, seed_series = self.transcriptome_search_with_semantic_expansion(geneset, search = n_seed, expand = n_expansion)
+                    additional_series, seed_series = self.transcriptome_search_with_semantic_expansion(geneset, search = n_seed, expand = n_expansion, per_series = per_series, filters = filters)
                 results_object.seed_studies = seed_series
                 results_object.expansion_studies = additional_series
 
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+
+class Search_cache:
+    def __init__(self, cache_path, max_bytes=256 * 2**20, table="results"):
+        """
+        Initializes an on-disk cache of search results, stored in a SQLite database.
+
+        Entries are keyed by a hash of the query, and the least recently used entries are evicted once
+        the stored results exceed max_bytes. Each table of the database is a separate cache with its own
+        budget, so that cheap entries, such as query embeddings, never evict search results.
+
+        Parameters:
+        - cache_path (str): The path to the SQLite database, created if it does not exist.
+        - max_bytes (int): The maximum total size of the cached results of the table in bytes (default is 256 MiB).
+        - table (str): The name of the table holding the cache (default is results).
+        """
+        if not table.isidentifier():
+            raise ValueError(f"The table name {table} is not a valid identifier.")
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(cache_path)
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+
+    @staticmethod
+    def fingerprint_file(path, n_bytes=2**20):
+        """
+        Compute a fingerprint of a file which changes when the file is rewritten.
+
+        The fingerprint combines the size and modification time of the file with a hash of its first
+        n_bytes, so that it is cheap to compute for vector stores of tens of gigabytes.
+
+        Args:
+            path (str): The path to the file.
+            n_bytes (int, optional): The number of leading bytes hashed. Defaults to 1 MiB.
+
+        Returns:
+            str: The hexadecimal fingerprint.
+        """
+        stat = os.stat(path)
+        digest = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        with open(path, "rb") as f:
+            digest.update(f.read(n_bytes))
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(**query):
+        """
+        Compute the cache key of a query.
+
+        Gene lists are normalized to their sorted unique genes, so the order and repetition of the genes
+        do not change the key.
+
+        Args:
+            **query: The query parameters, such as the gene set, the scoring parameters and the fingerprint of
+                the vector store.
+
+        Returns:
+            str: The hexadecimal key.
+        """
+        normalized = {
+            name: sorted(set(value)) if isinstance(value, (list, tuple, set)) else value
+            for name, value in query.items()
+        }
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key, dtype=np.int64):
+        """
+        Retrieve a cached array and mark it as recently used.
+
+        Args:
+            key (str): The cache key, as returned by ``make_key``.
+            dtype (numpy.dtype, optional): The type the array was stored with. Defaults to int64.
+
+        Returns:
+            numpy.ndarray or None: The cached array, or None if the key is not cached.
+        """
+        return self.get_many([key], dtype).get(key)
+
+    def get_many(self, keys, dtype=np.int64):
+        """
+        Retrieve many cached arrays and mark them as recently used, in one transaction.
+
+        Args:
+            keys (list): The cache keys.
+            dtype (numpy.dtype, optional): The type the arrays were stored with. Defaults to int64.
+
+        Returns:
+            dict: A dictionary mapping the cached keys to their arrays. Keys which are not cached are left out.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT key, value FROM {self.table} WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((key, np.frombuffer(value, dtype=dtype)) for key, value in rows)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if found:
+            with self.connection:
+                now = time.time()
+                self.connection.executemany(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put(self, key, value, dtype=np.int64):
+        """
+        Store an array in the cache, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (str): The cache key, as returned by ``make_key``.
+            value (numpy.ndarray): The array to cache.
+            dtype (numpy.dtype, optional): The type the array is stored with. Defaults to int64.
+
+        Returns:
+            None
+        """
+        self.put_many({key: value}, dtype)
+
+    def put_many(self, values, dtype=np.int64):
+        """
+        Store many arrays in the cache in one transaction, evicting the least recently used entries if the cache is full.
+
+        Args:
+            values (dict): A dictionary mapping cache keys to arrays.
+            dtype (numpy.dtype, optional): The type the arrays are stored with. Defaults to int64.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        rows = []
+        for key, value in values.items():
+            value = np.ascontiguousarray(value, dtype=dtype).tobytes()
+            rows.append((key, value, len(value), now))
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            excess = self.connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return
+            evicted = []
+            for old_key, size in self.connection.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access"):
+                if excess <= 0:
+                    break
+                evicted.append((old_key,))
+                excess -= size
+            self.connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted)
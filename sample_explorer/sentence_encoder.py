@@ -0,0 +1,59 @@
+import logging
+import os
+import threading
+
+
+class Sentence_encoder:
+    default_model = "paraphrase-MiniLM-L6-v2"
+    # the SentenceTransformer models loaded in this process, by model name or absolute model directory
+    models = {}
+    lock = threading.Lock()
+
+    def __init__(self, model_name_or_path=None):
+        """
+        Initializes a handle on a sentence encoder which is loaded on the first encode and shared by the whole process.
+
+        Creating an encoder neither imports torch nor loads the model, so that transcriptome searches never pay for
+        them. The first call to ``encode`` of any encoder of a model loads it once for every encoder of the process.
+        Weights exported to an npz file with ``Numpy_encoder.export`` are run by ``Numpy_encoder``, without torch.
+
+        Parameters:
+        - model_name_or_path (str): The name of a SentenceTransformer model, the path to a local model directory,
+          e.g. a copy saved with ``SentenceTransformer.save`` for machines without access to the model hub, or the
+          path to weights exported with ``Numpy_encoder.export`` (default is paraphrase-MiniLM-L6-v2).
+        """
+        if model_name_or_path is None:
+            model_name_or_path = self.default_model
+        if os.path.isdir(model_name_or_path) or model_name_or_path.endswith(".npz"):
+            model_name_or_path = os.path.abspath(model_name_or_path)
+        self.model_name_or_path = model_name_or_path
+
+    def get_model(self):
+        """
+        Return the model, loading it if no encoder of the process has loaded it yet.
+
+        Returns:
+            sentence_transformers.SentenceTransformer or Numpy_encoder: The model.
+        """
+        with self.lock:
+            if self.model_name_or_path not in self.models and self.model_name_or_path.endswith(".npz"):
+                from .numpy_encoder import Numpy_encoder
+                self.models[self.model_name_or_path] = Numpy_encoder(self.model_name_or_path)
+                logging.getLogger(__name__).info(f"Loaded NumPy encoder {self.model_name_or_path}.")
+            elif self.model_name_or_path not in self.models:
+                from sentence_transformers import SentenceTransformer
+                self.models[self.model_name_or_path] = SentenceTransformer(self.model_name_or_path)
+                logging.getLogger(__name__).info(f"Loaded SentenceTransformer model {self.model_name_or_path}.")
+            return self.models[self.model_name_or_path]
+
+    def encode(self, texts):
+        """
+        Encode texts with the model.
+
+        Args:
+            texts (str or list): A text or a list of texts.
+
+        Returns:
+            numpy.ndarray: The embedding of the text, or one row per text.
+        """
+        return self.get_model().encode(texts)
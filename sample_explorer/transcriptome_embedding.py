@@ -92,4 +92,40 @@ class Transcriptome_embedding:
         cosine_similarities = cosine_similarity(query_vector, self.embedding_matrix)
         closest_indices = np.argsort(cosine_similarities[0])[-k:][::-1]
         closest_samples = self.embeddings_index.iloc[closest_indices,:]
-        return closest_samples
\ No newline at end of file
+        return closest_samples
+
+    def get_closest_conditions_by_embedding(self, query_embeddings, k = 5, batch_size = 50000):
+        """
+        Retrieves the closest conditions of many query embeddings, in a single pass over the embedding matrix.
+
+        The embedding matrix is read in blocks of conditions, the cosine similarities of each block with all the
+        queries are computed with one matrix product, and the running top k of every query is kept.
+
+        Parameters:
+            query_embeddings (numpy.ndarray): A (queries x components) array of embeddings.
+            k (int): The number of closest conditions to retrieve per query. Default is 5.
+            batch_size (int): The number of conditions read per block. Default is 50000.
+        Returns:
+            tuple: The (queries x k) positions of the closest conditions and their cosine similarities, from the most
+                to the least similar.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(query_norms > 0, query_norms, 1.0)
+        n_obs = self.embedding_matrix.shape[0]
+        k = min(k, n_obs)
+        best_positions = np.empty((len(queries), 0), dtype=np.int64)
+        best_similarities = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, n_obs, batch_size):
+            block = np.asarray(self.embedding_matrix[start:start + batch_size], dtype=np.float32)
+            norms = np.linalg.norm(block, axis=1)
+            similarities = (queries @ block.T) / np.where(norms > 0, norms, 1.0)
+            positions = np.hstack([best_positions, np.broadcast_to(np.arange(start, start + len(block)), similarities.shape)])
+            similarities = np.hstack([best_similarities, similarities])
+            # the first blocks may hold fewer than k conditions
+            n_keep = min(k, similarities.shape[1])
+            keep = np.argpartition(-similarities, n_keep - 1, axis=1)[:, :n_keep]
+            best_positions = np.take_along_axis(positions, keep, axis=1)
+            best_similarities = np.take_along_axis(similarities, keep, axis=1)
+        order = np.argsort(-best_similarities, axis=1, kind="stable")
+        return np.take_along_axis(best_positions, order, axis=1), np.take_along_axis(best_similarities, order, axis=1)
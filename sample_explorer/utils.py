@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
+import anndata as ad
 from .rag_embedding import Rag_embedding
+from .enrichment import Transcriptome_enrichment
+from .execution_profile import Execution_profile
 import requests
 
 class Sample_to_series_map:
@@ -84,6 +87,83 @@ class ARCHS4_API_query:
         return df, samps
 
 
+class Local_signature_query(ARCHS4_API_query):
+    def __init__(self, h5_path, transcriptomic_vector_store, nsamples=1000, profile_path=None, max_memory=None):
+        """
+        Initializes a signature search against the local transcriptomic vector store, in place of the ARCHS4 signature API.
+
+        Samples are returned as ranked lists of GSM ids, as by ``ARCHS4_API_query.extract_sig``, so the two can be
+        used interchangeably. Many signatures are scored in a single pass over the vector store with ``extract_sigs``.
+
+        Parameters:
+        - h5_path (str): The path to the pickled GEO metadata, as for ``ARCHS4_API_query``.
+        - transcriptomic_vector_store (str): The path to the transcriptomic vector store.
+        - nsamples (int): The number of samples returned per signature (default is 1000).
+        - profile_path (str): The path to an execution profile written by ``Execution_profile.autotune`` (default is
+          None, no tuned block sizes).
+        - max_memory (int or str): The memory budget of a block, as for ``Execution_profile`` (default is None).
+        """
+        super().__init__(h5_path)
+        self.transcriptome_enrichment = Transcriptome_enrichment(ad.read_h5ad(transcriptomic_vector_store, backed="r"))
+        self.nsamples = nsamples
+        self.execution_profile = Execution_profile(profile_path, max_memory)
+
+    def extract_sigs(self, direction, sig_lists):
+        """
+        Retrieve the samples matching many gene sets, in a single pass over the transcriptomic vector store.
+
+        Args:
+            direction (str): "up" for samples where the genes are up, otherwise samples where they are down.
+            sig_lists (dict): A dictionary mapping signature names to lists of genes.
+
+        Returns:
+            dict: A dictionary mapping each signature name to its samples, from the best to the worst match.
+        """
+        direction = "up" if direction == "up" else "down"
+        signatures = {name: {direction: sig_list} for name, sig_list in sig_lists.items()}
+        batch_size = self.execution_profile.get_batch_size(
+            "signature", self.transcriptome_enrichment.memmap_adata.n_vars, extra_bytes_per_row=16 * len(signatures)
+        )
+        top_conditions = self.transcriptome_enrichment.top_signature_conditions(signatures, self.nsamples, batch_size=batch_size)
+        obs_names = self.transcriptome_enrichment.memmap_adata.obs_names
+        return {
+            name: list(obs_names[selection.get_ranked_positions()])
+            for name, selection in zip(signatures, top_conditions)
+        }
+
+    def extract_sig(self, direction, sig_list):
+        """
+        Retrieve the samples matching a gene set, as ``ARCHS4_API_query.extract_sig`` does with the signature API.
+
+        Args:
+            direction (str): "up" for samples where the genes are up, otherwise samples where they are down.
+            sig_list (list): A list of genes.
+
+        Returns:
+            list: The samples, from the best to the worst match.
+        """
+        return self.extract_sigs(direction, {"example_query": sig_list})["example_query"]
+
+
+def read_gmt(gmt_path):
+    """
+    Read a gene set library in GMT format.
+
+    Args:
+        gmt_path (str): The path to the GMT file, with one gene set per line: the name, a description or link, and the genes, separated by tabs.
+
+    Returns:
+        dict: A dictionary mapping gene set names to lists of gene symbols.
+    """
+    gene_sets = {}
+    with open(gmt_path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 2:
+                gene_sets[fields[0]] = [gene for gene in fields[2:] if gene]
+    return gene_sets
+
+
 class MsigDB_store:
     def __init__(self, signature_df_path, signature_metadata_df_path):
         self.signature_metadata_df = pd.read_csv(signature_metadata_df_path)
@@ -0,0 +1,21 @@
+import numpy as np
+import anndata as ad
+from sample_explorer.ann_index import Hnsw_index
+
+x = ad.read_h5ad("tests/test_semantic_db.h5ad")
+
+def test_ann_search_matches_exact_search():
+    index = Hnsw_index.build(x.X, M = 8, ef_construction = 50)
+    vectors = Hnsw_index.normalize(x.X)
+    for row in range(0, x.n_obs, 10):
+        positions, distances = index.search(x.X[row], k = 5, ef = x.n_obs)
+        exact = np.argsort(1 - vectors @ vectors[row], kind = "stable")[:5]
+        assert positions[0] == row
+        assert np.allclose(distances, 1 - vectors[exact] @ vectors[row], atol = 1e-5)
+
+def test_ann_index_roundtrip(tmp_path):
+    index = Hnsw_index.build(x.X, M = 8, ef_construction = 50)
+    index_path = Hnsw_index.index_path(str(tmp_path / "semantic_db.h5ad"))
+    index.save(index_path)
+    loaded = Hnsw_index.load(index_path, x.X)
+    assert np.array_equal(loaded.search(x.X[3])[0], index.search(x.X[3])[0])
@@ -0,0 +1,22 @@
+import numpy as np
+import anndata as ad
+from sample_explorer.atlas import Enrichment_atlas
+from sample_explorer.enrichment import Transcriptome_enrichment
+
+test_geneset =  ["IDI1", "SP100","KLF6", "PLPP1", "NEO1", "TSPAN6"]
+
+def build_atlas(tmp_path):
+    gmt_path = tmp_path / "library.gmt"
+    gmt_path.write_text("TEST\tlink\t" + "\t".join(test_geneset) + "\nSUBSET\tlink\t" + "\t".join(test_geneset[:3]) + "\n")
+    Enrichment_atlas.build("tests/test_transcriptome_db.h5ad", str(gmt_path), str(tmp_path / "atlas.h5"), k = 10)
+    return Enrichment_atlas(str(tmp_path / "atlas.h5"))
+
+def test_atlas_top_conditions(tmp_path):
+    atlas = build_atlas(tmp_path)
+    te = Transcriptome_enrichment(ad.read_h5ad("tests/test_transcriptome_db.h5ad", backed = "r"))
+    pvals = te.run_native_ora(test_geneset)["pvals"].values
+    assert np.array_equal(atlas.top_conditions("TEST"), np.argsort(pvals, kind = "stable")[:10])
+
+def test_atlas_condition_scores(tmp_path):
+    atlas = build_atlas(tmp_path)
+    assert list(atlas.condition_scores(0).index) == ["TEST", "SUBSET"]
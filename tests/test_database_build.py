@@ -0,0 +1,53 @@
+import shutil
+import anndata as ad
+import numpy as np
+from sample_explorer.database_build import Transcriptome_db_builder
+from sample_explorer.enrichment import Transcriptome_enrichment
+from sample_explorer.gene_store import Gene_major_store
+
+test_geneset =  ["IDI1", "SP100","KLF6", "PLPP1", "NEO1", "TSPAN6"]
+
+def test_top_gene_index_matches_native_ora(tmp_path):
+    path = tmp_path / "test_transcriptome_db.h5ad"
+    shutil.copy("tests/test_transcriptome_db.h5ad", path)
+    Transcriptome_db_builder(str(path)).add_top_gene_index(chunk_rows = 100)
+    te = Transcriptome_enrichment(ad.read_h5ad(path, backed = "r"))
+    assert "top_genes" not in te.memmap_adata.obsm
+    assert te.run_indexed_ora(test_geneset).equals(te.run_native_ora(test_geneset))
+    for positions in (np.arange(3, te.memmap_adata.n_obs, 7), np.arange(3, te.memmap_adata.n_obs, 2)):
+        assert (te.run_ora_on_positions(test_geneset, positions) == te.run_ora_on_positions(test_geneset, positions, use_index = False)).all()
+
+def test_clean_matrix_flags(tmp_path):
+    path = tmp_path / "test_transcriptome_db.h5ad"
+    shutil.copy("tests/test_transcriptome_db.h5ad", path)
+    before = Transcriptome_enrichment(ad.read_h5ad(path, backed = "r")).run_native_ora(test_geneset)
+    Transcriptome_db_builder(str(path)).clean_matrix()
+    te = Transcriptome_enrichment(ad.read_h5ad(path, backed = "r"))
+    assert te.finite_values and te.gene_index.is_unique
+    assert te.run_native_ora(test_geneset).equals(before)
+
+def test_projection_shortlist_is_scored_exactly(tmp_path):
+    path = tmp_path / "test_transcriptome_db.h5ad"
+    shutil.copy("tests/test_transcriptome_db.h5ad", path)
+    Transcriptome_db_builder(str(path)).add_projection(n_components = 100)
+    te = Transcriptome_enrichment(ad.read_h5ad(path, backed = "r"))
+    assert te.projection.shape == (te.memmap_adata.n_vars, 100)
+    positions = te.shortlist_conditions(test_geneset, n_candidates = 200)
+    pvals = te.run_ora_on_positions(test_geneset, positions)
+    assert (pvals == te.run_native_ora(test_geneset)["pvals"].values[positions]).all()
+
+def test_gene_major_store_profile(tmp_path):
+    Transcriptome_db_builder("tests/test_transcriptome_db.h5ad").write_gene_major_store(str(tmp_path / "genes.h5"), batch_size = 300)
+    profile = Gene_major_store(str(tmp_path / "genes.h5")).gene_profile(test_geneset[:2])
+    te = Transcriptome_enrichment(ad.read_h5ad("tests/test_transcriptome_db.h5ad", backed = "r"))
+    block = te.get_block_reader().read(0, te.memmap_adata.n_obs)
+    assert (profile.values == block[:, te.gene_index.get_indexer(test_geneset[:2])]).all()
+
+def test_prune_genes_keeps_gene_universe(tmp_path):
+    gene_universe = Transcriptome_db_builder("tests/test_transcriptome_db.h5ad").prune_genes(str(tmp_path / "pruned.h5ad"), min_prevalence = 0.05)
+    full = Transcriptome_enrichment(ad.read_h5ad("tests/test_transcriptome_db.h5ad", backed = "r"))
+    pruned = Transcriptome_enrichment(ad.read_h5ad(tmp_path / "pruned.h5ad", backed = "r"))
+    assert pruned.memmap_adata.n_vars == gene_universe["n_vars"] <= full.memmap_adata.n_vars
+    assert pruned.default_n_up == full.default_n_up
+    block = full.get_block_reader().read(0, full.memmap_adata.n_obs)
+    assert (pruned.get_block_reader().read(0, pruned.memmap_adata.n_obs) == block[:, full.gene_index.get_indexer(pruned.gene_index)]).all()
@@ -0,0 +1,27 @@
+import numpy as np
+from sample_explorer.embedding_cache import Embedding_cache
+
+
+class Counting_model:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts])
+
+def test_encoder_skips_cached_texts(tmp_path):
+    model = Counting_model()
+    cache = Embedding_cache(model, "model", cache_path = str(tmp_path / "cache.sqlite"), max_entries = 2)
+    embeddings = cache.encode(["alpha", "beta", "alpha"])
+    assert model.encoded == ["alpha", "beta"]
+    assert embeddings.dtype == np.float32
+    assert np.array_equal(embeddings[0], embeddings[2])
+    cache.encode("beta")
+    assert model.encoded == ["alpha", "beta"]
+
+    restarted = Embedding_cache(model, "model", cache_path = str(tmp_path / "cache.sqlite"))
+    assert np.array_equal(restarted.encode(["alpha", "gamma"])[0], embeddings[0])
+    assert model.encoded == ["alpha", "beta", "gamma"]
+    Embedding_cache(model, "other model", cache_path = str(tmp_path / "cache.sqlite")).encode("alpha")
+    assert model.encoded[-1] == "alpha"
@@ -1,5 +1,8 @@
 from sample_explorer.enrichment import Transcriptome_enrichment
 import anndata as ad
+import decoupler as dc
+import numpy as np
+import pytest
 
 x = ad.read_h5ad("tests/test_transcriptome_db.h5ad", backed = "r")
 
@@ -14,4 +17,34 @@ gs_dict = {'gsa':["IDI1", "SP100","KLF6", "PLPP1", "NEO1", "TSPAN6"],
 def test_transcriptome_enrichment_dict():
     te = Transcriptome_enrichment(x)
     df = te.list_to_dc_geneset_dictionary(gs_dict)
-    df.shape == (12, 2)
\ No newline at end of file
+    df.shape == (12, 2)
+
+def test_decoupler_keeps_its_n_up_on_empty_genes():
+    adata = x[:200].to_memory()
+    adata.var_names_make_unique()
+    adata.X = np.nan_to_num(np.asarray(adata.X, dtype = np.float32))
+    adata.X[:, :300] = 0
+    # decoupler drops conditions without counts, and the block then no longer matches the conditions
+    adata = adata[adata.X.any(axis = 1)].copy()
+    te = Transcriptome_enrichment(adata)
+    genelist = list(te.gene_index[295:305]) + ["IDI1", "SP100", "KLF6", "PLPP1", "NEO1", "TSPAN6"]
+    res = te.run_decouplr_on_rows(genelist, 0, adata.n_obs)
+    expected = adata.copy()
+    dc.run_ora(mat = expected, net = te.list_to_dc_geneset(genelist), source = 'geneset', target = 'genesymbol',
+               verbose = False, use_raw = False, min_n = 1)
+    assert np.array_equal(res["pvals"].values, expected.obsm["ora_pvals"].loc[res.index].values[:, 0])
+
+def test_decoupler_refuses_other_genelists():
+    te = Transcriptome_enrichment(x)
+    with pytest.raises(TypeError):
+        te.run_decouplr_on_rows("IDI1", 0, 10)
+
+def test_top_signature_conditions():
+    te = Transcriptome_enrichment(x)
+    signatures = {"up": {"up": ["IDI1", "SP100", "KLF6"]}, "both": {"up": ["IDI1", "SP100"], "down": ["NEO1", "TSPAN6"]}}
+    selected = np.arange(x.n_obs) % 2 == 0
+    top_conditions = te.top_signature_conditions(signatures, nsamples = 10, selected = selected, batch_size = 300)
+    scores = np.vstack([block for _, _, block in te.iter_signature_scores(signatures)])
+    for j, selection in enumerate(top_conditions):
+        expected = np.flatnonzero(selected)[np.lexsort((np.flatnonzero(selected), -scores[selected, j]))][:10]
+        assert selection.get_ranked_positions().tolist() == expected.tolist()
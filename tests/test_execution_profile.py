@@ -0,0 +1,20 @@
+from sample_explorer.execution_profile import Execution_profile
+
+
+def test_batch_size_fits_max_memory():
+    assert Execution_profile.parse_memory("512M") == 512 * 2**20
+    assert Execution_profile().get_batch_size("decoupler", 67186) == 500
+    profile = Execution_profile(max_memory="64M")
+    batch_size = profile.get_batch_size("native", 67186)
+    assert batch_size * 13 * 67186 <= 64 * 2**20
+    assert profile.get_batch_size("native", 67186, workers=4) == batch_size // 4
+
+def test_autotune_writes_profile(tmp_path):
+    profile_path = str(tmp_path / "profile.json")
+    profile = Execution_profile.autotune("tests/test_transcriptome_db.h5ad", profile_path, max_memory="256M",
+                                         candidates = (50, 100), n_rows = 400)
+    loaded = Execution_profile(profile_path)
+    assert loaded.batch_sizes == profile.batch_sizes
+    assert loaded.max_memory == 256 * 2**20
+    assert loaded.get_batch_size("native", 67186) in (50, 100)
+    assert Execution_profile(profile_path, max_memory="1M").get_batch_size("native", 67186) == 1
@@ -0,0 +1,23 @@
+import shutil
+import numpy as np
+import pandas as pd
+import anndata as ad
+from sample_explorer.database_build import Transcriptome_db_builder
+from sample_explorer.enrichment import Transcriptome_enrichment
+from sample_explorer.expression_profile import Expression_profile
+
+def test_profile_embedding_matches_stored_embedding(tmp_path):
+    path = tmp_path / "test_transcriptome_db.h5ad"
+    shutil.copy("tests/test_transcriptome_db.h5ad", path)
+    Transcriptome_db_builder(str(path)).add_projection(n_components = 100)
+    db = ad.read_h5ad(path, backed = "r")
+    te = Transcriptome_enrichment(db)
+    block = te.get_block_reader().read(0, 4).copy()
+    # the user matrix has the genes in reverse order
+    counts = pd.DataFrame(block[:, ::-1], index = ["a", "b", "c", "d"], columns = te.gene_index[::-1])
+    expression_profile = Expression_profile(te.gene_index, te.projection)
+    condition_counts = expression_profile.aggregate(counts, groups = {"a": "A", "b": "B", "c": "B", "d": "D"}, batch_size = 3)
+    assert list(condition_counts.index) == ["A", "B", "D"]
+    assert np.allclose(condition_counts.loc["B"].values, block[1:3].mean(axis = 0).astype(np.float16), rtol = 1e-3)
+    embeddings = expression_profile.embed(condition_counts)
+    assert np.allclose(embeddings[[0, 2]], db.obsm["embedding"][[0, 3]], rtol = 1e-2, atol = 1e-2)
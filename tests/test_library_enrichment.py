@@ -0,0 +1,26 @@
+import numpy as np
+from scipy.stats import hypergeom
+from sample_explorer.library_enrichment import Gene_set_library
+
+test_geneset =  ["IDI1", "SP100","KLF6", "PLPP1", "NEO1", "TSPAN6"]
+
+def test_hypergeometric_sf_matches_scipy():
+    k, m, n = np.meshgrid(np.arange(0, 60), [5, 50, 400], [10, 300, 2000], indexing = "ij")
+    pvals = Gene_set_library.hypergeometric_sf(k, 20000, m, n)
+    assert np.allclose(pvals, hypergeom.sf(k - 1, 20000, m, n), rtol = 1e-8, atol = 1e-300)
+
+def test_library_enrichment(tmp_path):
+    gmt_path = tmp_path / "library.gmt"
+    background = [f"GENE{i}" for i in range(100)]
+    gmt_path.write_text(
+        "TEST\tlink\t" + "\t".join(test_geneset) + "\nBACKGROUND\tlink\t" + "\t".join(background + test_geneset[:1]) + "\n"
+    )
+    library = Gene_set_library(str(gmt_path))
+    results = library.enrich_many({"query": test_geneset[:3] + ["NOT_A_GENE"], "other": background[:10]}, return_genes = True)
+    res = results["query"]
+    assert list(res["Term"]) == ["TEST", "BACKGROUND"]
+    assert res.loc[0, "Overlap"] == "3/6" and res.loc[0, "Genes"] == "IDI1;SP100;KLF6"
+    assert np.isclose(res.loc[0, "P-value"], hypergeom.sf(2, 106, 6, 3))
+    assert list(results["other"]["Term"]) == ["BACKGROUND"]
+    assert library.enrich_many({}) == {}
+    assert library.queries_to_matrix({}).shape == (0, len(library.genes))
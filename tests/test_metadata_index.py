@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+from sample_explorer.metadata_index import Metadata_index
+
+obs = pd.DataFrame({
+    "series_id": ["GSE1", "GSE1", "GSE2", "GSE3"],
+    "characteristics_ch1": ["tissue: liver", "cell line: HepG2", None, "tissue: Liver tumour"],
+})
+metadata_index = Metadata_index(obs)
+
+def test_contains_is_case_insensitive():
+    assert list(metadata_index.filter_positions([("characteristics_ch1", "contains", "liver")])) == [0, 3]
+
+def test_missing_values_only_match_negated_predicates():
+    assert list(metadata_index.filter_positions([("characteristics_ch1", "not contains", "cell line")])) == [0, 2, 3]
+
+def test_predicates_are_combined():
+    predicates = [("series_id", "in", ["GSE1", "GSE3"]), ("series_id", "!=", "GSE3")]
+    assert np.array_equal(metadata_index.filter_positions(predicates), [0, 1])
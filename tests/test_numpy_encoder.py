@@ -0,0 +1,54 @@
+import json
+import numpy as np
+import pytest
+from sample_explorer.numpy_encoder import Numpy_encoder
+
+
+def write_random_weights(weights_path, int8 = False, n_layers = 2, n_features = 32, n_heads = 4):
+    rng = np.random.default_rng(0)
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "cardiac", "myo", "##cytes", ",", "heart", "cafe", "!"]
+    shapes = {"embeddings.word_embeddings": (len(vocab), n_features), "embeddings.position_embeddings": (16, n_features),
+              "embeddings.token_type_embeddings": (2, n_features)}
+    for i in range(n_layers):
+        for name in ("attention.self.query", "attention.self.key", "attention.self.value", "attention.output.dense"):
+            shapes[f"encoder.layer.{i}.{name}"] = (n_features, n_features)
+        shapes[f"encoder.layer.{i}.intermediate.dense"] = (4 * n_features, n_features)
+        shapes[f"encoder.layer.{i}.output.dense"] = (n_features, 4 * n_features)
+    arrays = {}
+    for name, shape in shapes.items():
+        arrays[name + ".weight"] = rng.normal(size = shape).astype(np.float32) / np.sqrt(shape[1])
+        if name.startswith("encoder."):
+            arrays[name + ".bias"] = rng.normal(size = shape[0]).astype(np.float32) / 10
+        if int8 and "position" not in name and "token_type" not in name:
+            arrays[name + ".weight"], arrays[name + ".weight.scale"] = Numpy_encoder.quantize(arrays[name + ".weight"])
+    for name in ["embeddings.LayerNorm"] + [f"encoder.layer.{i}.{norm}" for i in range(n_layers) for norm in ("attention.output.LayerNorm", "output.LayerNorm")]:
+        arrays[name + ".weight"], arrays[name + ".bias"] = np.ones(n_features, np.float32), np.zeros(n_features, np.float32)
+    config = {"n_layers": n_layers, "n_heads": n_heads, "layer_norm_eps": 1e-12, "max_seq_length": 16, "do_lower_case": True}
+    np.savez(weights_path, config = np.array(json.dumps(config)), vocab = np.array(vocab), **arrays)
+
+def test_tokenize_and_pad(tmp_path):
+    write_random_weights(str(tmp_path / "weights.npz"))
+    encoder = Numpy_encoder(str(tmp_path / "weights.npz"))
+    assert encoder.split_words("Cardiac\tMyocytes, café!\x00") == ["cardiac", "myocytes", ",", "cafe", "!"]
+    input_ids, attention_mask = encoder.tokenize(["Cardiac myocytes", "heart"])
+    assert input_ids.tolist() == [[2, 4, 5, 6, 3], [2, 8, 3, 0, 0]]
+    assert attention_mask.sum(axis = 1).tolist() == [5, 3]
+    # padding does not change the embeddings
+    embeddings = encoder.encode(["heart", "cardiac myocytes, heart!"])
+    assert np.allclose(embeddings[0], encoder.encode("heart"), atol = 1e-5)
+
+def test_int8_weights_match_float_weights(tmp_path):
+    write_random_weights(str(tmp_path / "weights.npz"))
+    write_random_weights(str(tmp_path / "weights_int8.npz"), int8 = True)
+    texts = ["cardiac myocytes", "heart, cafe!"]
+    embeddings = Numpy_encoder(str(tmp_path / "weights.npz")).encode(texts)
+    int8_embeddings = Numpy_encoder(str(tmp_path / "weights_int8.npz")).encode(texts)
+    cosine = (embeddings * int8_embeddings).sum(axis = 1) / np.linalg.norm(embeddings, axis = 1) / np.linalg.norm(int8_embeddings, axis = 1)
+    assert cosine.min() > 0.999
+
+def test_matches_sentence_transformer(tmp_path):
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+    Numpy_encoder.export("paraphrase-MiniLM-L6-v2", str(tmp_path / "minilm.npz"))
+    texts = ["Trans-chromosomal regulation lincRNA", "studies with cardiac myocytes, in mice!"]
+    expected = sentence_transformers.SentenceTransformer("paraphrase-MiniLM-L6-v2").encode(texts)
+    assert np.allclose(Numpy_encoder(str(tmp_path / "minilm.npz")).encode(texts), expected, atol = 1e-4)
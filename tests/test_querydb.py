@@ -1,3 +1,4 @@
+import pytest
 
 
 from sample_explorer.sample_explorer import Query_DB
@@ -155,4 +156,85 @@ def test_expansion_semantic_zero_values():
                           search = "semantic", expand = "semantic", perform_enrichment=False, \
                             n_seed = 14, n_expansion = 0)
     
-    assert res.seed_studies.equals(res2.seed_studies)
\ No newline at end of file
+    assert res.seed_studies.equals(res2.seed_studies)
+
+def test_transcriptome_search_per_series():
+    _, series_of_interest = new_query_db.transcriptome_search(test_geneset, nsamples = 10, per_series = True)
+    assert len(series_of_interest) == 10
+    assert series_of_interest.is_unique
+
+def test_transcriptome_search_many():
+    results = new_query_db.transcriptome_search_many({"test": test_geneset}, nsamples = 10)
+    assert results["test"][0].equals(new_query_db.transcriptome_search(test_geneset, nsamples = 10)[0])
+    scores = new_query_db.transcriptome_search_many({"test": test_geneset}, return_scores = True)
+    assert scores.shape == (2000, 1)
+
+def test_progressive_transcriptome_search_completes_to_exact():
+    *_, (res_df, series, progress) = new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10, batch_size = 100, patience = None)
+    assert progress["status"] == "complete" and progress["recall_low"] == 1.0
+    assert res_df.equals(new_query_db.transcriptome_search(test_geneset, nsamples = 10)[0])
+
+def test_transcriptome_search_progressive_mode():
+    *_, (res_df, series, progress) = new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10)
+    assert new_query_db.transcriptome_search(test_geneset, nsamples = 10, mode = "progressive")[0].equals(res_df)
+
+def test_progressive_transcriptome_search_resumes(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.npz")
+    search = new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10, batch_size = 100, n_strata = 5, patience = None, checkpoint_path = checkpoint)
+    next(search)
+    search.close()
+    resumed = list(new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10, batch_size = 100, n_strata = 5, patience = None, checkpoint_path = checkpoint))
+    assert resumed[0][2]["rounds"] == 2
+    assert resumed[-1][0].equals(new_query_db.transcriptome_search(test_geneset, nsamples = 10)[0])
+
+def test_progressive_transcriptome_search_refuses_other_store(tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "checkpoint.npz")
+    search = new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10, batch_size = 100, n_strata = 5, patience = None, checkpoint_path = checkpoint)
+    next(search)
+    search.close()
+    monkeypatch.setattr(new_query_db, "transcriptome_fingerprint", "rebuilt")
+    with pytest.raises(ValueError):
+        next(new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10, batch_size = 100, n_strata = 5, patience = None, checkpoint_path = checkpoint))
+
+def test_search_cache_keys_follow_the_scoring_inputs(tmp_path, monkeypatch):
+    cached_query_db = Query_DB("tests/test_semantic_db.h5ad", "tests/test_transcriptome_db.h5ad", cache_path = str(tmp_path / "cache.sqlite"))
+    cached_query_db.transcriptome_search(test_geneset, nsamples = 10, method = "decoupler")
+    cached_query_db.transcriptome_search(test_geneset, nsamples = 10, method = "decoupler")
+    assert (cached_query_db.search_cache.hits, cached_query_db.search_cache.misses) == (1, 1)
+    monkeypatch.setitem(cached_query_db.execution_profile.batch_sizes, "decoupler", 250)
+    cached_query_db.transcriptome_search(test_geneset, nsamples = 10, method = "decoupler")
+    assert cached_query_db.search_cache.misses == 2
+    cached_query_db.transcriptome_search(test_geneset, nsamples = 10, method = "native")
+    monkeypatch.setattr(cached_query_db, "top_gene_index_fingerprint", "rebuilt")
+    cached_query_db.transcriptome_search(test_geneset, nsamples = 10, method = "native")
+    assert cached_query_db.search_cache.misses == 3
+
+def test_searches_refuse_stores_without_search(monkeypatch):
+    monkeypatch.setattr(new_query_db, "transcriptome_search_possible", False)
+    with pytest.raises(RuntimeError):
+        new_query_db.transcriptome_search_many({"test": test_geneset}, nsamples = 10)
+    with pytest.raises(RuntimeError):
+        next(new_query_db.progressive_transcriptome_search(test_geneset, nsamples = 10))
+
+def test_semantically_prefiltered_transcriptome_search():
+    _, relevant_series = new_query_db.semantic_search("Trans-chromosomal regulation lincRNA", k = 20)
+    res_df, series_of_interest = new_query_db.semantically_prefiltered_transcriptome_search(test_geneset, "Trans-chromosomal regulation lincRNA", nsamples = 10, n_series = 20)
+    assert series_of_interest.isin(relevant_series).all()
+
+def test_prefiltered_search_requires_both_queries():
+    with pytest.raises(ValueError):
+        new_query_db.search(None, "Trans-chromosomal regulation lincRNA", search = "prefiltered")
+    with pytest.raises(ValueError):
+        new_query_db.search(test_geneset, None, search = "prefiltered")
+
+def test_transcriptome_search_filters():
+    series = new_query_db.transcriptome_embedding.embeddings_index["series_id"].iloc[0]
+    res_df, series_of_interest = new_query_db.transcriptome_search(test_geneset, nsamples = 10, filters = [("series_id", "!=", series)])
+    assert len(res_df) == 10
+    assert (series_of_interest != series).all()
+
+def test_signature_search():
+    res_df, _ = new_query_db.signature_search(up_genes = test_geneset[:3], down_genes = test_geneset[3:], nsamples = 10)
+    assert len(res_df) == 10
+    results = new_query_db.signature_search_many({"test": {"up": test_geneset[:3], "down": test_geneset[3:]}}, nsamples = 10)
+    assert results["test"][0].equals(res_df)
@@ -2,7 +2,11 @@
 
 
 from sample_explorer.rag_embedding import Rag_embedding
+from sample_explorer.ann_index import Hnsw_index
+from sample_explorer.sentence_encoder import Sentence_encoder
 import anndata as ad
+import numpy as np
+import pytest
 
 x = ad.read_h5ad("tests/test_semantic_db.h5ad")
 
@@ -22,10 +26,48 @@ def test_rag_sem_df_size():
     df = rag_embedding.get_closest_semantic_studies('GSE44615,GSE44616', 7)
     assert df.shape == (7, 4)
 
+def test_closest_semantic_studies_of_unknown_series():
+    with pytest.raises(IndexError):
+        rag_embedding.get_closest_semantic_studies("GSE0", 7)
+
 def test_query_rag():
     df = rag_embedding.query_rag("Trans-chromosomal regulation lincRNA")
     assert df.iloc[0, 1] == "GSE45157"
 
 def test_average_embeddings():
     res = rag_embedding.get_averages_between_queries("test_query", ["test_query", "test_query"])
-    assert round(res) == 1.0
\ No newline at end of file
+    assert round(res) == 1.0
+
+
+def test_query_rag_with_ann_index():
+    ann_rag_embedding = Rag_embedding(x.obs, x.X, Hnsw_index.build(x.X))
+    df = ann_rag_embedding.query_rag("Trans-chromosomal regulation lincRNA")
+    exact_df = ann_rag_embedding.query_rag("Trans-chromosomal regulation lincRNA", exact = True)
+    assert df.iloc[0, 1] == "GSE45157"
+    assert df["gse_id"].to_list() == exact_df["gse_id"].to_list()
+
+def test_get_top_k():
+    scores = rag_embedding.normalized_matrix @ rag_embedding.normalized_matrix[3]
+    assert rag_embedding.get_top_k(scores, 5).tolist() == np.argsort(-scores, kind = "stable")[:5].tolist()
+    assert rag_embedding.get_top_k(scores, 500).tolist() == np.argsort(-scores, kind = "stable").tolist()
+
+def test_get_texts_linked_to_gse():
+    gse_ids = [rag_embedding.get_gse_from_rag_index(i) for i in (3, 5, 3)]
+    texts = rag_embedding.get_texts_linked_to_gse(gse_ids)
+    assert list(texts) == [rag_embedding.get_text_linked_to_gse(i) for i in gse_ids]
+    assert list(rag_embedding.get_series_rows(gse_ids[0])) == list(np.flatnonzero(x.obs["series_id"] == gse_ids[0]))
+
+def test_query_rag_many():
+    queries = ["Trans-chromosomal regulation lincRNA", "T cell exhaustion in tumours"]
+    results = rag_embedding.query_rag_many(queries, k = 5, max_bytes = 1000)
+    assert list(results) == queries
+    assert results[queries[0]].iloc[0, 1] == "GSE45157"
+    assert results[queries[1]]["gse_id"].to_list() == rag_embedding.query_rag(queries[1])["gse_id"].to_list()
+    assert rag_embedding.query_rag_many([]) == {}
+
+def test_encoder_is_loaded_once_and_lazily():
+    unloaded_rag_embedding = Rag_embedding(x.obs, x.X, model_name_or_path = "model-which-is-never-loaded")
+    assert "model-which-is-never-loaded" not in Sentence_encoder.models
+    rag_embedding.query_rag("lincRNA")
+    assert Sentence_encoder().get_model() is rag_embedding.model.get_model()
+    assert unloaded_rag_embedding.get_closest_semantic_studies('GSE44615,GSE44616', 7).shape == (7, 4)
@@ -0,0 +1,34 @@
+import numpy as np
+from sample_explorer.search_cache import Search_cache
+
+
+def test_key_ignores_gene_order():
+    key = Search_cache.make_key(geneset=["IDI1", "SP100", "KLF6"], nsamples=10)
+    assert key == Search_cache.make_key(geneset=["KLF6", "IDI1", "SP100", "IDI1"], nsamples=10)
+    assert key != Search_cache.make_key(geneset=["IDI1", "SP100", "KLF6"], nsamples=20)
+
+def test_cache_roundtrip(tmp_path):
+    cache = Search_cache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("query") is None
+    cache.put("query", np.arange(10))
+    assert np.array_equal(Search_cache(str(tmp_path / "cache.sqlite")).get("query"), np.arange(10))
+    assert (cache.hits, cache.misses) == (0, 1)
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = Search_cache(str(tmp_path / "cache.sqlite"), max_bytes=160)
+    cache.put("first", np.arange(10))
+    cache.put("second", np.arange(10))
+    cache.get("first")
+    cache.put("third", np.arange(10))
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+
+def test_tables_have_separate_budgets(tmp_path):
+    results = Search_cache(str(tmp_path / "cache.sqlite"), max_bytes=160)
+    embeddings = Search_cache(str(tmp_path / "cache.sqlite"), max_bytes=160, table="embeddings")
+    results.put("query", np.arange(10))
+    for i in range(5):
+        embeddings.put(f"text {i}", np.arange(10))
+    assert results.get("query") is not None
+    assert embeddings.get("query") is None
+    assert embeddings.get("text 0") is None and embeddings.get("text 4") is not None
@@ -1,5 +1,6 @@
 
 import anndata as ad
+import numpy as np
 from sample_explorer.sample_explorer import Transcriptome_enrichment
 
 
@@ -28,4 +29,28 @@ def test_gene_list_creation_for_anndata():
     gene_df = te.list_to_dc_geneset(test_geneset)
     # Replace 'path_to_dataframe' with the actual path to the dataframe produced by your code
 
-    assert gene_df.shape == (len(test_geneset), 2)  # Replace (1000, 2) with the expected shape of the dataframe
\ No newline at end of file
+    assert gene_df.shape == (len(test_geneset), 2)  # Replace (1000, 2) with the expected shape of the dataframe
+
+
+def test_native_ora_shape():
+    dataframe = te.run_native_ora(test_geneset)
+    assert dataframe.shape == (2000, 3)
+
+def test_native_ora_geneset_mask():
+    mask = te.geneset_to_mask(test_geneset)
+    assert mask.sum() == len(test_geneset)
+
+def test_native_ora_workers():
+    dataframe = te.run_native_ora(test_geneset, workers = 2)
+    assert dataframe.equals(te.run_native_ora(test_geneset))
+
+def test_decoupler_on_rows():
+    samples_list = te.memmap_adata.obs.head(200).index
+    dataframe = te.run_decouplr_on_rows(test_geneset, 0, 200)
+    assert dataframe.equals(te.run_decouplr_on_memmaped_adata_with_samples(test_geneset, samples_list))
+
+def test_native_ora_many():
+    genesets = {"test": test_geneset, "subset": test_geneset[:3]}
+    start, stop, pvals = next(te.iter_native_ora_pvals_many(genesets))
+    assert pvals.shape == (stop - start, 2)
+    assert np.allclose(pvals[:, 1], te.run_native_ora(test_geneset[:3])["pvals"].values[start:stop])
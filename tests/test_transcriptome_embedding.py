@@ -28,3 +28,14 @@ def test_calculate_interpoint_distance_for_samples():
     assert res == "5.26e+07"
 
 
+
+def test_get_closest_conditions_by_embedding():
+    positions, similarities = x1.get_closest_conditions_by_embedding(x.obsm["embedding"][[0, 10]], k = 5, batch_size = 100)
+    assert positions.shape == (2, 5)
+    assert list(positions[:, 0]) == [0, 10]
+    assert (similarities[:, :-1] >= similarities[:, 1:]).all()
+
+def test_get_closest_conditions_with_small_blocks():
+    positions, _ = x1.get_closest_conditions_by_embedding(x.obsm["embedding"][[0, 10]], k = 10, batch_size = 4)
+    exact, _ = x1.get_closest_conditions_by_embedding(x.obsm["embedding"][[0, 10]], k = 10)
+    assert (positions == exact).all()
@@ -4,7 +4,7 @@ import logging
 import traceback
 from io import StringIO
 from sample_explorer.sample_explorer import RNASeqAnalysis
-from sample_explorer.utils import MsigDB_store, ARCHS4_API_query
+from sample_explorer.utils import MsigDB_store, Local_signature_query
 
 #Initialize logging with a StringIO buffer
 log_buffer = StringIO()
@@ -18,13 +18,18 @@ logging.basicConfig(
 # Initialize stores and analysis objects
 data_source = "data/"
 msigdb_store = MsigDB_store(data_source + "msigdb.v2023.2.Hs.symbols.gmt", data_source + "test_set_misgdb.csv")
-archquery = ARCHS4_API_query(data_source + "whole_metadata_human.p")
+# signatures are scored against the local transcriptomic db, in one pass for all gene sets
+# ARCHS4_API_query queries the remote ARCHS4 signature API instead, one request per gene set
+archquery = Local_signature_query(data_source + "whole_metadata_human.p", data_source + "transcriptomic_db.h5ad")
 rna_seq_analysis = RNASeqAnalysis(data_source + "human_gene_v2.2.h5")
 
 # Filter gene sets containing "UP"
 filtered_gene_sets = pd.read_csv("archs4/test_data/test_gene_sets.txt", header = None)[0].to_list()
 #filtered_gene_sets = [gene_set for gene_set in msigdb_store.list_genesets() if "UP" in gene_set]
 
+gene_sets = {gene_set_name: msigdb_store.get_gene_set_by_name(gene_set_name)["geneset"] for gene_set_name in filtered_gene_sets}
+samples_per_gene_set = archquery.extract_sigs("up", gene_sets)
+
 # Define output directory and ensure it exists
 output_dir = "tempfiles/arch_enrichment/" # i will swtich this to arch_int_3
 os.makedirs(output_dir, exist_ok=True)
@@ -35,11 +40,9 @@ for gene_set_name in filtered_gene_sets:
         # Generate the filename for the output
         output_file = os.path.join(output_dir, f"{gene_set_name}.csv")
 
-        # Retrieve the gene set and associated genes
-        gene_set = msigdb_store.get_gene_set_by_name(gene_set_name)["geneset"]
-
-        # Query relevant series and samples
-        _, samples = archquery.return_relevant_series_and_samples("up", gene_set)
+        # Retrieve the gene set and the samples matching it
+        gene_set = gene_sets[gene_set_name]
+        samples = samples_per_gene_set[gene_set_name]
 
         # Perform enrichment analysis on the samples
         enrichment_results = rna_seq_analysis.perform_enrichment_on_samples(samples, gene_set)
@@ -1,18 +1,17 @@
 import os
-import time
 import traceback
-import gseapy as gp
 from io import StringIO
 from sample_explorer.utils import MsigDB_store
+from sample_explorer.library_enrichment import Gene_set_library
 import pandas as pd
 
 
 # This script performs the following tasks:
 # 1. Loads gene sets from MsigDB and filters for those containing "UP"
-# 2. Retrieves Enrichr results for each filtered gene set using the RNAseq_Automatic_GEO_Signatures_Human_Up database
-# 3. Saves the Enrichr results for each gene set as a pickle file
+# 2. Computes Enrichr results for all filtered gene sets at once against a local copy of the
+#    RNAseq_Automatic_GEO_Signatures_Human_Up library, without calling the Enrichr API
+# 3. Saves the Enrichr results for each gene set as a csv file
 # 4. Implements error handling and logging for robustness
-# 5. Uses rate limiting to avoid overloading the Enrichr server
 
 
 # Initialize the MsigDB store
@@ -30,29 +29,19 @@ os.makedirs(output_dir, exist_ok=True)
 # Initialize a StringIO buffer to accumulate log messages
 log_buffer = StringIO()
 
-def get_enrichr_result(gene_list):
-    """
-    Function to retrieve Enrichr results for a given gene list.
-    """
-    enrichment_result = gp.enrichr(
-        gene_list=gene_list,
-        gene_sets=['RNAseq_Automatic_GEO_Signatures_Human_Up'],
-        organism='human',  # Set organism to human
-        outdir=None  # Do not write results to disk
-    )
-    return enrichment_result.res2d
+# Load the library as a sparse gene by term matrix
+# (download from https://maayanlab.cloud/Enrichr/geneSetLibrary?mode=text&libraryName=RNAseq_Automatic_GEO_Signatures_Human_Up)
+library = Gene_set_library("data/RNAseq_Automatic_GEO_Signatures_Human_Up.gmt")
+
+# Retrieve the gene sets from the MsigDB store and enrich them all in one pass
+gene_sets = {gene_set_name: msigdb_store.get_gene_set_by_name(gene_set_name)["geneset"] for gene_set_name in filtered_gene_sets}
+all_enrichr_results = library.enrich_many(gene_sets, return_genes=True)
 
 # Process each gene set
 for gene_set_name in filtered_gene_sets:
     try:
-        # Introduce a delay to avoid overloading the server
-        time.sleep(1)
-
-        # Retrieve the gene set from the MsigDB store
-        gene_set = msigdb_store.get_gene_set_by_name(gene_set_name)["geneset"]
-
         # Get Enrichr results for the gene set
-        enrichr_results = get_enrichr_result(gene_set)
+        enrichr_results = all_enrichr_results[gene_set_name]
 
         # Define the output filename
         output_file = os.path.join(output_dir, f"{gene_set_name}.csv")
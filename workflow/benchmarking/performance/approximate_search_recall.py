@@ -0,0 +1,48 @@
+import argparse
+import time
+import pandas as pd
+from sample_explorer.sample_explorer import Query_DB
+from sample_explorer.utils import MsigDB_store
+
+# measures recall@k of approximate transcriptome search against exact search, over the MSigDB test gene sets
+# requires a transcriptomic_db.h5ad with a projection matrix (varm["projection"]), see Transcriptome_db_builder.add_projection
+
+def main():
+    parser = argparse.ArgumentParser(description='Approximate transcriptome search recall benchmark')
+    parser.add_argument('--transcriptome_db', type=str, help='Path to the transcriptome database')
+    parser.add_argument('--semantic_db', type=str, help='Path to the vector database')
+    parser.add_argument('--msigdb', type=str, default='data/msigdb.v2023.2.Hs.symbols.gmt', help='Path to the MSigDB gmt file')
+    parser.add_argument('--msigdb_metadata', type=str, default='data/test_set_misgdb.csv', help='Path to the MSigDB metadata csv')
+    parser.add_argument('--gene_sets', type=str, default='gene_sets/test_gene_sets.txt', help='Path to the list of gene set names')
+    parser.add_argument('--nsamples', type=int, default=1000, help='Number of conditions retrieved (k)')
+    parser.add_argument('--n_candidates', type=int, nargs='+', default=[2000, 5000, 10000], help='Shortlist sizes to test')
+    parser.add_argument('--output', type=str, default='approximate_search_recall.csv', help='Path to the output csv')
+    args = parser.parse_args()
+
+    query_db = Query_DB(args.semantic_db, args.transcriptome_db)
+    msigdb_store = MsigDB_store(args.msigdb, args.msigdb_metadata)
+    gene_set_names = pd.read_csv(args.gene_sets, header=None)[0].to_list()
+
+    results = []
+    for name in gene_set_names:
+        geneset = msigdb_store.get_gene_set_by_name(name)["geneset"]
+        start = time.perf_counter()
+        exact, _ = query_db.transcriptome_search(geneset, nsamples=args.nsamples)
+        exact_seconds = time.perf_counter() - start
+        for n_candidates in args.n_candidates:
+            start = time.perf_counter()
+            approximate, _ = query_db.transcriptome_search(geneset, nsamples=args.nsamples, mode="approximate", n_candidates=n_candidates)
+            results.append({
+                "gene_set": name,
+                "n_candidates": n_candidates,
+                "recall_at_k": len(exact.index.intersection(approximate.index)) / len(exact),
+                "exact_seconds": exact_seconds,
+                "approximate_seconds": time.perf_counter() - start,
+            })
+
+    df = pd.DataFrame(results)
+    print(df.groupby("n_candidates")[["recall_at_k", "exact_seconds", "approximate_seconds"]].mean().to_string())
+    df.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import multiprocessing
+import resource
+import time
+import anndata as ad
+import numpy as np
+import pandas as pd
+from sample_explorer.enrichment import Transcriptome_enrichment
+
+# compares the batch reader used before the positional reader (sample lookup, to_memory, per-batch cleaning)
+# with the positional reader, for peak RSS and rows per second
+# each reader runs in a fresh process, so that peak RSS is measured independently
+
+def read_by_samples(te, start, stop):
+    adata = te.memmap_adata
+    samples_list = adata.obs.index[start:stop]
+    query_adata = adata[adata.obs.index.isin(samples_list)].to_memory()
+    query_adata.var_names_make_unique()
+    np.nan_to_num(query_adata.X, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    return query_adata.X
+
+def read_by_position(te, start, stop):
+    return te.get_block_reader().read(start, stop)
+
+readers = {"samples": read_by_samples, "positional": read_by_position}
+
+def run_reader(name, transcriptome_db, n_rows, batch_size, queue):
+    te = Transcriptome_enrichment(ad.read_h5ad(transcriptome_db, backed="r"))
+    n_rows = min(n_rows, te.memmap_adata.n_obs)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.perf_counter()
+    for start in range(0, n_rows, batch_size):
+        readers[name](te, start, min(start + batch_size, n_rows))
+    seconds = time.perf_counter() - start_time
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({"reader": name, "rows_per_second": n_rows / seconds,
+               "peak_rss_mb": peak / 1024, "peak_rss_above_load_mb": (peak - baseline) / 1024})
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcriptome batch reader benchmark')
+    parser.add_argument('--transcriptome_db', type=str, help='Path to the transcriptome database')
+    parser.add_argument('--n_rows', type=int, default=20000, help='Number of rows to read')
+    parser.add_argument('--batch_size', type=int, default=500, help='Number of rows per batch')
+    parser.add_argument('--output', type=str, default='batch_reader_benchmark.csv', help='Path to the output csv')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    results = []
+    for name in readers:
+        process = context.Process(target=run_reader, args=(name, args.transcriptome_db, args.n_rows, args.batch_size, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    df = pd.DataFrame(results)
+    print(df.to_string(index=False))
+    df.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
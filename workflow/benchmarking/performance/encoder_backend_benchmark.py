@@ -0,0 +1,94 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+import numpy as np
+import pandas as pd
+
+# compares the torch sentence-transformers encoder with the NumPy encoder, on float32 and int8 weights,
+# for the time to import, to load the model and to encode the first query, the time per query, and peak RSS
+# each backend runs in a fresh process, so that import times and peak RSS are measured independently
+
+queries = [
+    "studies with cardiac myocytes",
+    "Trans-chromosomal regulation lincRNA",
+    "T cell exhaustion in chronic viral infection",
+    "single-cell RNA-seq of human pancreatic islets from type 2 diabetes donors",
+    "effect of hypoxia on glioblastoma stem cells",
+    "CRISPR knockout screen of interferon signalling genes in macrophages",
+    "liver fibrosis in mice fed a high-fat diet",
+    "Alzheimer's disease post-mortem brain tissue, prefrontal cortex",
+]
+
+def run_backend(name, model, n_repeats, queue):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.perf_counter()
+    if model.endswith(".npz"):
+        from sample_explorer.numpy_encoder import Numpy_encoder
+        import_seconds = time.perf_counter() - start_time
+        encoder = Numpy_encoder(model)
+    else:
+        from sentence_transformers import SentenceTransformer
+        import_seconds = time.perf_counter() - start_time
+        encoder = SentenceTransformer(model, device="cpu")
+    load_seconds = time.perf_counter() - start_time - import_seconds
+    encoder.encode(queries[:1])
+    startup_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for _ in range(n_repeats):
+        for query in queries:
+            encoder.encode([query])
+    query_seconds = (time.perf_counter() - start_time) / (n_repeats * len(queries))
+    embeddings = np.asarray(encoder.encode(queries), dtype=np.float32)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(({"backend": name, "import_seconds": import_seconds, "load_seconds": load_seconds,
+                "startup_seconds": startup_seconds, "ms_per_query": query_seconds * 1000,
+                "peak_rss_mb": peak / 1024, "peak_rss_above_python_mb": (peak - baseline) / 1024}, embeddings))
+
+def export_weights(model, weights_path, int8):
+    from sample_explorer.numpy_encoder import Numpy_encoder
+    Numpy_encoder.export(model, weights_path, int8=int8)
+
+def main():
+    parser = argparse.ArgumentParser(description='Sentence encoder backend benchmark')
+    parser.add_argument('--model', type=str, default='paraphrase-MiniLM-L6-v2', help='Name of the sentence model')
+    parser.add_argument('--weights', type=str, default='minilm.npz', help='Path to the exported float32 weights, exported if missing')
+    parser.add_argument('--int8_weights', type=str, default='minilm_int8.npz', help='Path to the exported int8 weights, exported if missing')
+    parser.add_argument('--n_repeats', type=int, default=10, help='Number of times each query is encoded')
+    parser.add_argument('--output', type=str, default='encoder_backend_benchmark.csv', help='Path to the output csv')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for weights_path, int8 in ((args.weights, False), (args.int8_weights, True)):
+        if not os.path.exists(weights_path):
+            process = context.Process(target=export_weights, args=(args.model, weights_path, int8))
+            process.start()
+            process.join()
+
+    backends = {"torch": args.model, "numpy": args.weights, "numpy_int8": args.int8_weights}
+    queue = context.Queue()
+    results, embeddings = [], {}
+    for name, model in backends.items():
+        process = context.Process(target=run_backend, args=(name, model, args.n_repeats, queue))
+        process.start()
+        result, embeddings[name] = queue.get()
+        process.join()
+        results.append(result)
+
+    # agreement of each backend with the torch embeddings
+    reference = embeddings["torch"]
+    for result in results:
+        backend = embeddings[result["backend"]]
+        cosine = (backend * reference).sum(axis=1) / (np.linalg.norm(backend, axis=1) * np.linalg.norm(reference, axis=1))
+        result["min_cosine_to_torch"] = cosine.min()
+        result["max_abs_difference_to_torch"] = np.abs(backend - reference).max()
+        model = backends[result["backend"]]
+        result["weights_mb"] = os.path.getsize(model) / 2**20 if model.endswith(".npz") else np.nan
+
+    df = pd.DataFrame(results)
+    print(df.to_string(index=False))
+    df.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
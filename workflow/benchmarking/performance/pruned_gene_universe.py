@@ -0,0 +1,57 @@
+import argparse
+import time
+import pandas as pd
+from sample_explorer.sample_explorer import Query_DB
+from sample_explorer.utils import MsigDB_store
+
+# measures the I/O saved by a pruned gene universe and how much transcriptome search results shift, over the MSigDB test gene sets
+# requires a transcriptomic_db_pruned.h5ad, see Transcriptome_db_builder.prune_genes
+
+def main():
+    parser = argparse.ArgumentParser(description='Pruned gene universe benchmark')
+    parser.add_argument('--transcriptome_db', type=str, help='Path to the full transcriptome database')
+    parser.add_argument('--pruned_transcriptome_db', type=str, help='Path to the pruned transcriptome database')
+    parser.add_argument('--semantic_db', type=str, help='Path to the vector database')
+    parser.add_argument('--msigdb', type=str, default='data/msigdb.v2023.2.Hs.symbols.gmt', help='Path to the MSigDB gmt file')
+    parser.add_argument('--msigdb_metadata', type=str, default='data/test_set_misgdb.csv', help='Path to the MSigDB metadata csv')
+    parser.add_argument('--gene_sets', type=str, default='gene_sets/test_gene_sets.txt', help='Path to the list of gene set names')
+    parser.add_argument('--nsamples', type=int, default=1000, help='Number of conditions retrieved (k)')
+    parser.add_argument('--method', type=str, default='native', help='ORA engine used on both databases')
+    parser.add_argument('--output', type=str, default='pruned_gene_universe.csv', help='Path to the output csv')
+    args = parser.parse_args()
+
+    full_db = Query_DB(args.semantic_db, args.transcriptome_db)
+    pruned_db = Query_DB(args.semantic_db, args.pruned_transcriptome_db)
+    gene_universe = pruned_db.transcriptome_enrichment.memmap_adata.uns["gene_universe"]
+    print(
+        f"Genes: {gene_universe['n_vars']} of {gene_universe['n_vars_full']}, "
+        f"bytes read per condition: {gene_universe['bytes_per_condition']} instead of {gene_universe['bytes_per_condition_full']} "
+        f"({1 - gene_universe['bytes_per_condition'] / gene_universe['bytes_per_condition_full']:.1%} less I/O)"
+    )
+    msigdb_store = MsigDB_store(args.msigdb, args.msigdb_metadata)
+    gene_set_names = pd.read_csv(args.gene_sets, header=None)[0].to_list()
+    pruned_genes = pruned_db.transcriptome_enrichment.gene_index
+
+    results = []
+    for name in gene_set_names:
+        geneset = msigdb_store.get_gene_set_by_name(name)["geneset"]
+        start = time.perf_counter()
+        full, _ = full_db.transcriptome_search(geneset, nsamples=args.nsamples, method=args.method)
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        pruned, _ = pruned_db.transcriptome_search(geneset, nsamples=args.nsamples, method=args.method)
+        pruned_seconds = time.perf_counter() - start
+        results.append({
+            "gene_set": name,
+            "genes_dropped": len(set(geneset) - set(pruned_genes)),
+            "overlap_at_k": len(full.index.intersection(pruned.index)) / len(full),
+            "full_seconds": full_seconds,
+            "pruned_seconds": pruned_seconds,
+        })
+
+    df = pd.DataFrame(results)
+    print(df[["genes_dropped", "overlap_at_k", "full_seconds", "pruned_seconds"]].mean().to_string())
+    df.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
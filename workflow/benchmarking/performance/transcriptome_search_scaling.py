@@ -0,0 +1,42 @@
+import argparse
+import os
+import time
+import anndata as ad
+import pandas as pd
+from sample_explorer.enrichment import Transcriptome_enrichment
+
+# measures the wall time of a native transcriptome search for an increasing number of worker processes
+# run on the full transcriptomic_db.h5ad, with --max_workers set to the number of physical cores
+
+test_geneset = "IFNG,IRF1,IRF2,STAT1,CXCL9,CXCL10,GBP1,GBP2,IDO1,TAP1"
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcriptome search scaling benchmark')
+    parser.add_argument('--transcriptome_db', type=str, help='Path to the transcriptome database')
+    parser.add_argument('--gene_list', type=str, default=test_geneset, help='Comma-separated gene list')
+    parser.add_argument('--max_workers', type=int, default=os.cpu_count(), help='Largest number of workers to test')
+    parser.add_argument('--output', type=str, default='transcriptome_search_scaling.csv', help='Path to the output csv')
+    args = parser.parse_args()
+
+    te = Transcriptome_enrichment(ad.read_h5ad(args.transcriptome_db, backed="r"))
+
+    workers_list = [1]
+    while workers_list[-1] * 2 <= args.max_workers:
+        workers_list.append(workers_list[-1] * 2)
+    if workers_list[-1] != args.max_workers:
+        workers_list.append(args.max_workers)
+
+    timings = []
+    for workers in workers_list:
+        start = time.perf_counter()
+        te.run_native_ora(args.gene_list.split(','), workers=workers)
+        timings.append({"workers": workers, "seconds": time.perf_counter() - start})
+
+    df = pd.DataFrame(timings)
+    df["speedup"] = df["seconds"].iloc[0] / df["seconds"]
+    df["efficiency"] = df["speedup"] / df["workers"]
+    print(df.to_string(index=False))
+    df.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -25,17 +25,23 @@ def load_rag_data():
         rag_embedding_matrix = pickle.load(f)
     return Rag_embedding(rag_index, rag_embedding_matrix)
 
-def process_gene_set(rag: Rag_embedding, msigdb_store: MsigDB_store, gene_set_name: str):
+def get_query_texts(msigdb_store: MsigDB_store, gene_set_names: List[str]) -> dict:
+    texts = {}
+    for gene_set_name in gene_set_names:
+        try:
+            texts[gene_set_name] = msigdb_store.get_gene_set_by_name(gene_set_name)["long_title"]
+        except Exception as e:
+            print(f"Failure: {gene_set_name}")
+            traceback.print_exc()
+    return texts
+
+def process_gene_sets(rag: Rag_embedding, msigdb_store: MsigDB_store, gene_set_names: List[str]):
     check_folder_existence()
-    try:
-        testset = msigdb_store.get_gene_set_by_name(gene_set_name)
-        test_text = testset["long_title"]
-        df_res = rag.query_rag(test_text, k=50)
+    # all the descriptions are encoded and compared with the studies in batches
+    results = rag.query_rag_many(get_query_texts(msigdb_store, gene_set_names), k=50)
+    for gene_set_name, df_res in results.items():
         savefile = os.path.join(TEMP_DIR, f"{gene_set_name}.csv")
         df_res.to_csv(savefile)
-    except Exception as e:
-        print(f"Failure: {gene_set_name}")
-        traceback.print_exc()
 
 def main():
     # Initialize data
@@ -43,8 +49,7 @@ def main():
     rag = load_rag_data()
     msigdb_store = MsigDB_store(f"{DATA_DIR}/msigdb.v2023.2.Hs.symbols.gmt", f"{DATA_DIR}/test_set_misgdb.csv")
 
-    for i in test_gene_sets:
-        process_gene_set(rag, msigdb_store, i)
+    process_gene_sets(rag, msigdb_store, test_gene_sets)
 
 
 if __name__ == "__main__":
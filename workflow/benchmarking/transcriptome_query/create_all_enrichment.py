@@ -3,6 +3,7 @@ import pandas as pd
 from sample_explorer.utils import MsigDB_store 
 from sample_explorer.sample_explorer import RNASeqAnalysis, Transcriptome_enrichment
 from sample_explorer.enrichment import Transcriptome_enrichment
+from sample_explorer.execution_profile import Execution_profile
 import traceback
 from typing import List
 import anndata as ad
@@ -43,7 +44,9 @@ for i in testset:
     res = msigdb_store.get_gene_set_by_name(i)
     dict_genes[i] = res["geneset"]
 
-user_batch_size = 250
+# block sizes tuned with `biorag tune`, if a profile exists; every gene set is scored against each block
+execution_profile = Execution_profile("data/execution_profile.json")
+user_batch_size = execution_profile.get_batch_size("decoupler", condition_matrix.n_vars, extra_bytes_per_row=24 * len(dict_genes), default=250)
 
 output_df1_list = []
 output_df2_list = []
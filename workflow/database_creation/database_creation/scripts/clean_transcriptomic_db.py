@@ -0,0 +1,7 @@
+from sample_explorer.database_build import Transcriptome_db_builder
+
+# replaces non-finite counts with zeros and makes gene names unique, once, at build time
+# the flags recorded in uns["preprocessing"] let searches skip these steps on every batch
+
+builder = Transcriptome_db_builder("results/transcriptomic_db.h5ad")
+builder.clean_matrix()
@@ -0,0 +1,7 @@
+from sample_explorer.database_build import Transcriptome_db_builder
+
+# writes the count matrix transposed (genes x conditions) to a companion store
+# gene profiles and gene panel scores then read only the requested genes
+
+builder = Transcriptome_db_builder("results/transcriptomic_db.h5ad")
+builder.write_gene_major_store("results/transcriptomic_db_genes.h5")
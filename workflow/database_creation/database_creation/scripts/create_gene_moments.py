@@ -0,0 +1,7 @@
+from sample_explorer.database_build import Transcriptome_db_builder
+
+# stores the mean and standard deviation of the log CPM of every gene (varm["log_cpm_moments"])
+# signature search then standardizes genes without a first pass over the count matrix
+
+builder = Transcriptome_db_builder("results/transcriptomic_db.h5ad")
+builder.add_gene_moments()
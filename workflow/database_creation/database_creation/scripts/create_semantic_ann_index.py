@@ -0,0 +1,9 @@
+import anndata as ad
+from sample_explorer.ann_index import Hnsw_index
+
+# builds the HNSW graph of the semantic embeddings, stored next to the semantic database (semantic_db.hnsw.npz)
+# Query_DB loads it automatically, and semantic search then explores the graph instead of every study
+
+sem_obj = ad.read_h5ad("results/semantic_db.h5ad", backed="r")
+index = Hnsw_index.build(sem_obj.X[:])
+index.save(Hnsw_index.index_path("results/semantic_db.h5ad"))
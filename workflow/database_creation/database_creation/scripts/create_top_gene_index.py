@@ -0,0 +1,7 @@
+from sample_explorer.database_build import Transcriptome_db_builder
+
+# stores the top expressed genes of each condition as a packed bitset (results/transcriptomic_db.top_genes.h5)
+# transcriptome search then scores gene sets without reading the count matrix
+
+builder = Transcriptome_db_builder("results/transcriptomic_db.h5ad")
+builder.add_top_gene_index()
@@ -22,5 +22,11 @@ with open("results/transcription_embedding_matrix_v2.pkl", 'rb') as file:
     embedding_matrix = pickle.load(file) 
 
 adata.obsm["embedding"] = embedding_matrix
+
+with open("results/jl_projection_v2.pkl", 'rb') as file:
+    projection_matrix = pickle.load(file)
+
+# genes x components, so that conditions are embedded as X @ projection
+adata.varm["projection"] = projection_matrix.T
 adata.write('results/transcriptomic_db.h5ad')
 
@@ -22,4 +22,9 @@ pickle_file_path = "results/matrix_v2.pkl"
 
 # Save the NumPy matrix using pickle
 with open(pickle_file_path, 'wb') as file:
-    pickle.dump(X_new, file)
\ No newline at end of file
+    pickle.dump(X_new, file)
+
+# the projection is stored in the transcriptomic db (varm["projection"]) for approximate transcriptome search,
+# which projects gene sets into the same space as the conditions
+with open("results/jl_projection_v2.pkl", 'wb') as file:
+    pickle.dump(transformer.components_.astype(np.float32), file)
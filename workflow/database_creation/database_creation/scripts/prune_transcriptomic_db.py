@@ -0,0 +1,14 @@
+from sample_explorer.database_build import Transcriptome_db_builder
+
+# writes a copy of the transcriptomic db without the genes which are almost never expressed
+# ORA keeps the number of top genes of the full gene universe, recorded in uns["gene_universe"]
+
+min_expression = 1
+min_prevalence = 0.01
+
+builder = Transcriptome_db_builder("results/transcriptomic_db.h5ad")
+gene_universe = builder.prune_genes("results/transcriptomic_db_pruned.h5ad", min_expression, min_prevalence)
+print(
+    f"Kept {gene_universe['n_vars']} of {gene_universe['n_vars_full']} genes, "
+    f"{gene_universe['bytes_per_condition']} instead of {gene_universe['bytes_per_condition_full']} bytes read per condition"
+)